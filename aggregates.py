@@ -0,0 +1,56 @@
+from datetime import datetime
+from sqlalchemy import func
+from models import db, Venue, Artist, Show
+
+#----------------------------------------------------------------------------#
+# Show count aggregates.
+#
+# Every page that shows "n upcoming shows" reads it from here, so the counts
+# come back as one row per venue/artist instead of one row per show.
+#----------------------------------------------------------------------------#
+
+# the show column that points at each entity
+SHOW_FOREIGN_KEYS = {
+    Venue: Show.venue_id,
+    Artist: Show.artist_id,
+}
+
+
+def show_counts(model, ids=None):
+    # grouped subquery: (entity_id, num_upcoming_shows, num_past_shows)
+    foreign_key = SHOW_FOREIGN_KEYS[model]
+    now = datetime.now()
+    query = db.session.query(
+        foreign_key.label('entity_id'),
+        func.count().filter(Show.start_time > now).label('num_upcoming_shows'),
+        func.count().filter(Show.start_time <= now).label('num_past_shows'),
+    )
+    if ids is not None:
+        query = query.filter(foreign_key.in_(ids))
+    if model is Artist:
+        # shows at archived venues are hidden everywhere (removal.py). The
+        # ORM filter only sees statements that select a Venue, and the async
+        # path runs outside the ORM, so they are dropped here.
+        query = query.join(Venue, Venue.id == Show.venue_id).filter(Venue.deleted_at.is_(None))
+    return query.group_by(foreign_key).subquery()
+
+
+def with_show_counts(query, model, ids=None):
+    # adds num_upcoming_shows / num_past_shows columns to a query over `model`;
+    # entities without shows get zeros through the outer join
+    counts = show_counts(model, ids)
+    return query.outerjoin(counts, counts.c.entity_id == model.id).add_columns(
+        func.coalesce(counts.c.num_upcoming_shows, 0).label('num_upcoming_shows'),
+        func.coalesce(counts.c.num_past_shows, 0).label('num_past_shows'),
+    )
+
+
+def show_counts_for(model, ids):
+    # {id: (num_upcoming_shows, num_past_shows)} for an already known set of ids
+    if not ids:
+        return {}
+    counts = show_counts(model, ids)
+    return {
+        row.entity_id: (row.num_upcoming_shows, row.num_past_shows)
+        for row in db.session.query(counts).all()
+    }
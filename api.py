@@ -0,0 +1,332 @@
+import hashlib
+import itertools
+import json
+from datetime import datetime
+from flask import Blueprint, Response, abort, current_app, redirect, request, stream_with_context, url_for
+from models import db, Venue, Artist, Show, DEFAULT_SHOW_MINUTES, MAX_SHOW_MINUTES
+from aggregates import show_counts_for
+from genres import filter_by_genre, genre_names
+from pagination import encode_cursor, decode_cursor, parse_id, parse_window_bound, keyset_page
+from cache import cache
+from routing import replica_reads
+from booking import free_slots, week_start
+
+#----------------------------------------------------------------------------#
+# JSON API.
+#
+# Read-only mirror of the HTML pages under /api/v1. Lists are keyset
+# paginated (?limit=&after=), every endpoint takes ?fields= to choose the
+# returned keys, responses carry an ETag and answer If-None-Match with 304,
+# and list endpoints stream every row as NDJSON with ?format=ndjson.
+# /venues/<id>/free-slots lists the gaps between a venue's bookings.
+#
+# The one write, POST /shows/batch, books many shows in one request (see
+# importer.book_show_batch) and answers with an outcome per show.
+#----------------------------------------------------------------------------#
+
+api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+VENUE_COLUMNS = {
+    'id': Venue.id,
+    'name': Venue.name,
+    'city': Venue.city,
+    'state': Venue.state,
+    'address': Venue.address,
+    'phone': Venue.phone,
+    'image_link': Venue.image_link,
+    'facebook_link': Venue.facebook_link,
+    'website_link': Venue.website_link,
+    'seeking_talent': Venue.seeking_talent,
+    'seeking_description': Venue.seeking_description,
+}
+
+ARTIST_COLUMNS = {
+    'id': Artist.id,
+    'name': Artist.name,
+    'city': Artist.city,
+    'state': Artist.state,
+    'phone': Artist.phone,
+    'image_link': Artist.image_link,
+    'facebook_link': Artist.facebook_link,
+    'website_link': Artist.website_link,
+    'seeking_venue': Artist.seeking_venue,
+    'seeking_description': Artist.seeking_description,
+}
+
+SHOW_COLUMNS = {
+    'id': Show.id,
+    'start_time': Show.start_time,
+    'venue_id': Show.venue_id,
+    'venue_name': Venue.name,
+    'artist_id': Show.artist_id,
+    'artist_name': Artist.name,
+    'artist_image_link': Artist.image_link,
+}
+
+# values computed from other tables rather than selected as columns
+ENTITY_EXTRAS = ('genres', 'num_upcoming_shows', 'num_past_shows')
+
+STREAM_CHUNK = 1000
+
+
+#  Helpers
+#  ----------------------------------------------------------------
+
+def to_json(value):
+    return json.dumps(value, default=_json_default, separators=(',', ':'))
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError('{!r} is not JSON serializable'.format(value))
+
+
+def selected_fields(available):
+    # ?fields=id,name -> ['id', 'name']; the id is always included
+    fields = request.args.get('fields')
+    if not fields:
+        return list(available)
+    names = ['id'] + [name for name in fields.split(',') if name and name != 'id']
+    unknown = [name for name in names if name not in available]
+    if unknown:
+        abort(400, 'unknown field(s): ' + ', '.join(unknown))
+    return list(dict.fromkeys(names))
+
+
+def page_limit():
+    limit = request.args.get('limit', current_app.config['SHOWS_PER_PAGE'], type=int)
+    return max(1, min(limit, current_app.config['SHOWS_MAX_PER_PAGE']))
+
+
+def conditional_json(build, dependencies):
+    # body memoized on the data versions it depends on; ETag from its content
+    body = cache.memoize('api:' + request.full_path, dependencies, lambda: to_json(build()))
+    response = Response(body, mimetype='application/json')
+    response.set_etag(hashlib.sha1(body.encode()).hexdigest(), weak=True)
+    return response.make_conditional(request)
+
+
+def stream_ndjson(query, serialize_chunk):
+    # server-side cursor read in chunks, so exports run in constant memory;
+    # serialize_chunk turns a list of rows into a list of dicts
+    rows = iter(query.execution_options(stream_results=True).yield_per(STREAM_CHUNK))
+
+    def generate():
+        while True:
+            chunk = list(itertools.islice(rows, STREAM_CHUNK))
+            if not chunk:
+                break
+            yield ''.join(to_json(item) + '\n' for item in serialize_chunk(chunk))
+
+    return Response(stream_with_context(generate()), mimetype='application/x-ndjson')
+
+
+def streaming():
+    return request.args.get('format') == 'ndjson'
+
+
+#  Venues and artists
+#  ----------------------------------------------------------------
+
+def entity_list(model, columns, dependencies):
+    fields = selected_fields(list(columns) + list(ENTITY_EXTRAS))
+    query = db.session.query(*[columns[name].label(name) for name in fields if name in columns])
+
+    if request.args.get('genre'):
+        query = filter_by_genre(query, model, request.args['genre'])
+    for name in ('city', 'state'):
+        if request.args.get(name):
+            query = query.filter(columns[name] == request.args[name])
+
+    def serialize_chunk(rows):
+        data = [dict(row._mapping) for row in rows]
+        add_entity_extras(model, fields, [row.id for row in rows], data)
+        return data
+
+    if streaming():
+        return stream_ndjson(query.order_by(model.id), serialize_chunk)
+
+    try:
+        after = parse_id(request.args.get('after'))
+    except ValueError:
+        abort(400)
+    limit = page_limit()
+
+    def build():
+        rows, has_more = keyset_page(query, (model.id,), None if after is None else (after,), limit)
+        ids = [row.id for row in rows]
+        data = serialize_chunk(rows)
+        next_url = url_for(request.endpoint, **dict(request.args, after=ids[-1])) if has_more else None
+        return {'data': data, 'next': next_url}
+
+    return conditional_json(build, dependencies)
+
+
+def add_entity_extras(model, fields, ids, data):
+    if 'genres' in fields:
+        names = genre_names(model, ids)
+        for item in data:
+            item['genres'] = names[item['id']]
+    if 'num_upcoming_shows' in fields or 'num_past_shows' in fields:
+        counts = show_counts_for(model, ids)
+        for item in data:
+            upcoming, past = counts.get(item['id'], (0, 0))
+            if 'num_upcoming_shows' in fields:
+                item['num_upcoming_shows'] = upcoming
+            if 'num_past_shows' in fields:
+                item['num_past_shows'] = past
+
+
+def entity_detail(model, columns, entity_id, dependencies, shows_filter):
+    fields = selected_fields(list(columns) + list(ENTITY_EXTRAS))
+
+    def build():
+        row = db.session.query(
+            *[columns[name].label(name) for name in fields if name in columns]
+        ).filter(model.id == entity_id).first()
+        if row is None:
+            abort(404)
+        data = [dict(row._mapping)]
+        add_entity_extras(model, fields, [entity_id], data)
+        data[0]['shows'] = url_for('api.shows', **{shows_filter: entity_id})
+        return data[0]
+
+    return conditional_json(build, dependencies)
+
+
+@api.route('/venues')
+@replica_reads
+def venues():
+    return entity_list(Venue, VENUE_COLUMNS, ['venues', 'shows'])
+
+
+@api.route('/venues/<int:venue_id>')
+@replica_reads
+def venue(venue_id):
+    return entity_detail(Venue, VENUE_COLUMNS, venue_id,
+                         ['venue:{}'.format(venue_id), 'shows'], 'venue_id')
+
+
+@api.route('/venues/<int:venue_id>/free-slots')
+@replica_reads
+def venue_free_slots(venue_id):
+    # ?week=2026-W43 (default: this week), ?duration= minutes a slot must fit,
+    # ?hours=18-24 daily opening hours
+    try:
+        start = week_start(request.args.get('week'))
+        duration = request.args.get('duration', DEFAULT_SHOW_MINUTES, type=int)
+        hours = tuple(int(hour) for hour in request.args.get('hours', '0-24').split('-'))
+    except ValueError:
+        abort(400)
+    if not 0 < duration <= MAX_SHOW_MINUTES or len(hours) != 2 or not 0 <= hours[0] < hours[1] <= 24:
+        abort(400)
+    if not request.args.get('week'):
+        # responses are cached by URL, so "this week" gets a URL of its own
+        return redirect(url_for('api.venue_free_slots', venue_id=venue_id,
+                                **dict(request.args, week=start.strftime('%G-W%V'))))
+
+    def build():
+        if db.session.query(Venue.id).filter(Venue.id == venue_id).first() is None:
+            abort(404)
+        return {
+            'venue_id': venue_id,
+            'week_start': start,
+            'data': [{'start': slot_start, 'end': slot_end} for slot_start, slot_end in
+                     free_slots(venue_id, start, duration, hours)],
+        }
+
+    return conditional_json(build, ['venue:{}'.format(venue_id), 'shows'])
+
+
+@api.route('/artists')
+@replica_reads
+def artists():
+    return entity_list(Artist, ARTIST_COLUMNS, ['artists', 'shows'])
+
+
+@api.route('/artists/<int:artist_id>')
+@replica_reads
+def artist(artist_id):
+    return entity_detail(Artist, ARTIST_COLUMNS, artist_id,
+                         ['artist:{}'.format(artist_id), 'venues', 'shows'], 'artist_id')
+
+
+#  Shows
+#  ----------------------------------------------------------------
+
+@api.route('/shows')
+@replica_reads
+def shows():
+    fields = selected_fields(SHOW_COLUMNS)
+    # start_time is part of the keyset, so it is always selected
+    columns = list(dict.fromkeys(fields + ['start_time']))
+    query = db.session.query(*[SHOW_COLUMNS[name].label(name) for name in columns]).join(
+        Artist, Artist.id == Show.artist_id).join(Venue, Venue.id == Show.venue_id)
+
+    try:
+        window_start = parse_window_bound(request.args.get('from'))
+        window_end = parse_window_bound(request.args.get('to'), end=True)
+        after = decode_cursor(request.args['after']) if request.args.get('after') else None
+        venue_id = parse_id(request.args.get('venue_id'))
+        artist_id = parse_id(request.args.get('artist_id'))
+    except ValueError:
+        abort(400)
+
+    if window_start:
+        query = query.filter(Show.start_time >= window_start)
+    if window_end:
+        query = query.filter(Show.start_time < window_end)
+    if venue_id:
+        query = query.filter(Show.venue_id == venue_id)
+    if artist_id:
+        query = query.filter(Show.artist_id == artist_id)
+
+    def serialize(row):
+        return {name: getattr(row, name) for name in fields}
+
+    if streaming():
+        return stream_ndjson(query.order_by(Show.start_time, Show.id),
+                             lambda rows: [serialize(row) for row in rows])
+
+    limit = page_limit()
+
+    def build():
+        rows, has_more = keyset_page(query, (Show.start_time, Show.id), after, limit)
+        next_url = None
+        if has_more:
+            cursor = encode_cursor(rows[-1].start_time, rows[-1].id)
+            next_url = url_for('api.shows', **dict(request.args, after=cursor))
+        return {'data': [serialize(row) for row in rows], 'next': next_url}
+
+    return conditional_json(build, ['shows', 'venues', 'artists'])
+
+
+@api.route('/shows/batch', methods=['POST'])
+def book_shows():
+    # {"shows": [{"artist_id" or "artist_name", "venue_id" or "venue_name",
+    # "start_time": "YYYY-MM-DD HH:MM:SS", "duration_minutes"}, ...]} ->
+    # {"results": [{"status", "id" or "errors"}, ...]} in the same order
+    from importer import book_show_batch
+
+    body = request.get_json(force=True, silent=True)
+    records = body.get('shows') if isinstance(body, dict) else None
+    if not isinstance(records, list) or not all(isinstance(record, dict) for record in records):
+        abort(400, 'expected {"shows": [...]}')
+    if len(records) > current_app.config['SHOW_BATCH_MAX_ROWS']:
+        abort(400, 'at most {} shows per batch'.format(current_app.config['SHOW_BATCH_MAX_ROWS']))
+
+    report = book_show_batch(records)
+    results = [report.results[position] for position in range(len(records))]
+    summary = {key: value for key, value in report.as_dict().items() if key in ('inserted', 'duplicates', 'invalid')}
+    return Response(to_json(dict(summary, results=results)), mimetype='application/json')
+
+
+#  Errors
+#  ----------------------------------------------------------------
+
+@api.errorhandler(400)
+@api.errorhandler(404)
+def json_error(error):
+    return Response(to_json({'error': error.description}), status=error.code,
+                    mimetype='application/json')
@@ -2,182 +2,214 @@
 # Imports
 #----------------------------------------------------------------------------#
 
+import io
 import json
 import sys
-import dateutil.parser
-import babel
-from flask import Flask, render_template, request, Response, flash, redirect, url_for
-from flask_moment import Moment
+import functools
+from datetime import datetime
+import click
+from flask import Flask, render_template, request, Response, flash, redirect, url_for, abort, jsonify, current_app
 import logging
-from logging import Formatter, FileHandler
-from flask_wtf import Form
-from forms import *
-from models import Show, db, Venue, Artist
-from flask_migrate import Migrate
+from models import Show, db, Venue, Artist, Genre, MAX_IDEMPOTENCY_KEY_LENGTH
+from areas import venue_areas
+from genres import filter_by_genre
+from schedule import show_page
+from details import detail_stamp, load_detail
+from removal import archive_venue, delete_venue as remove_venue
+from booking import BookingConflict, DuplicateSubmission, book_show, describe_conflict
+from search import search
+from autocomplete import KINDS as AUTOCOMPLETE_KINDS, autocomplete
+from commands import register_commands
+from cache import cache
+from assets import assets
+from fragments import fragments
+from routing import replica_reads
+from async_reads import async_reads
+from instrumentation import profiler
+from api import api
+from projection import ArtistListing, ShowListing, project
+from pagination import encode_cursor, decode_cursor, parse_id, parse_window_bound, keyset_page
+from sqlalchemy.orm import noload
+
+# forms (and flask_wtf), the importer, babel and dateutil are imported by the
+# views and filters that use them, so starting a worker does not pay for them
 
 
 #----------------------------------------------------------------------------#
 # App Config.
+#
+# create_app() builds the app; importing this module sets nothing up. The
+# views below are collected by @route and added to every app the factory
+# makes under their usual endpoint names. Flask-Migrate is only set up under
+# the flask CLI, so web workers never import alembic. `python -X importtime
+# -c "import app"` and benchmark.py's startup check keep an eye on the rest.
 #----------------------------------------------------------------------------#
 
-app = Flask(__name__)
-moment = Moment(app)
-app.config.from_object('config')
-db.init_app(app)
-migrate = Migrate(app, db)
+# (rule, view, options) for every @route, in definition order
+ROUTES = []
+
+
+def route(rule, **options):
+    def decorator(view):
+        ROUTES.append((rule, view, options))
+        return view
+    return decorator
+
+
+def running_cli():
+    # the flask command line (or another click program), not a WSGI server
+    return click.get_current_context(silent=True) is not None
+
+
+def create_app(config='config', migrate=None, settings=None):
+    # migrate: set up Flask-Migrate (and import alembic); by default only
+    # under the flask CLI. Scripts calling flask_migrate.upgrade() pass True.
+    # settings: config values that override `config`, applied before the
+    # extensions read them (the benchmark and tests use their own database).
+    app = Flask(__name__)
+    app.config.from_object(config)
+    app.config.update(settings or {})
+    db.init_app(app)
+    cache.init_app(app)
+    profiler.init_app(app)
+    autocomplete.init_app(app)
+    assets.init_app(app)
+    fragments.init_app(app)
+
+    app.add_template_filter(format_datetime, 'datetime')
+    for rule, view, options in ROUTES:
+        app.add_url_rule(rule, view_func=view, **options)
+    app.register_blueprint(api)
+    # replaces the detail views when ASYNC_READS is set
+    async_reads.init_app(app)
+    app.register_error_handler(404, not_found_error)
+    app.register_error_handler(500, server_error)
+    register_commands(app)
+
+    if migrate is None:
+        migrate = running_cli()
+    if migrate:
+        from flask_migrate import Migrate
+        Migrate(app, db)
+
+    if not app.debug:
+        configure_logging(app)
+    return app
+
+
+def configure_logging(app):
+    file_handler = logging.FileHandler('error.log')
+    file_handler.setFormatter(
+        logging.Formatter(
+            '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
+    )
+    app.logger.setLevel(logging.INFO)
+    file_handler.setLevel(logging.INFO)
+    app.logger.addHandler(file_handler)
+    app.logger.info('errors')
 
 #----------------------------------------------------------------------------#
 # Filters.
 #----------------------------------------------------------------------------#
 
+DATETIME_FORMATS = {
+    'full': "EEEE MMMM, d, y 'at' h:mma",
+    'medium': "EE MM, dd, y h:mma",
+}
+
+
+@functools.lru_cache(maxsize=None)
+def datetime_pattern(format):
+    # Babel patterns are parsed once per format instead of once per call
+    import babel.dates
+    return babel.dates.parse_pattern(DATETIME_FORMATS.get(format, format))
+
+
+@functools.lru_cache(maxsize=None)
+def datetime_locale(locale):
+    import babel
+    return babel.Locale.parse(locale)
+
+
+@functools.lru_cache(maxsize=4096)
+def cached_format_datetime(value, format, locale):
+    return datetime_pattern(format).apply(value, datetime_locale(locale))
+
+
 def format_datetime(value, format='medium'):
-    date = dateutil.parser.parse(value)
-    if format == 'full':
-        format = "EEEE MMMM, d, y 'at' h:mma"
-    elif format == 'medium':
-        format = "EE MM, dd, y h:mma"
-    return babel.dates.format_datetime(date, format, locale='en')
+    # routes pass datetimes straight through; strings are still accepted
+    if not isinstance(value, datetime):
+        import dateutil.parser
+        value = dateutil.parser.parse(value)
+    return cached_format_datetime(value, format, 'en')
 
-app.jinja_env.filters['datetime'] = format_datetime
 
 #----------------------------------------------------------------------------#
 # Controllers.
 #----------------------------------------------------------------------------#
 
-@app.route('/')
+@route('/')
 def index():
     return render_template('pages/home.html')
 
 #  Venues
 #  ----------------------------------------------------------------
 
-@app.route('/venues')
+@route('/venues')
+@replica_reads
+@cache.cached_page('venues', 'shows')
 def venues():
-
-    venue_list = []
-    venues = Venue.query.group_by(Venue.city, Venue.state, Venue.id).order_by(
-        Venue.city, Venue.state, Venue.id).all()
-
-    for venue in venues:
-        venue_item = {
-            "city": venue.city,
-            "state": venue.state,
-            "venues": [
-                {
-                    "id": venue.id,
-                    "name": venue.name,
-                    "num_upcoming_shows": 0,
-                }
-            ]
-        }
-
-        # append venues if city already exists in venue_list.
-        # Otherwise, add venue_item to venue list
-        if len(venue_list) and venue_list[len(venue_list) - 1]['city'] == venue_item["city"]:
-            venue_list[len(venue_list) -
-                       1]['venues'].append(venue_item["venues"][0])
-        else:
-            venue_list.append(venue_item)
-
-    return render_template('pages/venues.html', areas=venue_list)
+    # optional filters, e.g. /venues?genre=Jazz&state=NY
+    areas = venue_areas(
+        genre=request.args.get('genre'),
+        city=request.args.get('city'),
+        state=request.args.get('state'),
+    )
+    return render_template('pages/venues.html', areas=areas)
 
 
-@app.route('/venues/search', methods=['POST'])
+@route('/venues/search', methods=['POST'])
+@replica_reads
 def search_venues():
 
-    user_input = request.form.get('search_term')
-    # outerjoin used so that venues with no event history will still be returned
-    venue_result = db.session.query(Venue).outerjoin(Show, Show.venue_id == Venue.id).with_entities(
-        Venue.id, Venue.name, Show.start_time).filter(
-            Venue.name.ilike('%' + user_input + '%')).order_by(Venue.id).all()
+    search_term = request.form.get('search_term', '')
+    response = search(Venue, search_term, page=request.form.get('page', 1, type=int),
+                      per_page=current_app.config['SEARCH_PER_PAGE'])
 
-    response = {
-        "count": 0,
-        "data": []
-    }
-
-    for venue in venue_result:
-        # Increment num_upcoming_shows by 1 if last record in response dictionary has the same id as venue.id
-        if (response["data"] and response["data"][len(response["data"]) - 1]["id"] == venue.id):
-            response["data"][len(response["data"]) - 1]["num_upcoming_shows"] += 1
-        else:
-            data_item = {
-                "id": venue.id,
-                "name": venue.name,
-                "num_upcoming_shows": 1,
-            }
-            response["count"] += 1
-            response["data"].append(data_item)
-    
-    return render_template('pages/search_venues.html', results=response, search_term=request.form.get('search_term', ''))
+    return render_template('pages/search_venues.html', results=response, search_term=search_term)
 
 
-@app.route('/venues/<int:venue_id>')
+@route('/venues/<int:venue_id>')
+@replica_reads
+@cache.cached_page('venue:{venue_id}', 'artists', stamp=detail_stamp(Venue))
 def show_venue(venue_id):
-    venues = db.session.query(Venue).outerjoin(Show, Show.venue_id == Venue.id).outerjoin(
-        Artist, Artist.id == Show.artist_id).with_entities(
-        Venue.id, Venue.name, Venue.genres, Venue.address, Venue.city,
-        Venue.state, Venue.phone, Venue.website_link, Venue.facebook_link,
-        Venue.seeking_talent, Venue.seeking_description, Venue.image_link,
-        Artist.id, Artist.name, Artist.image_link, Show.start_time
-    ).filter(Venue.id == venue_id).order_by(Venue.id).all()
-
-    if venues:
-
-        # sort shows into past & upcoming
-        past_shows= []
-        upcoming_shows= []
-
-        for venue in venues:
-            temp_show = {
-                "artist_id": venue[12],
-                "artist_name": venue[13],
-                "artist_image_link": venue[14],
-                "start_time": ''
-            }
-
-            if venue[15]:
-                temp_show["start_time"] = venue[15].strftime("%m/%d/%Y %H:%M:%S")
-                if venue[15] <= datetime.now():
-                    past_shows.append(temp_show)
-                else:
-                    upcoming_shows.append(temp_show)
-
-        new_data = {
-            "id": venues[0][0],
-            "name": venues[0][1],
-            "genres": (venues[0][2]).split(","),
-            "address": venues[0][3],
-            "city": venues[0][4],
-            "state": venues[0][5],
-            "phone": venues[0][6],
-            "website": venues[0][7],
-            "facebook_link": venues[0][8],
-            "seeking_talent": venues[0][9],
-            "seeking_description": venues[0][10],
-            "image_link": venues[0][11],
-            "past_shows": past_shows,
-            "upcoming_shows": upcoming_shows,
-            "past_shows_count": len(past_shows),
-            "upcoming_shows_count": len(upcoming_shows),
-        }
-    else:
-        new_data = {}
+    # entity row, bounded upcoming/past show pages, counts and genres;
+    # see details.py
+    venue = load_detail(Venue, venue_id, current_app.config['DETAIL_SHOWS_PER_PAGE'])
+    return render_template('pages/show_venue.html', venue=venue)
+
+
+@route('/venues/<int:venue_id>/past-shows')
+@replica_reads
+@cache.cached_page('venue:{venue_id}', 'artists', stamp=detail_stamp(Venue))
+def venue_past_shows(venue_id):
+    return past_shows_page(Venue, venue_id, 'venue_past_shows')
 
-    return render_template('pages/show_venue.html', venue=new_data)
 
 #  Create Venue
 #  ----------------------------------------------------------------
 
 
-@app.route('/venues/create', methods=['GET'])
+@route('/venues/create', methods=['GET'])
 def create_venue_form():
+    from forms import VenueForm
     form = VenueForm()
     return render_template('forms/new_venue.html', form=form)
 
 
-@app.route('/venues/create', methods=['POST'])
+@route('/venues/create', methods=['POST'])
 def create_venue_submission():
+    from forms import VenueForm
 
     venue_form = VenueForm(request.form)
 
@@ -190,7 +222,7 @@ def create_venue_submission():
                 address = venue_form.address.data,
                 phone = venue_form.phone.data,
                 image_link = venue_form.image_link.data,
-                genres = ",".join(venue_form.genres.data),
+                genres = Genre.from_names(venue_form.genres.data),
                 facebook_link = venue_form.facebook_link.data,
                 website_link = venue_form.website_link.data,
                 seeking_talent = venue_form.seeking_talent.data,
@@ -199,30 +231,37 @@ def create_venue_submission():
 
             db.session.add(new_venue)
             db.session.commit()
+            cache.bump('venues')
             flash('Venue ' + request.form['name'] + ' was successfully listed!')
         except:
             db.session.rollback()
             flash('An error occurred. Venue ' + request.form['name'] + ' could not be listed.\n' + sys.exc_info())
         finally:
-            db.session.close()
             return redirect(url_for('index'))
     else:
         flash('An error occurred. Check form inputs and try again.')
 
 
-@app.route('/venues/<venue_id>/delete', methods=['POST'])
+@route('/venues/<int:venue_id>/delete', methods=['POST'])
 def delete_venue(venue_id):
     
     try:
-        venue = Venue.query.get(venue_id)
-        db.session.delete(venue)
-        db.session.commit()
-        flash('successfully deleted')
+        # set-based deletes; the venue's shows are never loaded
+        if current_app.config['VENUE_DELETE_MODE'] == 'archive':
+            deleted = archive_venue(venue_id)
+        else:
+            deleted = remove_venue(venue_id)
+        if deleted:
+            db.session.commit()
+            cache.bump('venues', 'venue:{}'.format(venue_id), 'shows')
+            flash('successfully deleted')
+        else:
+            db.session.rollback()
+            flash('Venue {} was not found.'.format(venue_id))
     except:
         db.session.rollback()
         flash('an error occurred.\n' + sys.exc_info())
     finally:
-        db.session.close()
         return redirect(url_for('index'))
 
 
@@ -230,114 +269,79 @@ def delete_venue(venue_id):
 #  ----------------------------------------------------------------
 
 
-@app.route('/artists')
+@route('/artists')
+@replica_reads
+@cache.cached_page('artists')
 def artists():
 
-    artist_list = []
-    artists = Artist.query.order_by(Artist.id).all()
-
-    for artist in artists:
-        new_artist = {
-            "id": artist.id,
-            "name": artist.name
-        }
-        artist_list.append(new_artist)
+    query = db.session.query(Artist.id, Artist.name)
+    if request.args.get('genre'):
+        query = filter_by_genre(query, Artist, request.args['genre'])
+    artist_list = project(ArtistListing, query.order_by(Artist.id))
 
     return render_template('pages/artists.html', artists=artist_list)
 
 
-@app.route('/artists/search', methods=['POST'])
+@route('/artists/search', methods=['POST'])
+@replica_reads
 def search_artists():
 
-    user_input = request.form.get('search_term')
+    search_term = request.form.get('search_term', '')
+    response = search(Artist, search_term, page=request.form.get('page', 1, type=int),
+                      per_page=current_app.config['SEARCH_PER_PAGE'])
 
-    # outerjoin used so that artists with no event history will still be returned
-    artist_result = db.session.query(Artist).outerjoin(Show, Show.artist_id == Artist.id).with_entities(Artist.id, Artist.name, Show.start_time).filter(Artist.name.ilike('%' + user_input + '%')).order_by(Artist.id).all()
+    return render_template('pages/search_artists.html', results=response, search_term=search_term)
 
-    response = {
-        "count": 0,
-        "data": []
-    }
 
-    for artist in artist_result:
-        if (response["data"] and response["data"][len(response["data"]) - 1]["id"] == artist.id):
-            response["data"][len(response["data"]) - 1]["num_upcoming_shows"] += 1
-        else:
-            data_item = {
-                "id": artist.id,
-                "name": artist.name,
-                "num_upcoming_shows": 1,
-            }
-            response["count"] += 1
-            response["data"].append(data_item)
+@route('/artists/<int:artist_id>')
+@replica_reads
+@cache.cached_page('artist:{artist_id}', 'venues', stamp=detail_stamp(Artist))
+def show_artist(artist_id):
+    artist = load_detail(Artist, artist_id, current_app.config['DETAIL_SHOWS_PER_PAGE'])
+    return render_template('pages/show_artist.html', artist=artist)
 
-    return render_template('pages/search_artists.html', results=response, search_term=request.form.get('search_term', ''))
 
+@route('/artists/<int:artist_id>/past-shows')
+@replica_reads
+@cache.cached_page('artist:{artist_id}', 'venues', stamp=detail_stamp(Artist))
+def artist_past_shows(artist_id):
+    return past_shows_page(Artist, artist_id, 'artist_past_shows')
 
-@app.route('/artists/<int:artist_id>')
-def show_artist(artist_id):
 
-    artists = db.session.query(Artist).outerjoin(Show, Show.artist_id == Artist.id).outerjoin(Venue, Venue.id == Show.venue_id).with_entities(
-        Artist.id, Artist.name, Artist.genres, Artist.city, Artist.state, Artist.phone, Artist.website_link, Artist.facebook_link,
-        Artist.seeking_venue, Artist.seeking_description, Artist.image_link, Venue.id, Venue.name, Venue.image_link, Show.start_time
-    ).filter(Artist.id == artist_id).order_by(Artist.id).all()
-
-    if artists:
-        # sort shows into past & upcoming
-        past_shows= []
-        upcoming_shows= []
-
-        for artist in artists:
-            temp_show = {
-                "venue_id": artist[11],
-                "venue_name": artist[12],
-                "venue_image_link": artist[13],
-                "start_time": ''
-            }
-
-            if artist[14]:
-                temp_show["start_time"] = artist[14].strftime("%m/%d/%Y %H:%M:%S")
-                if artist[14] <= datetime.now():
-                    past_shows.append(temp_show)
-                else:
-                    upcoming_shows.append(temp_show)
-        
-        new_data = {
-            "id": artists[0][0],
-            "name": artists[0][1],
-            "genres": (artists[0][2]).split(","),
-            "city": artists[0][3],
-            "state": artists[0][4],
-            "phone": artists[0][5],
-            "website": artists[0][6],
-            "facebook_link": artists[0][7],
-            "seeking_venue": artists[0][8],
-            "seeking_description": artists[0][9],
-            "image_link": artists[0][10],
-            "past_shows": past_shows,
-            "upcoming_shows": upcoming_shows,
-            "past_shows_count": len(past_shows),
-            "upcoming_shows_count": len(upcoming_shows),
-        }
-    else:
-        new_data = {}
+#  Show listings
+#  ----------------------------------------------------------------
+
+def past_shows_page(model, entity_id, endpoint):
+    # one "load more past shows" page, continuing from the detail page
+    entity = db.session.query(model.id, model.name).filter(model.id == entity_id).first()
+    if entity is None:
+        abort(404)
+    try:
+        after = decode_cursor(request.args['after']) if request.args.get('after') else None
+    except ValueError:
+        abort(400)
 
-    return render_template('pages/show_artist.html', artist=new_data)
+    shows, cursor = show_page(model, entity_id, past=True,
+                              limit=current_app.config['DETAIL_SHOWS_PER_PAGE'], after=after)
+    next_url = url_for(endpoint, after=cursor, **{model.__name__.lower() + '_id': entity_id}) if cursor else None
+    return render_template('pages/past_shows.html', entity=entity, kind=model.__name__.lower(),
+                           shows=shows, next_url=next_url)
 
 #  Update
 #  ----------------------------------------------------------------
 
 
-@app.route('/artists/<int:artist_id>/edit', methods=['GET'])
+@route('/artists/<int:artist_id>/edit', methods=['GET'])
 def edit_artist(artist_id):
+    from forms import ArtistForm
 
-    artist_detail = Artist.query.get(artist_id)
+    artist_detail = Artist.query.options(noload(Artist.shows)).get(artist_id)
     form = ArtistForm()
 
     artist = {
         "id": artist_detail.id,
         "name": artist_detail.name,
-        "genres": artist_detail.genres.split(","),
+        "genres": [genre.name for genre in artist_detail.genres],
         "city": artist_detail.city,
         "state": artist_detail.state,
         "phone": artist_detail.phone,
@@ -351,46 +355,48 @@ def edit_artist(artist_id):
     return render_template('forms/edit_artist.html', form=form, artist=artist)
 
 
-@app.route('/artists/<int:artist_id>/edit', methods=['POST'])
+@route('/artists/<int:artist_id>/edit', methods=['POST'])
 def edit_artist_submission(artist_id):
+    from forms import ArtistForm
 
     artist_form = ArtistForm(request.form)
 
     if (artist_form.validate()):
         try:
-            artist_info = Artist.query.get(artist_id)
+            artist_info = Artist.query.options(noload(Artist.shows)).get(artist_id)
             artist_info.name = artist_form.name.data
             artist_info.city = artist_form.city.data
             artist_info.state = artist_form.state.data
             artist_info.phone = artist_form.phone.data
             artist_info.image_link = artist_form.image_link.data
-            artist_info.genres = ",".join(artist_form.genres.data)
+            artist_info.genres = Genre.from_names(artist_form.genres.data)
             artist_info.facebook_link = artist_form.facebook_link.data
             artist_info.website_link = artist_form.website_link.data
             artist_info.seeking_venue = artist_form.seeking_venue.data
             artist_info.seeking_description = artist_form.seeking_description.data
 
             db.session.commit()
+            cache.bump('artists', 'artist:{}'.format(artist_id))
             flash(artist_form.name.data + ' was successfully updated!')
         except:
             db.session.rollback()
             flash('An error occurred. ' + artist_form.name.data + ' could not be updated. \n' + sys.exc_info())
 
         finally:
-            db.session.close()
             return redirect(url_for('show_artist', artist_id=artist_id))
 
 
-@app.route('/venues/<int:venue_id>/edit', methods=['GET'])
+@route('/venues/<int:venue_id>/edit', methods=['GET'])
 def edit_venue(venue_id):
+    from forms import VenueForm
 
-    venue_detail = Venue.query.get(venue_id)
+    venue_detail = Venue.query.options(noload(Venue.shows)).get(venue_id)
     form = VenueForm()
 
     venue = {
         "id": venue_detail.id,
         "name": venue_detail.name,
-        "genres": venue_detail.genres.split(","),
+        "genres": [genre.name for genre in venue_detail.genres],
         "address": venue_detail.address,
         "city": venue_detail.city,
         "state": venue_detail.state,
@@ -405,33 +411,33 @@ def edit_venue(venue_id):
     return render_template('forms/edit_venue.html', form=form, venue=venue)
 
 
-@app.route('/venues/<int:venue_id>/edit', methods=['POST'])
+@route('/venues/<int:venue_id>/edit', methods=['POST'])
 def edit_venue_submission(venue_id):
+    from forms import VenueForm
 
     venue_form = VenueForm(request.form)
 
     if (venue_form.validate()):
         try:
-            venue_info = Venue.query.get(venue_id)
+            venue_info = Venue.query.options(noload(Venue.shows)).get(venue_id)
             venue_info.name = venue_form.name.data
             venue_info.city = venue_form.city.data
             venue_info.state = venue_form.state.data
             venue_info.address = venue_form.address.data
             venue_info.phone = venue_form.phone.data
             venue_info.image_link = venue_form.image_link.data
-            venue_info.genres = ",".join(venue_form.genres.data)
+            venue_info.genres = Genre.from_names(venue_form.genres.data)
             venue_info.facebook_link = venue_form.facebook_link.data
             venue_info.website_link = venue_form.website_link.data
             venue_info.seeking_talent = venue_form.seeking_talent.data
             venue_info.seeking_description = venue_form.seeking_description.data
 
             db.session.commit()
+            cache.bump('venues', 'venue:{}'.format(venue_id))
             flash(venue_form.name.data + ' was successfully updated!')
         except:
             db.session.rollback()
             flash('An error occurred. ' + venue_form.name.data + ' could not be updated. \n' + sys.exc_info())
-        finally:
-            db.session.close()
 
     return redirect(url_for('show_venue', venue_id=venue_id))
 
@@ -439,14 +445,16 @@ def edit_venue_submission(venue_id):
 #  ----------------------------------------------------------------
 
 
-@app.route('/artists/create', methods=['GET'])
+@route('/artists/create', methods=['GET'])
 def create_artist_form():
+    from forms import ArtistForm
     form = ArtistForm()
     return render_template('forms/new_artist.html', form=form)
 
 
-@app.route('/artists/create', methods=['POST'])
+@route('/artists/create', methods=['POST'])
 def create_artist_submission():
+    from forms import ArtistForm
 
     artist_form = ArtistForm(request.form)
 
@@ -458,7 +466,7 @@ def create_artist_submission():
                 state=artist_form.state.data,
                 phone=artist_form.phone.data,
                 image_link=artist_form.image_link.data,
-                genres=",".join(artist_form.genres.data),
+                genres=Genre.from_names(artist_form.genres.data),
                 facebook_link=artist_form.facebook_link.data,
                 website_link=artist_form.website_link.data,
                 seeking_venue=artist_form.seeking_venue.data,
@@ -467,12 +475,12 @@ def create_artist_submission():
 
             db.session.add(new_artist)
             db.session.commit()
+            cache.bump('artists')
             flash('Artist ' + request.form['name'] + ' was successfully listed!')
         except:
             db.session.rollback()
             flash('An error occurred. Artist ' + request.form['name'] + ' could not be listed.\n' + sys.exc_info())
         finally:
-            db.session.close()
             return redirect(url_for('index'))
     else:
         flash('An error occurred. Check form inputs and try again.' + sys.exc_info())
@@ -481,88 +489,159 @@ def create_artist_submission():
 #  Shows
 #  ----------------------------------------------------------------
 
-@app.route('/shows')
+@route('/shows')
+@replica_reads
+@cache.cached_page('shows', 'venues', 'artists')
 def shows():
 
-    shows_list = []
+    # optional filters; anything malformed is a bad request rather than a full scan
+    try:
+        filters = {
+            'from': request.args.get('from', ''),
+            'to': request.args.get('to', ''),
+            'venue_id': parse_id(request.args.get('venue_id')),
+            'artist_id': parse_id(request.args.get('artist_id')),
+        }
+        window_start = parse_window_bound(filters['from'])
+        window_end = parse_window_bound(filters['to'], end=True)
+        after = decode_cursor(request.args['after']) if request.args.get('after') else None
+    except ValueError:
+        abort(400)
+
+    limit = min(request.args.get('limit', current_app.config['SHOWS_PER_PAGE'], type=int),
+                current_app.config['SHOWS_MAX_PER_PAGE'])
+
+    # fetch required records from related tables, in ShowListing order
+    query = db.session.query(Show).join(Artist, Artist.id == Show.artist_id).join(Venue, Venue.id == Show.venue_id).with_entities(
+        Show.id, Show.venue_id, Venue.name, Show.artist_id, Artist.name, Artist.image_link, Show.start_time
+    )
+
+    if window_start:
+        query = query.filter(Show.start_time >= window_start)
+    if window_end:
+        query = query.filter(Show.start_time < window_end)
+    if filters['venue_id']:
+        query = query.filter(Show.venue_id == filters['venue_id'])
+    if filters['artist_id']:
+        query = query.filter(Show.artist_id == filters['artist_id'])
 
-    # fetch required records from related tables
-    shows = db.session.query(Show).join(Artist, Artist.id == Show.artist_id).join(Venue, Venue.id == Show.venue_id).with_entities(
-        Show.venue_id, Venue.name, Show.artist_id, Artist.name, Artist.image_link, Show.start_time
-    ).all()
+    # keyset pagination on (start_time, id) so every page costs the same
+    shows, has_more = keyset_page(query, (Show.start_time, Show.id), after, max(limit, 1))
 
-    for show in shows:
-        show_info = {
-            "venue_id": show[0],
-            "venue_name": show[1],
-            "artist_id": show[2],
-            "artist_name": show[3],
-            "artist_image_link": show[4],
-            "start_time": show[5].strftime("%m/%d/%Y %H:%M:%S")
-            }
-        shows_list.append(show_info)
+    shows_list = project(ShowListing, shows)
+    next_cursor = encode_cursor(shows[-1].start_time, shows[-1].id) if has_more else None
+    filters = {key: value for key, value in filters.items() if value}
 
-    return render_template('pages/shows.html', shows=shows_list)
+    return render_template('pages/shows.html', shows=shows_list, filters=filters, next_cursor=next_cursor)
 
 
-@app.route('/shows/create')
+@route('/shows/create')
 def create_shows():
+    from forms import ShowForm
     # renders form. do not touch.
     form = ShowForm()
     return render_template('forms/new_show.html', form=form)
 
 
-@app.route('/shows/create', methods=['POST'])
+@route('/shows/create', methods=['POST'])
 def create_show_submission():
+    from forms import ShowForm
 
     show_form = ShowForm(request.form)
 
-    if (show_form.validate()):
-        try:
-            new_show = Show(
-                artist_id = show_form.artist_id.data,
-                venue_id = show_form.venue_id.data,
-                start_time = show_form.start_time.data
-            )
+    if not show_form.validate():
+        flash('An error occurred. Check form inputs and try again.')
+        return render_template('forms/new_show.html', form=show_form)
 
-            db.session.add(new_show)
-            db.session.commit()
-            flash('Show was successfully listed!')
-        except:
-            db.session.rollback()
-            flash('An error occurred. Show could not be listed. \n' + sys.exc_info())
-        finally:
-            db.session.close()
+    # API clients send an Idempotency-Key header; the form carries its own key
+    key = request.headers.get('Idempotency-Key') or show_form.idempotency_key.data or None
+    if key is not None and len(key) > MAX_IDEMPOTENCY_KEY_LENGTH:
+        abort(400)
+
+    venue_id, artist_id = show_form.venue_id.data, show_form.artist_id.data
+    try:
+        book_show(venue_id, artist_id, show_form.start_time.data, show_form.duration_minutes.data,
+                  idempotency_key=key)
+        db.session.commit()
+    except DuplicateSubmission:
+        # a retry of a submission that already went through
+        db.session.rollback()
+        flash('Show was successfully listed!')
+        return render_template('pages/home.html')
+    except BookingConflict as conflict:
+        # back to the form, so another time can be picked
+        db.session.rollback()
+        reasons = [describe_conflict(booking, venue_id, artist_id) for booking in conflict.conflicts]
+        flash('Show could not be listed: ' + ('; '.join(reasons) or 'the time slot was just taken.'))
+        return render_template('forms/new_show.html', form=show_form)
+    except:
+        db.session.rollback()
+        flash('An error occurred. Show could not be listed.')
+    else:
+        cache.bump('shows', 'venue:{}'.format(venue_id), 'artist:{}'.format(artist_id))
+        flash('Show was successfully listed!')
 
     return render_template('pages/home.html')
 
 
-@app.errorhandler(404)
+#  Autocomplete
+#  ----------------------------------------------------------------
+
+@route('/autocomplete')
+@replica_reads
+def autocomplete_names():
+    # ?q=blue%20n&type=venues|artists (both by default)&limit=
+    kinds = request.args.getlist('type') or list(AUTOCOMPLETE_KINDS)
+    if any(kind not in AUTOCOMPLETE_KINDS for kind in kinds):
+        abort(400)
+    limit = request.args.get('limit', current_app.config['AUTOCOMPLETE_LIMIT'], type=int)
+    limit = max(1, min(limit, current_app.config['AUTOCOMPLETE_MAX_LIMIT']))
+    term = request.args.get('q', '')
+    return jsonify({kind: autocomplete.lookup(kind, term, limit) for kind in kinds})
+
+
+#  Import
+#  ----------------------------------------------------------------
+
+@route('/import/<kind>', methods=['POST'])
+def import_data(kind):
+    from importer import KINDS as IMPORT_KINDS, guess_format, import_records, read_records
+    # accepts a multipart "file" upload or the raw request body
+    if kind not in IMPORT_KINDS:
+        abort(404)
+
+    upload = request.files.get('file')
+    if upload is not None:
+        stream, filename = upload.stream, upload.filename or ''
+    else:
+        stream, filename = request.stream, ''
+    format = request.args.get('format') or guess_format(filename)
+
+    try:
+        records = read_records(io.TextIOWrapper(stream, encoding='utf-8', newline=''), format)
+        report = import_records(kind, records, batch_size=request.args.get('batch_size', 1000, type=int))
+    except ValueError as error:
+        return Response(json.dumps({'error': str(error)}), status=400, mimetype='application/json')
+
+    return Response(json.dumps(report.as_dict()), mimetype='application/json')
+
+
+#  Errors
+#  ----------------------------------------------------------------
+
 def not_found_error(error):
     return render_template('errors/404.html'), 404
 
 
-@app.errorhandler(500)
 def server_error(error):
     return render_template('errors/500.html'), 500
 
-
-if not app.debug:
-    file_handler = FileHandler('error.log')
-    file_handler.setFormatter(
-        Formatter(
-            '%(asctime)s %(levelname)s: %(message)s [in %(pathname)s:%(lineno)d]')
-    )
-    app.logger.setLevel(logging.INFO)
-    file_handler.setLevel(logging.INFO)
-    app.logger.addHandler(file_handler)
-    app.logger.info('errors')
-
 #----------------------------------------------------------------------------#
 # Launch.
 #----------------------------------------------------------------------------#
 
 # Default port:
 if __name__ == '__main__':
+    app = create_app()
     app.debug = True
     app.run(host='0.0.0.0', port=3000)
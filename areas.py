@@ -0,0 +1,164 @@
+import itertools
+from datetime import datetime
+from sqlalchemy import and_, event, func, select
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import get_history
+from models import db, Venue, VenueArea, Show
+from genres import entities_with_genre
+from projection import AreaVenue
+
+#----------------------------------------------------------------------------#
+# Venue area rollup.
+#
+# /venues lists every venue grouped by (city, state) with its number of
+# upcoming shows. The listing is kept precomputed in venue_areas, so the page
+# reads only that table, in index order.
+#
+# ORM writes to venues and shows refresh the affected rows in the same flush.
+# Bulk imports, which bypass the ORM, refresh the venues each batch touches.
+# `flask rebuild-venue-areas` recomputes the whole table. A stored count
+# is correct until the venue's next show starts (next_show_at). The
+# refresh_venue_areas job recounts rows past that point in the background;
+# any it has not reached yet are recounted when they are read.
+#----------------------------------------------------------------------------#
+
+areas = VenueArea.__table__
+
+
+def _upcoming_shows(now):
+    # venues outer-joined to their upcoming shows; grouped by the callers
+    return Venue.__table__.outerjoin(
+        Show.__table__, and_(Show.venue_id == Venue.id, Show.start_time > now))
+
+
+def _area_rows(now, venue_ids=None):
+    query = select(
+        Venue.id, Venue.city, Venue.state, Venue.name,
+        func.count(Show.id), func.min(Show.start_time),
+    ).select_from(_upcoming_shows(now)).where(Venue.deleted_at.is_(None)).group_by(
+        Venue.id, Venue.city, Venue.state, Venue.name)
+    if venue_ids is not None:
+        query = query.where(Venue.id.in_(venue_ids))
+    return query
+
+
+AREA_COLUMNS = ['venue_id', 'city', 'state', 'name', 'num_upcoming_shows', 'next_show_at']
+
+
+def insert_venue_areas(connection, venue_ids):
+    if venue_ids:
+        connection.execute(areas.insert().from_select(AREA_COLUMNS, _area_rows(datetime.now(), venue_ids)))
+
+
+def update_venue_areas(connection, venue_ids):
+    # recomputes existing rows in place, so concurrent writers to the same
+    # venue queue on the row lock instead of racing a delete + insert
+    if not venue_ids:
+        return
+    now = datetime.now()
+    upcoming = and_(Show.venue_id == areas.c.venue_id, Show.start_time > now)
+    venue = Venue.id == areas.c.venue_id
+    connection.execute(areas.update().where(areas.c.venue_id.in_(venue_ids)).values(
+        city=select(Venue.city).where(venue).scalar_subquery(),
+        state=select(Venue.state).where(venue).scalar_subquery(),
+        name=select(Venue.name).where(venue).scalar_subquery(),
+        num_upcoming_shows=select(func.count(Show.id)).where(upcoming).scalar_subquery(),
+        next_show_at=select(func.min(Show.start_time)).where(upcoming).scalar_subquery(),
+    ))
+
+
+def delete_venue_areas(connection, venue_ids):
+    # the foreign key cascades on Postgres; SQLite does not enforce it
+    if venue_ids:
+        connection.execute(areas.delete().where(areas.c.venue_id.in_(venue_ids)))
+
+
+def rebuild_venue_areas(connection):
+    # whole-table refresh; maintenance only (`flask rebuild-venue-areas`)
+    connection.execute(areas.delete())
+    connection.execute(areas.insert().from_select(AREA_COLUMNS, _area_rows(datetime.now())))
+
+
+def refresh_due_venue_areas(chunk_size=1000):
+    # job (jobs.py): recounts the rows whose next show has started, so the
+    # listing seldom has to do it while a visitor waits
+    due = db.session.execute(
+        select(areas.c.venue_id).where(areas.c.next_show_at <= datetime.now())).scalars().all()
+    for start in range(0, len(due), chunk_size):
+        update_venue_areas(db.session.connection(), due[start:start + chunk_size])
+        db.session.commit()
+
+
+def venue_areas(genre=None, city=None, state=None):
+    # [{"city", "state", "venues": [AreaVenue]}]
+    # grouped on (city, state), so same-named cities in different states
+    # stay apart
+    query = db.session.query(areas)
+    if genre:
+        query = query.filter(areas.c.venue_id.in_(entities_with_genre(Venue, genre)))
+    if city:
+        query = query.filter(areas.c.city == city)
+    if state:
+        query = query.filter(areas.c.state == state)
+    query = query.order_by(areas.c.city, areas.c.state, areas.c.venue_id)
+    rows = query.all()
+
+    now = datetime.now()
+    stale = [row.venue_id for row in rows if row.next_show_at is not None and row.next_show_at <= now]
+    if stale:
+        # written on the primary even when this page reads from a replica,
+        # and read back from there, where the fresh counts are
+        with db.engine.begin() as connection:
+            update_venue_areas(connection, stale)
+            rows = connection.execute(query.statement).all()
+
+    return [
+        {
+            "city": city,
+            "state": state,
+            "venues": [AreaVenue(row.venue_id, row.name, row.num_upcoming_shows) for row in group],
+        }
+        for (city, state), group in itertools.groupby(rows, key=lambda row: (row.city, row.state))
+    ]
+
+
+@event.listens_for(Show.venue_id, 'set', active_history=True)
+def _keep_previous_venue(target, value, oldvalue, initiator):
+    # active_history loads the old venue_id before it is overwritten, so a
+    # show moved between venues refreshes both of them
+    pass
+
+
+@event.listens_for(Session, 'after_flush')
+def _refresh_venue_areas(session, flush_context):
+    created, changed, deleted = set(), set(), set()
+    for instance in session.new:
+        if isinstance(instance, Venue):
+            created.add(instance.id)
+        elif isinstance(instance, Show):
+            changed.add(instance.venue_id)
+    for instance in session.dirty:
+        if isinstance(instance, Venue) and instance.deleted_at is not None:
+            # archived: off the listing right away, ahead of the purge
+            deleted.add(instance.id)
+        elif isinstance(instance, Venue) and session.is_modified(instance):
+            changed.add(instance.id)
+        elif isinstance(instance, Show):
+            history = get_history(instance, 'venue_id')
+            changed.update(history.unchanged or ())
+            changed.update(history.added or ())
+            changed.update(history.deleted or ())
+    for instance in session.deleted:
+        if isinstance(instance, Venue):
+            deleted.add(instance.id)
+        elif isinstance(instance, Show):
+            changed.add(instance.venue_id)
+
+    changed -= created | deleted
+    changed.discard(None)
+    if not (created or changed or deleted):
+        return
+    connection = session.connection()
+    delete_venue_areas(connection, deleted)
+    insert_venue_areas(connection, created)
+    update_venue_areas(connection, changed)
@@ -0,0 +1,182 @@
+import gzip
+import hashlib
+import json
+import mimetypes
+import os
+import posixpath
+import re
+from flask import current_app, request, send_from_directory, url_for
+
+#----------------------------------------------------------------------------#
+# Static assets.
+#
+# `flask build-assets` copies every file under static/ into static/build/ with
+# a content hash in its name (css/main.3f2a9c1b07de.css). Compressible files
+# also get a gzip variant, and a brotli one when the brotli package is
+# installed. The names are recorded in static/build/manifest.json. Templates
+# link through asset_url(), which gives the hashed URL when a manifest exists
+# and the plain /static URL otherwise. A hashed file never changes, so it is
+# served with a year-long immutable Cache-Control, precompressed in the best
+# encoding the client accepts.
+#----------------------------------------------------------------------------#
+
+BUILD_DIR = 'build'
+MANIFEST = 'manifest.json'
+
+COMPRESSIBLE = ('.css', '.js', '.map', '.svg', '.json', '.txt', '.ttf', '.otf', '.eot')
+# (Content-Encoding, file suffix), most preferred first
+ENCODINGS = [('br', '.br'), ('gzip', '.gz')]
+FAR_FUTURE = 365 * 24 * 3600
+
+# references to other assets that have to point at their hashed names
+REFERENCE_RES = {
+    '.css': re.compile(r'url\(\s*([\'"]?)(?P<ref>[^\'")]+)\1\s*\)'),
+    '.js': re.compile(r'//[#@] sourceMappingURL=(?P<ref>\S+)'),
+}
+
+
+#  Build
+#  ----------------------------------------------------------------
+
+def hashed_name(path, content):
+    root, extension = posixpath.splitext(path)
+    return '{}.{}{}'.format(root, hashlib.sha256(content).hexdigest()[:12], extension)
+
+
+def compressors():
+    yield 'gzip', lambda data: gzip.compress(data, compresslevel=9, mtime=0)
+    try:
+        import brotli
+    except ImportError:
+        return
+    yield 'br', lambda data: brotli.compress(data, quality=11)
+
+
+def rewrite_references(path, content, manifest):
+    # points relative references in a CSS/JS file at already hashed files
+    pattern = REFERENCE_RES.get(posixpath.splitext(path)[1])
+    if pattern is None:
+        return content
+    directory = posixpath.dirname(path)
+
+    def replace(match):
+        target, suffix = re.match(r'([^?#]*)(.*)', match.group('ref')).groups()
+        if not target or re.match(r'[a-z][a-z0-9+.-]*:|/', target, re.I):
+            # absolute URLs and data: URIs are left alone
+            return match.group(0)
+        resolved = posixpath.normpath(posixpath.join(directory, target))
+        if resolved not in manifest:
+            return match.group(0)
+        hashed = posixpath.relpath(manifest[resolved], directory or '.')
+        start, end = match.start('ref') - match.start(), match.end('ref') - match.start()
+        return match.group(0)[:start] + hashed + suffix + match.group(0)[end:]
+
+    return pattern.sub(replace, content.decode('utf-8')).encode('utf-8')
+
+
+def build_assets(static_folder):
+    # writes static/build/ and returns the manifest
+    build = os.path.join(static_folder, BUILD_DIR)
+    sources = []
+    for directory, subdirectories, files in os.walk(static_folder):
+        if os.path.abspath(directory) == os.path.abspath(static_folder) and BUILD_DIR in subdirectories:
+            subdirectories.remove(BUILD_DIR)
+        for name in files:
+            sources.append(os.path.relpath(os.path.join(directory, name), static_folder).replace(os.sep, '/'))
+
+    manifest = {'assets': {}, 'encodings': {}}
+    # files that reference others go last, once their targets have names
+    for path in sorted(sources, key=lambda path: (posixpath.splitext(path)[1] in REFERENCE_RES, path)):
+        with open(os.path.join(static_folder, path), 'rb') as stream:
+            content = rewrite_references(path, stream.read(), manifest['assets'])
+        target = hashed_name(path, content)
+        _write(build, target, content)
+        manifest['assets'][path] = target
+
+        if path.endswith(COMPRESSIBLE):
+            encodings = []
+            for encoding, compress in compressors():
+                compressed = compress(content)
+                if len(compressed) < len(content):
+                    _write(build, target + dict(ENCODINGS)[encoding], compressed)
+                    encodings.append(encoding)
+            if encodings:
+                manifest['encodings'][target] = encodings
+
+    with open(os.path.join(build, MANIFEST), 'w') as stream:
+        json.dump(manifest, stream, indent=2, sort_keys=True)
+    return manifest
+
+
+def _write(build, path, content):
+    destination = os.path.join(build, *path.split('/'))
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    with open(destination, 'wb') as stream:
+        stream.write(content)
+
+
+#  Serving
+#  ----------------------------------------------------------------
+
+class AssetState:
+    # one app's build folder and the manifest read from it
+
+    def __init__(self, build_folder):
+        self.build_folder = build_folder
+        self.manifest = {'assets': {}, 'encodings': {}}
+
+
+class Assets:
+    # the manifest is kept per app in app.extensions['assets']
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        state = app.extensions['assets'] = AssetState(os.path.join(app.static_folder, BUILD_DIR))
+        self.load(state)
+        app.add_url_rule(app.static_url_path + '/' + BUILD_DIR + '/<path:filename>',
+                         'built_asset', self.serve)
+        app.add_template_global(self.url, 'asset_url')
+
+    @staticmethod
+    def state():
+        return current_app.extensions['assets']
+
+    def load(self, state=None):
+        # no manifest (nothing built yet) means plain /static URLs
+        state = state or self.state()
+        try:
+            with open(os.path.join(state.build_folder, MANIFEST)) as stream:
+                state.manifest = json.load(stream)
+        except FileNotFoundError:
+            state.manifest = {'assets': {}, 'encodings': {}}
+
+    def url(self, path):
+        hashed = self.state().manifest['assets'].get(path)
+        if hashed is None:
+            return url_for('static', filename=path)
+        return url_for('built_asset', filename=hashed)
+
+    def serve(self, filename):
+        state = self.state()
+        served, encoding = filename, None
+        for name, suffix in ENCODINGS:
+            if name in state.manifest['encodings'].get(filename, ()) and name in request.accept_encodings:
+                served, encoding = filename + suffix, name
+                break
+
+        response = send_from_directory(
+            state.build_folder, served, mimetype=mimetypes.guess_type(filename)[0] or 'application/octet-stream',
+            max_age=FAR_FUTURE, conditional=True)
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+        if filename in state.manifest['encodings']:
+            response.vary.add('Accept-Encoding')
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+        return response
+
+
+assets = Assets()
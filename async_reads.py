@@ -0,0 +1,133 @@
+import asyncio
+import os
+import threading
+from flask import current_app, render_template
+from sqlalchemy.engine import make_url
+from models import db, Venue, Artist
+from cache import cache
+from details import build_detail, detail_stamp, detail_statements
+from routing import engine_options, replica_reads
+
+#----------------------------------------------------------------------------#
+# Async read path.
+#
+# With ASYNC_READS on, the venue and artist detail pages are served by async
+# views that send their five statements concurrently through an async engine
+# (asyncpg on Postgres, aiosqlite on SQLite) instead of one after another.
+#
+# Flask runs every async view on an event loop of its own, but pooled asyncpg
+# connections belong to the loop that opened them. So all queries run on one
+# long-lived loop in a background thread, where the async engines and their
+# pools live. The views only wait on that loop.
+#----------------------------------------------------------------------------#
+
+ASYNC_DRIVERS = {
+    'postgresql': 'postgresql+asyncpg',
+    'sqlite': 'sqlite+aiosqlite',
+}
+
+
+def async_url(url, root_path):
+    url = make_url(url)
+    url = url.set(drivername=ASYNC_DRIVERS[url.get_backend_name()])
+    if url.get_backend_name() == 'sqlite' and url.database not in (None, '', ':memory:'):
+        # relative to the app, the same as Flask-SQLAlchemy does for sync engines
+        url = url.set(database=os.path.join(root_path, url.database))
+    return url
+
+
+class AsyncReads:
+    # the loop thread is shared by the process; each app's async engines are
+    # kept in app.extensions['async_reads'], by bind
+
+    def __init__(self, app=None):
+        self.loop = None
+        self.lock = threading.Lock()
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # swaps the read views registered in app.py for their async versions
+        if not app.config.get('ASYNC_READS', False):
+            return
+        app.extensions['async_reads'] = {}
+        for endpoint, view in ASYNC_VIEWS.items():
+            app.view_functions[endpoint] = view
+
+    def _start_loop(self):
+        with self.lock:
+            if self.loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name='async-reads', daemon=True).start()
+                self.loop = loop
+        return self.loop
+
+    def _engine(self, app, bind):
+        # created on first use, one per (app, bind); only ever used on self.loop
+        from sqlalchemy.ext.asyncio import create_async_engine
+
+        engines = app.extensions['async_reads']
+        with self.lock:
+            if bind not in engines:
+                uri = app.config['SQLALCHEMY_BINDS'][bind] if bind else app.config['SQLALCHEMY_DATABASE_URI']
+                url = async_url(uri, app.root_path)
+                options = engine_options(url, app.config['SQLALCHEMY_ENGINE_OPTIONS'], app.config)
+                engines[bind] = create_async_engine(url, **options)
+            return engines[bind]
+
+    async def fetch_all(self, statements):
+        # rows for every statement, run concurrently on separate connections;
+        # reads follow the same primary/replica choice as the sync session
+        engine = self._engine(current_app._get_current_object(), db.read_bind())
+        future = asyncio.run_coroutine_threadsafe(_gather(engine, statements), self._start_loop())
+        return await asyncio.wrap_future(future)
+
+    def dispose(self):
+        # closes the current app's pooled connections, e.g. before forking workers
+        engines = current_app.extensions.get('async_reads', {})
+        loop, disposed = self.loop, list(engines.values())
+        engines.clear()
+        if loop is not None:
+            for engine in disposed:
+                asyncio.run_coroutine_threadsafe(engine.dispose(), loop).result()
+
+
+async def _fetch(engine, statement):
+    async with engine.connect() as connection:
+        result = await connection.execute(statement)
+        return result.all()
+
+
+async def _gather(engine, statements):
+    return await asyncio.gather(*(_fetch(engine, statement) for statement in statements))
+
+
+async_reads = AsyncReads()
+
+
+#  Views
+#  ----------------------------------------------------------------
+
+async def load_detail_async(model, entity_id, limit):
+    results = await async_reads.fetch_all(detail_statements(model, entity_id, limit))
+    return build_detail(model, entity_id, limit, results)
+
+
+@replica_reads
+@cache.cached_page('venue:{venue_id}', 'artists', stamp=detail_stamp(Venue))
+async def show_venue(venue_id):
+    venue = await load_detail_async(Venue, venue_id, current_app.config['DETAIL_SHOWS_PER_PAGE'])
+    return render_template('pages/show_venue.html', venue=venue)
+
+
+@replica_reads
+@cache.cached_page('artist:{artist_id}', 'venues', stamp=detail_stamp(Artist))
+async def show_artist(artist_id):
+    artist = await load_detail_async(Artist, artist_id, current_app.config['DETAIL_SHOWS_PER_PAGE'])
+    return render_template('pages/show_artist.html', artist=artist)
+
+
+ASYNC_VIEWS = {
+    'show_venue': show_venue,
+    'show_artist': show_artist,
+}
@@ -0,0 +1,258 @@
+import bisect
+import heapq
+import threading
+import time
+from array import array
+from flask import current_app
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from models import db, Venue, Artist
+from search import tokenize
+
+#----------------------------------------------------------------------------#
+# Name autocomplete.
+#
+# /autocomplete answers from an in-process prefix index over venue and artist
+# names instead of the database. Each name is indexed under its word
+# suffixes ("the blue note", "blue note", "note"), so a prefix of any word
+# matches. A lookup is one binary search plus a scan of at most `limit` live
+# entries.
+#
+# Committed ORM writes are applied to the index as they happen. Writes that
+# bypass the ORM (bulk imports) or happen in another worker are picked up by
+# a background rebuild: right away after reset(), otherwise once the index is
+# AUTOCOMPLETE_REFRESH_SECONDS old. Lookups keep using the old index meanwhile.
+#----------------------------------------------------------------------------#
+
+KINDS = {
+    'venues': Venue,
+    'artists': Artist,
+}
+
+# word suffixes indexed per name; later words are only reachable from earlier ones
+MAX_WORD_STARTS = 6
+
+
+def fold(text):
+    return ' '.join(tokenize(text))
+
+
+def name_keys(name):
+    words = tokenize(name)
+    return [' '.join(words[start:]) for start in range(min(len(words), MAX_WORD_STARTS))]
+
+
+class PrefixIndex:
+    # sorted keys with their ids in a parallel array, plus a small sorted
+    # buffer of recent additions that is merged in once it holds MERGE_AT
+    # entries. Entries of renamed or deleted rows are skipped on lookup and
+    # dropped by the next merge.
+
+    MERGE_AT = 4096
+
+    def __init__(self, rows=()):
+        self.names = {}
+        pairs = []
+        for row_id, name in rows:
+            self.names[row_id] = name
+            pairs.extend((key, row_id) for key in name_keys(name))
+        pairs.sort()
+        self.keys = [key for key, _ in pairs]
+        self.ids = array('q', [row_id for _, row_id in pairs])
+        self.pending = []
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, row_id, name):
+        self.names[row_id] = name
+        for key in name_keys(name):
+            bisect.insort(self.pending, (key, row_id))
+        if len(self.pending) >= self.MERGE_AT:
+            self._merge()
+
+    def remove(self, row_id):
+        self.names.pop(row_id, None)
+
+    def _live(self, key, row_id):
+        # the entry still describes a word suffix of the row's current name
+        name = self.names.get(row_id)
+        return name is not None and (' ' + fold(name)).endswith(' ' + key)
+
+    def _merge(self):
+        keys, ids, previous = [], array('q'), None
+        for entry in heapq.merge(zip(self.keys, self.ids), self.pending):
+            if entry != previous and self._live(*entry):
+                keys.append(entry[0])
+                ids.append(entry[1])
+            previous = entry
+        self.keys, self.ids, self.pending = keys, ids, []
+
+    def _scan(self, prefix):
+        # (key, id) for every entry starting with `prefix`, in key order
+        def merged_run():
+            for position in range(bisect.bisect_left(self.keys, prefix), len(self.keys)):
+                key = self.keys[position]
+                if not key.startswith(prefix):
+                    return
+                yield key, self.ids[position]
+
+        def pending_run():
+            for position in range(bisect.bisect_left(self.pending, (prefix,)), len(self.pending)):
+                if not self.pending[position][0].startswith(prefix):
+                    return
+                yield self.pending[position]
+
+        return heapq.merge(merged_run(), pending_run())
+
+    def lookup(self, prefix, limit, deadline=None):
+        # [(id, name)] for up to `limit` rows with a word starting with
+        # `prefix`; cut short at `deadline` (a perf_counter value)
+        matches, seen = [], set()
+        for scanned, (key, row_id) in enumerate(self._scan(prefix), 1):
+            if row_id not in seen and self._live(key, row_id):
+                seen.add(row_id)
+                matches.append((row_id, self.names[row_id]))
+                if len(matches) == limit:
+                    break
+            if deadline is not None and scanned % 256 == 0 and time.perf_counter() > deadline:
+                break
+        return matches
+
+
+class AutocompleteState:
+    # one app's indexes and their build bookkeeping
+
+    def __init__(self):
+        self.indexes = {}
+        self.built_at = None
+        self.stale = False
+        # changes committed while a rebuild reads the tables; replayed onto
+        # the new indexes before they replace the old ones
+        self.replay = None
+        self.lock = threading.Lock()
+        self.build_lock = threading.Lock()
+
+
+class Autocomplete:
+    # the indexes are kept per app in app.extensions['autocomplete']
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('AUTOCOMPLETE_LIMIT', 10)
+        app.config.setdefault('AUTOCOMPLETE_MAX_LIMIT', 50)
+        app.config.setdefault('AUTOCOMPLETE_BUDGET_MS', 5)
+        app.config.setdefault('AUTOCOMPLETE_REFRESH_SECONDS', 300)
+        app.config.setdefault('AUTOCOMPLETE_PRELOAD', True)
+        app.extensions['autocomplete'] = AutocompleteState()
+        if app.config['AUTOCOMPLETE_PRELOAD']:
+            # building reads every name, so it starts as soon as the app
+            # serves, off the request thread
+            app.before_first_request(lambda: self._rebuild_in_background(current_app._get_current_object()))
+
+    @staticmethod
+    def state():
+        return current_app.extensions['autocomplete']
+
+    def lookup(self, kind, term, limit):
+        # [{"id", "name"}] for names of `kind` ('venues' or 'artists') with a
+        # word starting with `term`
+        prefix = fold(term)
+        if not prefix:
+            return []
+        if term[-1:].isspace():
+            # "blue " completes the next word rather than "blue" itself
+            prefix += ' '
+        state = self.state()
+        self._ensure_fresh(state)
+
+        deadline = time.perf_counter() + current_app.config['AUTOCOMPLETE_BUDGET_MS'] / 1000
+        with state.lock:
+            matches = state.indexes[KINDS[kind]].lookup(prefix, limit, deadline)
+        return [{'id': row_id, 'name': name} for row_id, name in matches]
+
+    def reset(self):
+        # for writes that bypass the ORM; rebuilt in the background on the next lookup
+        self.state().stale = True
+
+    def _ensure_fresh(self, state):
+        if not state.indexes:
+            self._rebuild()
+        elif state.stale or time.monotonic() - state.built_at > current_app.config['AUTOCOMPLETE_REFRESH_SECONDS']:
+            self._rebuild_in_background(current_app._get_current_object())
+
+    def _rebuild_in_background(self, app):
+        def run():
+            with app.app_context():
+                self._rebuild()
+
+        if not app.extensions['autocomplete'].build_lock.locked():
+            threading.Thread(target=run, name='autocomplete-build', daemon=True).start()
+
+    def _rebuild(self):
+        state = self.state()
+        with state.build_lock:
+            if state.indexes and not state.stale and \
+                    time.monotonic() - state.built_at <= current_app.config['AUTOCOMPLETE_REFRESH_SECONDS']:
+                # another thread finished a build while this one waited
+                return
+            with state.lock:
+                state.stale = False
+                state.replay = []
+            indexes = {
+                model: PrefixIndex(db.session.query(model.id, model.name).yield_per(10000))
+                for model in KINDS.values()
+            }
+            with state.lock:
+                self._apply(indexes, state.replay)
+                state.indexes, state.replay = indexes, None
+                state.built_at = time.monotonic()
+
+    def apply(self, changes):
+        # changes: [(model, id, name or None for a delete)] from a committed session
+        state = self.state()
+        with state.lock:
+            if state.replay is not None:
+                state.replay.extend(changes)
+            self._apply(state.indexes, changes)
+
+    @staticmethod
+    def _apply(indexes, changes):
+        for model, row_id, name in changes:
+            index = indexes.get(model)
+            if index is None or (name is not None and index.names.get(row_id) == name):
+                continue
+            index.remove(row_id)
+            if name is not None:
+                index.add(row_id, name)
+
+
+autocomplete = Autocomplete()
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_name_changes(session, flush_context):
+    pending = session.info.setdefault('autocomplete_changes', [])
+    for instance in session.new.union(session.dirty):
+        if isinstance(instance, (Venue, Artist)):
+            # an archived venue leaves the index as if deleted
+            name = None if getattr(instance, 'deleted_at', None) else instance.name
+            pending.append((type(instance), instance.id, name))
+    for instance in session.deleted:
+        if isinstance(instance, (Venue, Artist)):
+            pending.append((type(instance), instance.id, None))
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_name_changes(session):
+    pending = session.info.pop('autocomplete_changes', None)
+    if pending:
+        autocomplete.apply(pending)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_name_changes(session):
+    session.info.pop('autocomplete_changes', None)
@@ -0,0 +1,692 @@
+import json
+import logging
+import os
+import platform
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import threading
+import tracemalloc
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+import click
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+#----------------------------------------------------------------------------#
+# Benchmark suite.
+#
+# Seeds a throwaway database with synthetic venues, artists and shows, then
+# drives every route through the Flask test client. For each route it reports
+# p50/p95/p99 latency, statements per request and peak allocated memory.
+#
+#   python benchmark.py --venues 500 --artists 2000 --shows 50000
+#   python benchmark.py --database postgresql://localhost/fyyur_bench
+#   python benchmark.py --compare benchmarks/<old>.json
+#   python benchmark.py --route autocomplete --autocomplete-names 1000000
+#   python benchmark.py --route '/venues' --startup-runs 20
+#   python benchmark.py --route none --projection-rows 50000
+#
+# Sync vs async detail pages under 16 concurrent clients:
+#
+#   python benchmark.py --route '<popular id>' --concurrency 16 --output sync.json
+#   ASYNC_READS=1 python benchmark.py --route '<popular id>' --concurrency 16 --compare sync.json
+#
+# Venue/artist popularity and city sizes are Zipf-distributed, so a few rows
+# own most of the shows, as in real listings. The same seed always produces
+# the same data.
+#----------------------------------------------------------------------------#
+
+CITIES = [
+    ('New York', 'NY'), ('Los Angeles', 'CA'), ('Chicago', 'IL'), ('Houston', 'TX'),
+    ('Phoenix', 'AZ'), ('Philadelphia', 'PA'), ('San Antonio', 'TX'), ('San Diego', 'CA'),
+    ('Dallas', 'TX'), ('Austin', 'TX'), ('San Francisco', 'CA'), ('Seattle', 'WA'),
+    ('Denver', 'CO'), ('Nashville', 'TN'), ('Boston', 'MA'), ('Portland', 'OR'),
+    ('Las Vegas', 'NV'), ('Memphis', 'TN'), ('Atlanta', 'GA'), ('Miami', 'FL'),
+    ('New Orleans', 'LA'), ('Minneapolis', 'MN'), ('Detroit', 'MI'), ('Baltimore', 'MD'),
+]
+
+ADJECTIVES = [
+    'Blue', 'Golden', 'Velvet', 'Electric', 'Silver', 'Midnight', 'Crimson', 'Lucky',
+    'Wild', 'Quiet', 'Neon', 'Rusty', 'Broken', 'Royal', 'Hidden', 'Little',
+]
+
+NOUNS = [
+    'Note', 'Room', 'Hall', 'Owl', 'Garden', 'Tavern', 'Echo', 'Lantern', 'Fox',
+    'Harbor', 'Parlor', 'Engine', 'Crow', 'Cellar', 'Pearl', 'Rebels',
+]
+
+GENRES = [
+    'Alternative', 'Blues', 'Classical', 'Country', 'Electronic', 'Folk', 'Funk',
+    'Hip-Hop', 'Heavy Metal', 'Instrumental', 'Jazz', 'Musical Theatre', 'Pop',
+    'Punk', 'R&B', 'Reggae', 'Rock n Roll', 'Soul', 'Other',
+]
+
+# draws per show before a slot that keeps clashing is given up
+SHOW_ATTEMPTS = 10
+
+# timed lookups (and renames) for --autocomplete-names
+AUTOCOMPLETE_LOOKUPS = 10000
+# shows per POST /api/v1/shows/batch
+BATCH_SHOWS = 50
+
+# cold start: a fresh interpreter importing app.py and running create_app()
+STARTUP_BUDGET_MS = 800
+STARTUP_SCRIPT = 'from app import create_app; create_app()'
+
+# --projection-rows: timed builds per approach, the best one is reported
+PROJECTION_REPEATS = 7
+
+
+#  Data generator
+#  ----------------------------------------------------------------
+
+def zipf_weights(count, exponent):
+    # cumulative weights for random.choices, rank 1 the most popular
+    total, cumulative = 0.0, []
+    for rank in range(1, count + 1):
+        total += 1.0 / rank ** exponent
+        cumulative.append(total)
+    return cumulative
+
+
+def entity_name(rng, number):
+    # the first few hundred names are unique, later ones are numbered
+    name = 'The {} {}'.format(rng.choice(ADJECTIVES), rng.choice(NOUNS))
+    return '{} {}'.format(name, number) if number >= len(ADJECTIVES) * len(NOUNS) else name
+
+
+def entity_rows(rng, count, cities, with_address):
+    city_weights = zipf_weights(len(cities), 1.1)
+    rows = []
+    for number in range(count):
+        city, state = rng.choices(cities, cum_weights=city_weights)[0]
+        row = {
+            'name': entity_name(rng, number),
+            'city': city,
+            'state': state,
+            'phone': '{:03d}-{:03d}-{:04d}'.format(rng.randrange(200, 999), rng.randrange(1000), rng.randrange(10000)),
+            'image_link': 'https://images.example.com/{}.jpg'.format(number),
+            'facebook_link': 'https://www.facebook.com/{}'.format(number),
+            'website_link': 'https://example.com/{}'.format(number),
+            'seeking_description': rng.choice(['', 'Looking for new talent on weekends.']),
+            'date_created': datetime.utcnow(),
+        }
+        if with_address:
+            row['address'] = '{} Main Street'.format(rng.randrange(1, 2000))
+        rows.append(row)
+    return rows
+
+
+def generate_data(venues, artists, shows, seed=0, skew=1.0):
+    # bulk-writes the synthetic dataset into the current app's database
+    from models import db, Genre, Venue, Artist, Show, venue_genres, artist_genres, DEFAULT_SHOW_MINUTES
+    from importer import write_rows
+    from areas import insert_venue_areas
+    from booking import Booking, BookingIndex, end_of
+
+    rng = random.Random(seed)
+    write_rows(Genre.__table__, [{'name': name} for name in GENRES])
+    genre_ids = [genre_id for (genre_id,) in db.session.query(Genre.id).order_by(Genre.id)]
+
+    venue_rows = entity_rows(rng, venues, CITIES, with_address=True)
+    for row in venue_rows:
+        row['seeking_talent'] = rng.random() < 0.3
+    artist_rows = entity_rows(rng, artists, CITIES, with_address=False)
+    for row in artist_rows:
+        row['seeking_venue'] = rng.random() < 0.3
+    write_rows(Venue.__table__, venue_rows)
+    write_rows(Artist.__table__, artist_rows)
+
+    # a fresh database hands out ids in insertion order
+    venue_ids = [venue_id for (venue_id,) in db.session.query(Venue.id).order_by(Venue.id)]
+    artist_ids = [artist_id for (artist_id,) in db.session.query(Artist.id).order_by(Artist.id)]
+
+    for link_table, column, ids in ((venue_genres, 'venue_id', venue_ids),
+                                    (artist_genres, 'artist_id', artist_ids)):
+        write_rows(link_table, [
+            {column: entity_id, 'genre_id': genre_id}
+            for entity_id in ids
+            for genre_id in rng.sample(genre_ids, rng.randint(1, 3))
+        ])
+
+    venue_weights = zipf_weights(len(venue_ids), skew)
+    artist_weights = zipf_weights(len(artist_ids), skew)
+    now = datetime.now().replace(minute=0, second=0, microsecond=0)
+    # shows may not overlap for a venue or an artist; a draw that would is
+    # retried a few times and then dropped, so skewed data can come out short
+    bookings = BookingIndex()
+    show_rows = []
+    for _ in range(shows):
+        for _attempt in range(SHOW_ATTEMPTS):
+            # spread over roughly a year either side of today, evenings only
+            day = now + timedelta(days=int(rng.gauss(0, 120)))
+            start = day.replace(hour=rng.randint(18, 23))
+            booking = Booking(
+                None,
+                rng.choices(venue_ids, cum_weights=venue_weights)[0],
+                rng.choices(artist_ids, cum_weights=artist_weights)[0],
+                start,
+                end_of(start, DEFAULT_SHOW_MINUTES),
+            )
+            if not bookings.conflicts(booking.venue_id, booking.artist_id, booking.start_time, booking.end_time):
+                break
+        else:
+            continue
+        bookings.add(booking)
+        show_rows.append({
+            'venue_id': booking.venue_id,
+            'artist_id': booking.artist_id,
+            'start_time': booking.start_time,
+            'duration_minutes': DEFAULT_SHOW_MINUTES,
+        })
+        if len(show_rows) == 10000:
+            write_rows(Show.__table__, show_rows)
+            show_rows = []
+    write_rows(Show.__table__, show_rows)
+    for start in range(0, len(venue_ids), 1000):
+        insert_venue_areas(db.session.connection(), venue_ids[start:start + 1000])
+    db.session.commit()
+    return venue_ids, artist_ids
+
+
+#  Routes
+#  ----------------------------------------------------------------
+
+def venue_form(number, prefix='Bench'):
+    return {
+        'name': '{} Venue {}'.format(prefix, number),
+        'city': 'New York',
+        'state': 'NY',
+        'address': '{} Broadway'.format(number),
+        'phone': '212-555-0100',
+        'image_link': '',
+        'genres': ['Jazz', 'Blues'],
+        'facebook_link': 'https://www.facebook.com/bench{}'.format(number),
+        'website_link': '',
+        'seeking_description': '',
+    }
+
+
+def artist_form(number, prefix='Bench'):
+    form = venue_form(number, prefix)
+    del form['address']
+    form['name'] = '{} Artist {}'.format(prefix, number)
+    return form
+
+
+def bench_requests(venue_ids, artist_ids, seed=0):
+    # (route, method, build) where build(i) returns (url, form data) for the
+    # i-th call. Reads come first; writes follow, and deletes run last.
+    rng = random.Random(seed)
+    popular_venue, popular_artist = venue_ids[0], artist_ids[0]
+
+    def fixed(url, data=None):
+        return lambda i: (url, data)
+
+    def show_form(i):
+        start = datetime.now() + timedelta(days=rng.randint(1, 365))
+        return '/shows/create', {
+            'artist_id': str(rng.choice(artist_ids)),
+            'venue_id': str(rng.choice(venue_ids)),
+            'start_time': start.strftime('%Y-%m-%d %H:%M:%S'),
+        }
+
+    def import_body(i):
+        start = datetime.now() + timedelta(days=400 + i)
+        return '/import/shows?format=ndjson', json.dumps({
+            'artist_id': rng.choice(artist_ids),
+            'venue_id': rng.choice(venue_ids),
+            'start_time': start.strftime('%Y-%m-%d %H:%M:%S'),
+        })
+
+    def show_batch(i):
+        # a tour: one show a day, clear of the seeded and imported ones
+        start = datetime.now() + timedelta(days=2000 + i * BATCH_SHOWS)
+        return '/api/v1/shows/batch', json.dumps({'shows': [{
+            'artist_id': rng.choice(artist_ids),
+            'venue_id': rng.choice(venue_ids),
+            'start_time': (start + timedelta(days=day)).strftime('%Y-%m-%d %H:%M:%S'),
+        } for day in range(BATCH_SHOWS)]})
+
+    return [
+        ('GET /', 'GET', fixed('/')),
+        ('GET /venues', 'GET', fixed('/venues')),
+        ('GET /venues?genre', 'GET', fixed('/venues?genre=Jazz')),
+        ('GET /venues/<id>', 'GET', lambda i: ('/venues/{}'.format(rng.choice(venue_ids)), None)),
+        ('GET /venues/<popular id>', 'GET', fixed('/venues/{}'.format(popular_venue))),
+        ('GET /venues/<popular id>/past-shows', 'GET', fixed('/venues/{}/past-shows'.format(popular_venue))),
+        ('POST /venues/search', 'POST', fixed('/venues/search', {'search_term': 'the blue'})),
+        ('GET /artists', 'GET', fixed('/artists')),
+        ('GET /artists/<id>', 'GET', lambda i: ('/artists/{}'.format(rng.choice(artist_ids)), None)),
+        ('GET /artists/<popular id>', 'GET', fixed('/artists/{}'.format(popular_artist))),
+        ('GET /artists/<popular id>/past-shows', 'GET', fixed('/artists/{}/past-shows'.format(popular_artist))),
+        ('POST /artists/search', 'POST', fixed('/artists/search', {'search_term': 'velvet'})),
+        ('GET /autocomplete', 'GET', lambda i: (
+            '/autocomplete?q=' + rng.choice(ADJECTIVES + NOUNS)[:rng.randint(1, 4)], None)),
+        ('GET /shows', 'GET', fixed('/shows')),
+        ('GET /shows?venue_id', 'GET', fixed('/shows?venue_id={}'.format(popular_venue))),
+        ('GET /api/v1/venues', 'GET', fixed('/api/v1/venues')),
+        ('GET /api/v1/artists/<id>', 'GET', lambda i: ('/api/v1/artists/{}'.format(rng.choice(artist_ids)), None)),
+        ('GET /api/v1/shows', 'GET', fixed('/api/v1/shows')),
+        ('GET /metrics', 'GET', fixed('/metrics')),
+        ('GET /venues/create', 'GET', fixed('/venues/create')),
+        ('GET /artists/create', 'GET', fixed('/artists/create')),
+        ('GET /shows/create', 'GET', fixed('/shows/create')),
+        ('GET /venues/<id>/edit', 'GET', fixed('/venues/{}/edit'.format(popular_venue))),
+        ('GET /artists/<id>/edit', 'GET', fixed('/artists/{}/edit'.format(popular_artist))),
+        ('POST /venues/create', 'POST', lambda i: ('/venues/create', venue_form(i))),
+        ('POST /artists/create', 'POST', lambda i: ('/artists/create', artist_form(i))),
+        ('POST /venues/<id>/edit', 'POST', lambda i: (
+            '/venues/{}/edit'.format(venue_ids[i % len(venue_ids)]), venue_form(i, 'Edited'))),
+        ('POST /artists/<id>/edit', 'POST', lambda i: (
+            '/artists/{}/edit'.format(artist_ids[i % len(artist_ids)]), artist_form(i, 'Edited'))),
+        ('POST /shows/create', 'POST', lambda i: show_form(i)),
+        ('POST /import/shows', 'POST', import_body),
+        ('POST /api/v1/shows/batch', 'POST', show_batch),
+        # least popular venues first, so the reads above measured a full dataset
+        ('POST /venues/<id>/delete', 'POST', lambda i: (
+            '/venues/{}/delete'.format(venue_ids[-(i % len(venue_ids)) - 1]), None)),
+    ]
+
+
+#  Measurement
+#  ----------------------------------------------------------------
+
+def percentile(sorted_values, fraction):
+    # nearest-rank percentile of an already sorted list
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(fraction * len(sorted_values))) - 1))
+    return sorted_values[index]
+
+
+class StatementCounter:
+    # counts statements on every engine, the same hook instrumentation.py uses
+
+    def __init__(self):
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def __enter__(self):
+        event.listen(Engine, 'after_cursor_execute', self.record)
+        return self
+
+    def __exit__(self, *exc_info):
+        event.remove(Engine, 'after_cursor_execute', self.record)
+
+    def record(self, conn, cursor, statement, parameters, context, executemany):
+        with self.lock:
+            self.count += 1
+
+
+def measure(app, requests, iterations, warmup, concurrency=1):
+    # each route gets `iterations` timed calls spread over `concurrency`
+    # threads, each with its own test client
+    local = threading.local()
+
+    def call(method, build, i):
+        if not hasattr(local, 'client'):
+            local.client = app.test_client()
+        url, data = build(i)
+        started = time.perf_counter()
+        response = local.client.open(url, method=method, data=data)
+        response.get_data()
+        return (time.perf_counter() - started) * 1000, response.status_code
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for route, method, build in requests:
+            for i in range(warmup):
+                call(method, build, i)
+
+            with StatementCounter() as counter:
+                started = time.perf_counter()
+                calls = list(pool.map(lambda i: call(method, build, i), range(warmup, warmup + iterations)))
+                elapsed = time.perf_counter() - started
+            timings = sorted(timing for timing, _ in calls)
+            statuses = Counter(status for _, status in calls)
+
+            # one extra call under tracemalloc; it slows requests down too much
+            # to leave on while timing
+            tracemalloc.start()
+            call(method, build, warmup + iterations)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+
+            results[route] = {
+                'p50_ms': round(percentile(timings, 0.50), 3),
+                'p95_ms': round(percentile(timings, 0.95), 3),
+                'p99_ms': round(percentile(timings, 0.99), 3),
+                'mean_ms': round(sum(timings) / len(timings), 3),
+                'requests_per_second': round(iterations / elapsed, 1),
+                'queries_per_request': round(counter.count / iterations, 2),
+                'peak_kib': round(peak / 1024, 1),
+                'statuses': {str(status): count for status, count in sorted(statuses.items())},
+            }
+            click.echo('{:<36} p50 {p50_ms:>8.2f}ms  p95 {p95_ms:>8.2f}ms  p99 {p99_ms:>8.2f}ms  '
+                       '{requests_per_second:>8.1f} req/s  queries {queries_per_request:>6}  '
+                       'peak {peak_kib:>9.1f}KiB'.format(route, **results[route]))
+    return results
+
+
+#  Autocomplete index
+#  ----------------------------------------------------------------
+
+def measure_autocomplete(count, seed, lookups, limit, budget_ms):
+    # builds autocomplete.PrefixIndex from `count` synthetic names without a
+    # database, then times lookups of 1-4 letter word prefixes and renames
+    from autocomplete import PrefixIndex
+
+    rng = random.Random(seed)
+    names = [(number, entity_name(rng, number)) for number in range(1, count + 1)]
+    words = sorted({word for word in ADJECTIVES + NOUNS} | {str(number) for number in range(10)})
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    index = PrefixIndex(names)
+    build_seconds = time.perf_counter() - started
+    rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+
+    timings = []
+    for _ in range(lookups):
+        prefix = rng.choice(words).lower()[:rng.randint(1, 4)]
+        started = time.perf_counter()
+        index.lookup(prefix, limit)
+        timings.append((time.perf_counter() - started) * 1000)
+    timings.sort()
+
+    # renames land in the pending buffer and are merged in every MERGE_AT keys
+    updates = []
+    for _ in range(min(lookups, count)):
+        row_id = rng.randint(1, count)
+        started = time.perf_counter()
+        index.remove(row_id)
+        index.add(row_id, entity_name(rng, row_id))
+        updates.append((time.perf_counter() - started) * 1000)
+    updates.sort()
+
+    result = {
+        'names': count,
+        'build_seconds': round(build_seconds, 2),
+        # ru_maxrss is KiB on Linux; the build is this process's peak
+        'max_rss_growth_kib': rss_growth,
+        'lookup_p50_ms': round(percentile(timings, 0.50), 3),
+        'lookup_p95_ms': round(percentile(timings, 0.95), 3),
+        'lookup_p99_ms': round(percentile(timings, 0.99), 3),
+        'update_p50_ms': round(percentile(updates, 0.50), 3),
+        'update_p99_ms': round(percentile(updates, 0.99), 3),
+        'budget_ms': budget_ms,
+    }
+    click.echo('autocomplete: {names} names built in {build_seconds}s (+{max_rss_growth_kib}KiB); lookup '
+               'p50 {lookup_p50_ms}ms p95 {lookup_p95_ms}ms p99 {lookup_p99_ms}ms; update p50 {update_p50_ms}ms '
+               'p99 {update_p99_ms}ms; budget {budget_ms}ms'.format(**result))
+    return result
+
+
+#  Row views
+#  ----------------------------------------------------------------
+
+def measure_projection(count, repeats):
+    # /shows rows turned into template data the way the route used to (a
+    # dict per row, positional indexing) and as projection.ShowListing
+    # views, timed on `count` rows read back from the seeded database. Each
+    # result is then read field by field the way templates read it.
+    from flask import current_app
+    from models import db, Venue, Artist, Show
+    from projection import ShowListing, project
+
+    rows = db.session.query(
+        Show.id, Show.venue_id, Venue.name, Show.artist_id, Artist.name, Artist.image_link, Show.start_time,
+    ).join(Venue, Venue.id == Show.venue_id).join(Artist, Artist.id == Show.artist_id).limit(count).all()
+    if not rows:
+        raise click.ClickException('--projection-rows needs seeded shows')
+    rows = (rows * -(-count // len(rows)))[:count]
+
+    def dicts():
+        shows_list = []
+        for show in rows:
+            show_info = {
+                "id": show[0],
+                "venue_id": show[1],
+                "venue_name": show[2],
+                "artist_id": show[3],
+                "artist_name": show[4],
+                "artist_image_link": show[5],
+                "start_time": show[6]
+                }
+            shows_list.append(show_info)
+        return shows_list
+
+    def views():
+        return project(ShowListing, rows)
+
+    def read(built):
+        for item in built:
+            for field in ShowListing._fields:
+                template_getattr(item, field)
+
+    template_getattr = current_app.jinja_env.getattr
+    result = {'rows': count}
+    for name, build in (('dicts', dicts), ('views', views)):
+        builds, reads = [], []
+        for _ in range(repeats):
+            started = time.perf_counter()
+            built = build()
+            builds.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            read(built)
+            reads.append(time.perf_counter() - started)
+        del built
+        tracemalloc.start()
+        built = build()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del built
+        result[name] = {
+            'build_ms': round(min(builds) * 1000, 2),
+            'read_ms': round(min(reads) * 1000, 2),
+            'peak_kib': round(peak / 1024, 1),
+        }
+    click.echo('projection of {} rows:'.format(count))
+    for name in ('dicts', 'views'):
+        click.echo('  {:6} build {build_ms}ms  template reads {read_ms}ms  peak {peak_kib}KiB'.format(
+            name, **result[name]))
+    return result
+
+
+#  Cold start
+#  ----------------------------------------------------------------
+
+def measure_startup(runs, budget_ms):
+    # wall time of `runs` fresh interpreters building the app, plus the
+    # slowest imports of the last one as reported by `python -X importtime`
+    timings, stderr = [], ''
+    for _ in range(runs):
+        started = time.perf_counter()
+        finished = subprocess.run([sys.executable, '-X', 'importtime', '-c', STARTUP_SCRIPT],
+                                  cwd=os.path.dirname(os.path.abspath(__file__)),
+                                  stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+        timings.append((time.perf_counter() - started) * 1000)
+        stderr = finished.stderr
+        if finished.returncode:
+            raise click.ClickException('create_app() failed:\n' + stderr)
+    timings.sort()
+
+    # "import time: self [us] | cumulative | package", nested names indented
+    imports = []
+    for line in stderr.splitlines():
+        fields = line.split('|')
+        if len(fields) == 3 and fields[1].strip().isdigit():
+            name = fields[2].rstrip()
+            imports.append((int(fields[1]), name.strip(), len(name) - len(name.lstrip())))
+    # what app.py pulls in directly, one level below the top
+    top_level = min((indent for _, _, indent in imports), default=0)
+    slowest = sorted((item for item in imports if item[2] == top_level + 2), reverse=True)[:8]
+
+    result = {
+        'runs': runs,
+        'p50_ms': round(percentile(timings, 0.50), 1),
+        'max_ms': round(timings[-1], 1),
+        'budget_ms': budget_ms,
+        'slowest_imports_ms': {name: round(cumulative / 1000, 1) for cumulative, name, _ in slowest},
+    }
+    click.echo('startup: p50 {p50_ms}ms, max {max_ms}ms over {runs} runs; budget {budget_ms}ms'.format(**result))
+    click.echo('  slowest imports: ' + ', '.join(
+        '{} {}ms'.format(name, ms) for name, ms in result['slowest_imports_ms'].items()))
+    return result
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def compare(old, new):
+    # per-route change against an earlier results file
+    click.echo('\n{:<36} {:>12} {:>12} {:>10} {:>10} {:>10}'.format(
+        'route', 'p95 before', 'p95 after', 'req/s', 'req/s', 'queries'))
+    for route, after in new['routes'].items():
+        before = old['routes'].get(route)
+        if before is None:
+            click.echo('{:<36} {:>12} {:>10.2f}ms {:>10} {:>10} {:>10}'.format(
+                route, '-', after['p95_ms'], '-', after.get('requests_per_second', '-'), after['queries_per_request']))
+            continue
+        change = (after['p95_ms'] / before['p95_ms'] - 1) * 100 if before['p95_ms'] else 0.0
+        click.echo('{:<36} {:>10.2f}ms {:>10.2f}ms {:>10} {:>10} {:>4} -> {:<4} (p95 {:+.0f}%)'.format(
+            route, before['p95_ms'], after['p95_ms'],
+            before.get('requests_per_second', '-'), after.get('requests_per_second', '-'),
+            before['queries_per_request'], after['queries_per_request'], change))
+
+
+@click.command()
+@click.option('--database', help='Empty database URL to seed; defaults to a temporary SQLite file.')
+@click.option('--venues', default=200, show_default=True)
+@click.option('--artists', default=500, show_default=True)
+@click.option('--shows', default=10000, show_default=True)
+@click.option('--skew', default=1.0, show_default=True, help='Zipf exponent for venue/artist popularity.')
+@click.option('--seed', default=0, show_default=True)
+@click.option('--iterations', default=50, show_default=True, help='Timed calls per route.')
+@click.option('--warmup', default=3, show_default=True, help='Untimed calls per route.')
+@click.option('--concurrency', default=1, show_default=True, help='Concurrent clients per route.')
+@click.option('--route', 'route_filters', multiple=True,
+              help='Only benchmark routes containing this text; may be repeated.')
+@click.option('--cache/--no-cache', default=False, show_default=True, help='Keep the page cache enabled.')
+@click.option('--output', type=click.Path(dir_okay=False),
+              help='Results file; defaults to benchmarks/<commit>.json.')
+@click.option('--compare', 'compare_with', type=click.Path(exists=True, dir_okay=False),
+              help='Earlier results file to compare against.')
+@click.option('--autocomplete-names', default=0, show_default=True,
+              help='Also benchmark the autocomplete index alone with this many names, e.g. 1000000.')
+@click.option('--projection-rows', default=0, show_default=True,
+              help='Also time building /shows template data from this many rows, dicts against row views.')
+@click.option('--startup-runs', default=5, show_default=True,
+              help='Fresh interpreters timed building the app; 0 skips the cold start check.')
+@click.option('--fail-on-error', is_flag=True,
+              help='Exit non-zero if any route answered with a 5xx or autocomplete or startup missed its budget.')
+def main(database, venues, artists, shows, skew, seed, iterations, warmup, concurrency,
+         route_filters, cache, output, compare_with, autocomplete_names, projection_rows, startup_runs,
+         fail_on_error):
+    """Seed a throwaway database and benchmark every route."""
+    # per-request query logs too; slow queries still show up in the report
+    logging.getLogger('fyyur.queries').setLevel(logging.ERROR)
+    temporary = None
+    if database is None:
+        temporary = tempfile.NamedTemporaryFile(prefix='fyyur-bench-', suffix='.db', delete=False)
+        temporary.close()
+        database = 'sqlite:///' + temporary.name
+
+    from app import create_app
+    from models import db, Venue, Show
+
+    app = create_app(settings={
+        'SQLALCHEMY_DATABASE_URI': database,
+        'WTF_CSRF_ENABLED': False,
+        'CACHE_ENABLED': cache,
+    })
+
+    try:
+        with app.app_context():
+            db.create_all()
+            if db.session.query(Venue.id).first() is not None:
+                raise click.ClickException('{} already has data; point --database at an empty one'.format(database))
+            started = time.perf_counter()
+            venue_ids, artist_ids = generate_data(venues, artists, shows, seed, skew)
+            seeded = time.perf_counter() - started
+            # overlapping draws are dropped, so there can be fewer shows than asked for
+            seeded_shows = db.session.query(Show.id).count()
+            click.echo('seeded {} venues, {} artists, {} shows in {:.1f}s'.format(venues, artists, seeded_shows, seeded))
+            dialect = db.engine.dialect.name
+            projection = measure_projection(projection_rows, PROJECTION_REPEATS) if projection_rows else None
+            db.session.remove()
+
+        requests = [
+            request for request in bench_requests(venue_ids, artist_ids, seed)
+            if not route_filters or any(text in request[0] for text in route_filters)
+        ]
+        routes = measure(app, requests, iterations, warmup, concurrency)
+    finally:
+        if temporary is not None:
+            os.unlink(temporary.name)
+
+    commit = git_commit()
+    results = {
+        'commit': commit,
+        'created': datetime.utcnow().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'database': dialect,
+        'dataset': {'venues': venues, 'artists': artists, 'shows': seeded_shows, 'skew': skew, 'seed': seed},
+        'iterations': iterations,
+        'warmup': warmup,
+        'cache': cache,
+        'concurrency': concurrency,
+        'async_reads': app.config['ASYNC_READS'],
+        # ru_maxrss is KiB on Linux
+        'max_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'routes': routes,
+    }
+    if autocomplete_names:
+        results['autocomplete'] = measure_autocomplete(
+            autocomplete_names, seed, AUTOCOMPLETE_LOOKUPS,
+            app.config['AUTOCOMPLETE_LIMIT'], app.config['AUTOCOMPLETE_BUDGET_MS'])
+    if projection is not None:
+        results['projection'] = projection
+    if startup_runs:
+        results['startup'] = measure_startup(startup_runs, STARTUP_BUDGET_MS)
+
+    output = output or os.path.join('benchmarks', '{}.json'.format(commit))
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as stream:
+        json.dump(results, stream, indent=2, sort_keys=True)
+    click.echo('results written to {}'.format(output))
+
+    if compare_with:
+        with open(compare_with) as stream:
+            compare(json.load(stream), results)
+
+    errors = [route for route, result in routes.items() if any(status.startswith('5') for status in result['statuses'])]
+    if errors:
+        click.echo('server errors on: ' + ', '.join(errors))
+        if fail_on_error:
+            raise SystemExit(1)
+    over_budget = results.get('autocomplete', {}).get('lookup_p99_ms', 0) > app.config['AUTOCOMPLETE_BUDGET_MS']
+    if over_budget:
+        click.echo('autocomplete p99 is over its {}ms budget'.format(app.config['AUTOCOMPLETE_BUDGET_MS']))
+        if fail_on_error:
+            raise SystemExit(1)
+    if results.get('startup', {}).get('p50_ms', 0) > STARTUP_BUDGET_MS:
+        click.echo('startup p50 is over its {}ms budget'.format(STARTUP_BUDGET_MS))
+        if fail_on_error:
+            raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,292 @@
+from collections import namedtuple
+from datetime import datetime, timedelta
+from sqlalchemy import func, literal_column, or_
+from sqlalchemy.exc import IntegrityError
+from models import db, Show, IdempotencyKey, DEFAULT_SHOW_MINUTES, MAX_SHOW_MINUTES
+
+#----------------------------------------------------------------------------#
+# Show booking.
+#
+# A show holds its venue and its artist for [start_time, start_time +
+# duration_minutes); no two shows of one venue or one artist may overlap.
+# On Postgres the shows_venue_no_overlap / shows_artist_no_overlap exclusion
+# constraints enforce this, and conflicts are looked up through their GiST
+# indexes. Elsewhere the shows that could overlap are read with one index
+# range scan (no show runs longer than MAX_SHOW_MINUTES) and checked against
+# an in-memory interval tree.
+#
+# A submission may carry an idempotency key; a retry with the same key gets
+# the show the first one booked (DuplicateSubmission) instead of a new one.
+#----------------------------------------------------------------------------#
+
+# Postgres SQLSTATE for a violated exclusion constraint
+EXCLUSION_VIOLATION = '23P01'
+
+Booking = namedtuple('Booking', 'id venue_id artist_id start_time end_time')
+
+
+class BookingConflict(Exception):
+    # .conflicts holds the Bookings in the way; empty when Postgres rejected
+    # the insert after a concurrent booking got there first
+
+    def __init__(self, conflicts):
+        super().__init__('show overlaps {} existing booking(s)'.format(len(conflicts)))
+        self.conflicts = conflicts
+
+
+class DuplicateSubmission(Exception):
+    # .show_id is the show booked by the first submission with this key
+
+    def __init__(self, show_id):
+        super().__init__('already booked as show {}'.format(show_id))
+        self.show_id = show_id
+
+
+def end_of(start_time, duration_minutes):
+    return start_time + timedelta(minutes=duration_minutes)
+
+
+def describe_conflict(booking, venue_id, artist_id):
+    # "venue 3 is booked from ... to ..." for the side that clashes
+    side = 'venue {}'.format(venue_id) if booking.venue_id == venue_id else 'artist {}'.format(artist_id)
+    return '{} is booked from {:%Y-%m-%d %H:%M} to {:%Y-%m-%d %H:%M}'.format(
+        side, booking.start_time, booking.end_time)
+
+
+#  Interval tree
+#  ----------------------------------------------------------------
+
+class IntervalTree:
+    # static tree over half-open (start, end, item) intervals: sorted by start,
+    # each node of the implicit balanced tree over that order keeps the latest
+    # end below it, so overlapping() only descends where something can overlap.
+    __slots__ = ('starts', 'ends', 'items', 'max_ends')
+
+    def __init__(self, intervals):
+        intervals = sorted(intervals, key=lambda interval: interval[0])
+        self.starts = [interval[0] for interval in intervals]
+        self.ends = [interval[1] for interval in intervals]
+        self.items = [interval[2] for interval in intervals]
+        self.max_ends = list(self.ends)
+        if intervals:
+            self._build(0, len(intervals))
+
+    def _build(self, lo, hi):
+        # fills max_ends for the subtree over [lo, hi), rooted at its middle
+        mid = (lo + hi) // 2
+        for child_lo, child_hi in ((lo, mid), (mid + 1, hi)):
+            if child_lo < child_hi:
+                self.max_ends[mid] = max(self.max_ends[mid], self._build(child_lo, child_hi))
+        return self.max_ends[mid]
+
+    def __len__(self):
+        return len(self.items)
+
+    def intervals(self):
+        return list(zip(self.starts, self.ends, self.items))
+
+    def overlapping(self, start, end):
+        found = []
+        ranges = [(0, len(self.items))]
+        while ranges:
+            lo, hi = ranges.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            if self.max_ends[mid] <= start:
+                # everything in this subtree is over before `start`
+                continue
+            ranges.append((lo, mid))
+            if self.starts[mid] < end:
+                if self.ends[mid] > start:
+                    found.append(self.items[mid])
+                ranges.append((mid + 1, hi))
+        return found
+
+
+class IntervalIndex:
+    # IntervalTrees that grow by merging equal-sized trees, like a binary
+    # counter: add() is amortized O(log^2 n) and a query asks O(log n) trees.
+    __slots__ = ('trees',)
+
+    def __init__(self, intervals=()):
+        intervals = list(intervals)
+        self.trees = [IntervalTree(intervals)] if intervals else []
+
+    def add(self, start, end, item):
+        intervals = [(start, end, item)]
+        while self.trees and len(self.trees[-1]) <= len(intervals):
+            intervals.extend(self.trees.pop().intervals())
+        self.trees.append(IntervalTree(intervals))
+
+    def overlapping(self, start, end):
+        return [item for tree in self.trees for item in tree.overlapping(start, end)]
+
+
+class BookingIndex:
+    # one IntervalIndex per venue and per artist
+
+    def __init__(self, bookings=()):
+        grouped = {}
+        for booking in bookings:
+            for key in self._keys(booking.venue_id, booking.artist_id):
+                grouped.setdefault(key, []).append((booking.start_time, booking.end_time, booking))
+        self.indexes = {key: IntervalIndex(intervals) for key, intervals in grouped.items()}
+
+    @staticmethod
+    def _keys(venue_id, artist_id):
+        return (('venue', venue_id), ('artist', artist_id))
+
+    @classmethod
+    def load(cls, venue_ids, artist_ids, start, end):
+        # every booking of these venues/artists that overlaps [start, end)
+        return cls(existing_bookings(
+            or_(Show.venue_id.in_(list(venue_ids)), Show.artist_id.in_(list(artist_ids))), start, end))
+
+    def add(self, booking):
+        for key in self._keys(booking.venue_id, booking.artist_id):
+            self.indexes.setdefault(key, IntervalIndex()).add(booking.start_time, booking.end_time, booking)
+
+    def conflicts(self, venue_id, artist_id, start_time, end_time, exclude_id=None):
+        found = {}
+        for key in self._keys(venue_id, artist_id):
+            index = self.indexes.get(key)
+            if index is not None:
+                for booking in index.overlapping(start_time, end_time):
+                    if exclude_id is None or booking.id != exclude_id:
+                        found[id(booking)] = booking
+        return sorted(found.values(), key=lambda booking: booking.start_time)
+
+
+#  Queries
+#  ----------------------------------------------------------------
+
+def existing_bookings(condition, start, end):
+    # Bookings matching `condition` that may overlap [start, end): the
+    # start_time bound keeps this to a range of the (venue_id | artist_id,
+    # start_time) indexes
+    rows = db.session.query(
+        Show.id, Show.venue_id, Show.artist_id, Show.start_time, Show.duration_minutes,
+    ).filter(
+        condition,
+        Show.start_time > start - timedelta(minutes=MAX_SHOW_MINUTES),
+        Show.start_time < end,
+    ).order_by(Show.start_time)
+    return [
+        Booking(row.id, row.venue_id, row.artist_id, row.start_time, end_of(row.start_time, row.duration_minutes))
+        for row in rows
+    ]
+
+
+def show_period():
+    # the same expression the exclusion constraints index
+    return func.tsrange(
+        Show.start_time, Show.start_time + Show.duration_minutes * literal_column("interval '1 minute'"))
+
+
+def find_conflicts(venue_id, artist_id, start_time, duration_minutes=DEFAULT_SHOW_MINUTES, exclude_id=None):
+    # Bookings of this venue or artist that overlap the proposed show
+    end_time = end_of(start_time, duration_minutes)
+    if db.engine.dialect.name != 'postgresql':
+        index = BookingIndex.load([venue_id], [artist_id], start_time, end_time)
+        return index.conflicts(venue_id, artist_id, start_time, end_time, exclude_id)
+
+    query = db.session.query(
+        Show.id, Show.venue_id, Show.artist_id, Show.start_time, Show.duration_minutes,
+    ).filter(
+        or_(Show.venue_id == venue_id, Show.artist_id == artist_id),
+        show_period().op('&&')(func.tsrange(start_time, end_time)),
+    ).order_by(Show.start_time)
+    if exclude_id is not None:
+        query = query.filter(Show.id != exclude_id)
+    return [
+        Booking(row.id, row.venue_id, row.artist_id, row.start_time, end_of(row.start_time, row.duration_minutes))
+        for row in query
+    ]
+
+
+def claim_key(key):
+    # inserts the key's row, or raises DuplicateSubmission when it is taken.
+    # Nothing else may be pending in the session: losing the race rolls back.
+    existing = db.session.get(IdempotencyKey, key)
+    if existing is None:
+        claim = IdempotencyKey(key=key)
+        db.session.add(claim)
+        try:
+            db.session.flush()
+            return claim
+        except IntegrityError:
+            # a concurrent submission with this key committed first
+            db.session.rollback()
+            existing = db.session.get(IdempotencyKey, key)
+    raise DuplicateSubmission(existing.show_id)
+
+
+def book_show(venue_id, artist_id, start_time, duration_minutes=DEFAULT_SHOW_MINUTES, idempotency_key=None):
+    # adds and flushes the Show, or raises BookingConflict (or
+    # DuplicateSubmission for a key seen before). The caller commits; a
+    # rollback releases the key for another try.
+    claim = claim_key(idempotency_key) if idempotency_key else None
+    conflicts = find_conflicts(venue_id, artist_id, start_time, duration_minutes)
+    if conflicts:
+        raise BookingConflict(conflicts)
+
+    show = Show(venue_id=venue_id, artist_id=artist_id, start_time=start_time,
+                duration_minutes=duration_minutes)
+    db.session.add(show)
+    try:
+        db.session.flush()
+    except IntegrityError as error:
+        if getattr(error.orig, 'pgcode', None) == EXCLUSION_VIOLATION:
+            raise BookingConflict([]) from error
+        raise
+    if claim is not None:
+        claim.show_id = show.id
+    return show
+
+
+#  Free slots
+#  ----------------------------------------------------------------
+
+def week_start(value=None):
+    # Monday 00:00 of an ISO week given as YYYY-Www; the current week by default
+    if not value:
+        today = datetime.now().date()
+        return datetime.combine(today - timedelta(days=today.weekday()), datetime.min.time())
+    return datetime.strptime(value + '-1', '%G-W%V-%u')
+
+
+def opening_windows(start, hours):
+    # [(open, close)] for the seven days from `start`, touching windows merged
+    windows = []
+    for day in range(7):
+        open_at = start + timedelta(days=day, hours=hours[0])
+        close_at = start + timedelta(days=day, hours=hours[1])
+        if windows and windows[-1][1] == open_at:
+            windows[-1] = (windows[-1][0], close_at)
+        else:
+            windows.append((open_at, close_at))
+    return windows
+
+
+def free_slots(venue_id, start, min_minutes=DEFAULT_SHOW_MINUTES, hours=(0, 24)):
+    # [(start, end)] gaps of at least min_minutes in the venue's week from
+    # `start`, within the daily opening `hours`. One index range scan of the
+    # venue's shows, then a single sweep over them in start order.
+    windows = opening_windows(start, hours)
+    busy = existing_bookings(Show.venue_id == venue_id, windows[0][0], windows[-1][1])
+    minimum = timedelta(minutes=min_minutes)
+
+    slots, position, busy_until = [], 0, windows[0][0]
+    for open_at, close_at in windows:
+        cursor = max(open_at, busy_until)
+        while position < len(busy) and busy[position].start_time < close_at:
+            booking = busy[position]
+            if booking.start_time - cursor >= minimum:
+                slots.append((cursor, booking.start_time))
+            cursor = max(cursor, booking.end_time)
+            busy_until = max(busy_until, booking.end_time)
+            position += 1
+        if close_at - cursor >= minimum:
+            slots.append((cursor, close_at))
+    return slots
@@ -0,0 +1,249 @@
+import functools
+import hashlib
+import importlib
+import os
+import pickle
+import threading
+import time
+from collections import OrderedDict
+from flask import current_app, request, session
+from routing import read_bind, sticks_to_primary
+
+#----------------------------------------------------------------------------#
+# Versioned response cache.
+#
+# Cached values are keyed on the versions of everything they were built from
+# ("venues", "venue:3", ...). Write handlers bump those versions, so a stale
+# entry is never looked up again and simply ages out of the LRU/TTL store.
+#
+# The default backend lives in process memory. Deployments running several
+# workers should set CACHE_BACKEND to a shared backend ('redis', or the dotted
+# path of any class with get/set/incr/counters) so every worker sees the same bumps.
+#
+# The same versions make the weak ETags on cached pages, so a client that
+# sends If-None-Match gets a 304 without the page being rendered or read.
+#
+# With a read replica, a page rendered just after a bump may come from a
+# replica that has not caught up with the write. Such a page is served but
+# neither stored nor tagged while any of its dependencies was bumped less
+# than REPLICA_STICKY_SECONDS ago. Replica and primary renders are stored
+# apart, and a client still sticky to the primary skips the cache entirely.
+#----------------------------------------------------------------------------#
+
+
+class MemoryBackend:
+    # LRU dict with per-entry expiry; safe to share between threads. Counters
+    # are kept apart so version numbers are never evicted and reused.
+
+    def __init__(self, max_entries=1024, **options):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.versions = {}
+        self.lock = threading.Lock()
+        # versions start over with the process, and so must ETags built on them
+        self.epoch = os.urandom(8).hex()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires is not None and expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def get_many(self, keys):
+        # get() for each key under one acquisition of the lock
+        now, values = time.monotonic(), []
+        with self.lock:
+            for key in keys:
+                entry = self.entries.get(key)
+                if entry is not None and entry[1] is not None and entry[1] < now:
+                    del self.entries[key]
+                    entry = None
+                if entry is not None:
+                    self.entries.move_to_end(key)
+                values.append(None if entry is None else entry[0])
+        return values
+
+    def counters(self, keys):
+        with self.lock:
+            return [self.versions.get(key, 0) for key in keys]
+
+    def set(self, key, value, ttl=None):
+        expires = time.monotonic() + ttl if ttl else None
+        with self.lock:
+            self.entries[key] = (value, expires)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def incr(self, key):
+        with self.lock:
+            self.versions[key] = self.versions.get(key, 0) + 1
+            return self.versions[key]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+class RedisBackend:
+    # shared backend for multi-worker deployments; eviction is left to redis
+
+    def __init__(self, url='redis://localhost:6379/0', prefix='fyyur:', **options):
+        import redis
+
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def get(self, key):
+        value = self.client.get(self.prefix + key)
+        return None if value is None else pickle.loads(value)
+
+    def counters(self, keys):
+        values = self.client.mget([self.prefix + key for key in keys])
+        return [int(value or 0) for value in values]
+
+    def set(self, key, value, ttl=None):
+        self.client.set(self.prefix + key, pickle.dumps(value), ex=ttl)
+
+    def incr(self, key):
+        # counters are plain redis integers, unlike the pickled values
+        return self.client.incr(self.prefix + key)
+
+    def clear(self):
+        for key in self.client.scan_iter(self.prefix + '*'):
+            self.client.delete(key)
+
+
+BACKENDS = {
+    'memory': MemoryBackend,
+    'redis': RedisBackend,
+}
+
+
+class CacheState:
+    # one app's backend and settings
+
+    def __init__(self, app):
+        name = app.config.get('CACHE_BACKEND', 'memory')
+        if name in BACKENDS:
+            backend_class = BACKENDS[name]
+        else:
+            module, _, attribute = name.rpartition('.')
+            backend_class = getattr(importlib.import_module(module), attribute)
+        self.backend = backend_class(**app.config.get('CACHE_OPTIONS', {}))
+        self.enabled = app.config.get('CACHE_ENABLED', True)
+        self.default_ttl = app.config.get('CACHE_DEFAULT_TTL', 60)
+        self.epoch = getattr(self.backend, 'epoch', '')
+        # how long after a bump a replica may still miss the write
+        self.replica_lag = app.config.get('REPLICA_STICKY_SECONDS', 5)
+
+
+class Cache:
+    # the backend and settings are kept per app in app.extensions['cache'],
+    # so apps built side by side by create_app() never share them
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.extensions['cache'] = CacheState(app)
+
+    @staticmethod
+    def state():
+        return current_app.extensions['cache']
+
+    @property
+    def enabled(self):
+        return self.state().enabled
+
+    @property
+    def backend(self):
+        return self.state().backend
+
+    def versions(self, dependencies):
+        return tuple(self.state().backend.counters(['version:' + name for name in dependencies]))
+
+    def bump(self, *dependencies):
+        # called by write handlers once their transaction has committed
+        state = self.state()
+        for name in dependencies:
+            state.backend.incr('version:' + name)
+            if state.replica_lag:
+                state.backend.set('bumped:' + name, time.time(), state.replica_lag)
+
+    def recently_bumped(self, dependencies):
+        # any of these bumped within the last replica_lag seconds
+        backend = self.state().backend
+        return any(backend.get('bumped:' + name) is not None for name in dependencies)
+
+    def memoize(self, key, dependencies, loader, ttl=None, versions=None):
+        # value of loader() cached under `key` until a dependency is bumped;
+        # `versions` saves the lookup when the caller already has them
+        state = self.state()
+        if not state.enabled:
+            return loader()
+        versioned_key = '{}|{}'.format(key, versions or self.versions(dependencies))
+        value = state.backend.get(versioned_key)
+        if value is None:
+            value = loader()
+            state.backend.set(versioned_key, value, ttl or state.default_ttl)
+        return value
+
+    def page_etag(self, versions, ttl, stamp):
+        # pages also change as shows move from upcoming to past, so the tag
+        # turns over once per TTL even without writes
+        state = self.state()
+        period = int(time.time() // (ttl or state.default_ttl or 60))
+        key = repr((request.full_path, state.epoch, versions, period, stamp))
+        return hashlib.sha1(key.encode()).hexdigest()
+
+    def cached_page(self, *dependencies, ttl=None, stamp=None):
+        # caches a view's rendered output; dependencies may use the view's
+        # arguments, e.g. cache.cached_page('venue:{venue_id}', 'artists').
+        # GET responses carry a weak ETag over the same versions plus
+        # stamp(**kwargs) (e.g. the entity's date_created); a matching
+        # If-None-Match is answered with 304 before the view runs. A stamp of
+        # None means the entity is gone, and the view answers as usual.
+        def decorator(view):
+            @functools.wraps(view)
+            def wrapper(**kwargs):
+                # async views are run to completion, so what gets cached is
+                # the response rather than a coroutine
+                render = current_app.ensure_sync(view)
+                # pages with pending flash messages are personal; render them
+                # fresh, as are pages for a client that just wrote (read-your-writes)
+                if request.method != 'GET' or session.get('_flashes') or sticks_to_primary():
+                    return render(**kwargs)
+                names = [name.format(**kwargs) for name in dependencies]
+                bind = read_bind()
+                if bind is not None and self.recently_bumped(names):
+                    # the replica may not have the write behind the bump yet
+                    return render(**kwargs)
+                versions = self.versions(names)
+                marker = stamp(**kwargs) if stamp is not None else ''
+                if marker is None:
+                    return render(**kwargs)
+
+                etag = self.page_etag(versions, ttl, marker)
+                if request.if_none_match.contains_weak(etag):
+                    response = current_app.response_class(status=304)
+                else:
+                    response = current_app.make_response(self.memoize(
+                        'page:{}:{}'.format(bind or 'primary', request.full_path),
+                        names, lambda: render(**kwargs), ttl, versions))
+                response.set_etag(etag, weak=True)
+                # stored, but revalidated on every use
+                response.cache_control.no_cache = True
+                return response
+            return wrapper
+        return decorator
+
+
+cache = Cache()
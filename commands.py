@@ -0,0 +1,234 @@
+import json
+import threading
+import click
+from flask import current_app
+from flask.cli import with_appcontext
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from models import db, Venue, Artist
+from assets import assets, build_assets
+from cache import cache
+from removal import archived_venue_ids, purge_venue
+from areas import rebuild_venue_areas
+from jobs import Worker
+
+#----------------------------------------------------------------------------#
+# CLI commands.
+#----------------------------------------------------------------------------#
+
+
+def register_commands(app):
+    app.cli.add_command(explain_check)
+    app.cli.add_command(import_command)
+    app.cli.add_command(build_assets_command)
+    app.cli.add_command(purge_venues_command)
+    app.cli.add_command(rebuild_venue_areas_command)
+    app.cli.add_command(worker_command)
+
+
+#  EXPLAIN check
+#  ----------------------------------------------------------------
+
+def checked_requests():
+    # (method, url, form data) for every read route; detail pages use the first ids
+    venue_id = db.session.query(Venue.id).order_by(Venue.id).limit(1).scalar() or 1
+    artist_id = db.session.query(Artist.id).order_by(Artist.id).limit(1).scalar() or 1
+    return [
+        ('GET', '/venues', None),
+        ('GET', '/artists', None),
+        ('GET', '/shows', None),
+        ('GET', '/shows?venue_id={}'.format(venue_id), None),
+        ('GET', '/shows?artist_id={}'.format(artist_id), None),
+        ('GET', '/venues/{}'.format(venue_id), None),
+        ('GET', '/artists/{}'.format(artist_id), None),
+        ('POST', '/venues/search', {'search_term': 'the'}),
+        ('POST', '/artists/search', {'search_term': 'the'}),
+    ]
+
+
+def capture_statements(app, requests):
+    # runs each request through the test client and records its SELECTs with
+    # the engine that ran them, so replica reads are EXPLAINed on the
+    # replica. Every request runs once unrecorded first: one-time warmup
+    # (the search fallback index, lookup caches) is not what a route costs.
+    # Only this thread is recorded, not the autocomplete index rebuilding in
+    # the background, and the page cache is off so every request queries.
+    captured = []
+    thread = threading.get_ident()
+    recording = False
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if recording and threading.get_ident() == thread and statement.lstrip().upper().startswith('SELECT'):
+            captured[-1][1].append((conn.engine, statement, parameters))
+
+    client = app.test_client()
+    state = cache.state()
+    cache_enabled, state.enabled = state.enabled, False
+    event.listen(Engine, 'before_cursor_execute', record)
+    try:
+        for method, url, data in requests:
+            client.open(url, method=method, data=data)
+        recording = True
+        for method, url, data in requests:
+            captured.append(('{} {}'.format(method, url), []))
+            client.open(url, method=method, data=data)
+    finally:
+        event.remove(Engine, 'before_cursor_execute', record)
+        state.enabled = cache_enabled
+    return captured
+
+
+def postgres_seq_scans(connection, statement, parameters, threshold):
+    plan = connection.exec_driver_sql('EXPLAIN (FORMAT JSON) ' + statement, parameters).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    scans = []
+    nodes = [plan[0]['Plan']]
+    while nodes:
+        node = nodes.pop()
+        if node['Node Type'] == 'Seq Scan' and node['Plan Rows'] > threshold:
+            scans.append((node['Relation Name'], node['Plan Rows']))
+        nodes.extend(node.get('Plans', []))
+    return scans
+
+
+def sqlite_seq_scans(connection, statement, parameters, threshold):
+    # SQLite plans carry no row estimates, so full scans are sized by table count
+    scans = []
+    for row in connection.exec_driver_sql('EXPLAIN QUERY PLAN ' + statement, parameters):
+        detail = row[-1].split()
+        if detail[0] == 'SCAN' and 'USING' not in detail:
+            table = detail[2] if detail[1] == 'TABLE' else detail[1]
+            if table not in db.metadata.tables:
+                # scans of subqueries are covered by the plan rows of their tables
+                continue
+            rows = connection.exec_driver_sql('SELECT count(*) FROM "{}"'.format(table)).scalar()
+            if rows > threshold:
+                scans.append((table, rows))
+    return scans
+
+
+@click.command('explain-check')
+@click.option('--threshold', default=1000, show_default=True,
+              help='Largest table (in rows) that may be read with a sequential scan.')
+@with_appcontext
+def explain_check(threshold):
+    """EXPLAIN every read route's queries and fail on large sequential scans."""
+    check = {
+        'postgresql': postgres_seq_scans,
+        'sqlite': sqlite_seq_scans,
+    }.get(db.engine.dialect.name)
+    if check is None:
+        raise click.ClickException('explain-check supports postgresql and sqlite only')
+
+    failures = 0
+    captured = capture_statements(current_app, checked_requests())
+    connections = {}
+    try:
+        for route, statements in captured:
+            for engine, statement, parameters in statements:
+                if engine not in connections:
+                    connections[engine] = engine.connect()
+                for table, rows in check(connections[engine], statement, parameters, threshold):
+                    failures += 1
+                    click.echo('{}: sequential scan on {} (~{} rows)\n    {}'.format(
+                        route, table, rows, ' '.join(statement.split())))
+    finally:
+        for connection in connections.values():
+            connection.close()
+
+    if failures:
+        raise click.ClickException('{} sequential scan(s) above {} rows'.format(failures, threshold))
+    click.echo('ok: no sequential scans above {} rows across {} routes'.format(threshold, len(captured)))
+
+
+#  Bulk import
+#  ----------------------------------------------------------------
+
+@click.command('import')
+# importer.KINDS, spelled out so that starting the app does not load the forms
+@click.argument('kind', type=click.Choice(['artists', 'shows', 'venues']))
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'format', type=click.Choice(['csv', 'ndjson']),
+              help='Input format; guessed from the file extension by default.')
+@click.option('--batch-size', default=1000, show_default=True)
+@click.option('--background', is_flag=True, help='Queue the batches for `flask worker` instead of writing them now.')
+@with_appcontext
+def import_command(kind, path, format, batch_size, background):
+    """Bulk-load venues, artists or shows from a CSV or NDJSON file."""
+    from importer import guess_format, import_records, queue_import, read_records
+
+    if background:
+        with open(path, newline='', encoding='utf-8') as stream:
+            chunks = queue_import(kind, read_records(stream, format or guess_format(path)), batch_size)
+        db.session.commit()
+        click.echo('{} batch(es) queued'.format(chunks))
+        return
+
+    def progress(report):
+        click.echo('{kind}: {read} read, {inserted} inserted, {duplicates} duplicate, '
+                   '{invalid} invalid ({rows_per_second} rows/s)'.format(**report.as_dict()))
+
+    with open(path, newline='', encoding='utf-8') as stream:
+        records = read_records(stream, format or guess_format(path))
+        report = import_records(kind, records, batch_size=batch_size, progress=progress)
+
+    for error in report.errors:
+        click.echo('line {line}: {errors}'.format(line=error['line'], errors='; '.join(error['errors'])))
+    click.echo('done in {seconds}s'.format(**report.as_dict()))
+
+
+#  Static assets
+#  ----------------------------------------------------------------
+
+@click.command('build-assets')
+@with_appcontext
+def build_assets_command():
+    """Write content-hashed, precompressed copies of static/ to static/build/."""
+    manifest = build_assets(current_app.static_folder)
+    assets.load()
+    click.echo('{} assets, {} with precompressed variants'.format(
+        len(manifest['assets']), len(manifest['encodings'])))
+
+
+#  Archived venues
+#  ----------------------------------------------------------------
+
+@click.command('purge-venues')
+@click.option('--chunk-size', type=int, help='Shows deleted per transaction; VENUE_PURGE_CHUNK by default.')
+@with_appcontext
+def purge_venues_command(chunk_size):
+    """Finish removing archived venues whose background purge did not complete."""
+    chunk_size = chunk_size or current_app.config['VENUE_PURGE_CHUNK']
+    venue_ids = archived_venue_ids()
+    for venue_id in venue_ids:
+        purge_venue(venue_id, chunk_size)
+    click.echo('{} archived venue(s) purged'.format(len(venue_ids)))
+
+
+#  Venue area rollup
+#  ----------------------------------------------------------------
+
+@click.command('rebuild-venue-areas')
+@with_appcontext
+def rebuild_venue_areas_command():
+    """Recompute the whole /venues area rollup from venues and shows."""
+    rebuild_venue_areas(db.session.connection())
+    db.session.commit()
+    cache.bump('venues')
+    click.echo('venue areas rebuilt')
+
+
+#  Background jobs
+#  ----------------------------------------------------------------
+
+@click.command('worker')
+@click.option('--concurrency', type=int, help='Jobs run at once; JOBS_CONCURRENCY by default.')
+@click.option('--burst', is_flag=True, help='Exit once no job is due instead of waiting for more.')
+@with_appcontext
+def worker_command(concurrency, burst):
+    """Run queued background jobs until interrupted."""
+    worker = Worker(current_app._get_current_object(), concurrency, burst)
+    click.echo('worker {} running {} job(s) at a time'.format(worker.name, worker.concurrency))
+    worker.run()
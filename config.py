@@ -6,8 +6,87 @@ basedir = os.path.abspath(os.path.dirname(__file__))
 # Enable debug mode.
 DEBUG = True
 
-# TODO IMPLEMENT DATABASE URL
-SQLALCHEMY_DATABASE_URI = 'postgresql://postgres@localhost:5432/fyyur'
+# Primary database. Heroku-style postgres:// URLs are accepted.
+SQLALCHEMY_DATABASE_URI = os.environ.get(
+    'DATABASE_URL', 'postgresql://postgres@localhost:5432/fyyur'
+).replace('postgres://', 'postgresql://', 1)
+
+# Optional read replica for the read-only routes (see routing.py). Clients
+# that just wrote keep reading from the primary for REPLICA_STICKY_SECONDS.
+if os.environ.get('DATABASE_REPLICA_URL'):
+    SQLALCHEMY_BINDS = {
+        'replica': os.environ['DATABASE_REPLICA_URL'].replace('postgres://', 'postgresql://', 1),
+    }
+REPLICA_STICKY_SECONDS = int(os.environ.get('REPLICA_STICKY_SECONDS', 5))
+
+# Connection pool, applied to the primary and the replica. Pool sizing is
+# ignored for SQLite. DB_STATEMENT_TIMEOUT_MS (Postgres only) cancels any
+# statement running longer; 0 disables it.
+SQLALCHEMY_ENGINE_OPTIONS = {
+    'pool_size': int(os.environ.get('DB_POOL_SIZE', 5)),
+    'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 10)),
+    'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+    'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+    'pool_pre_ping': os.environ.get('DB_POOL_PRE_PING', '1') == '1',
+}
+DB_STATEMENT_TIMEOUT_MS = int(os.environ.get('DB_STATEMENT_TIMEOUT_MS', 0))
+
+# Serve the venue/artist detail pages through async views that run their
+# queries concurrently (see async_reads.py). Needs flask[async] plus asyncpg,
+# or aiosqlite for SQLite.
+ASYNC_READS = os.environ.get('ASYNC_READS') == '1'
 
 SQLALCHEMY_TRACK_MODIFICATIONS = False
+
+# Page size for keyset-paginated listings.
+SHOWS_PER_PAGE = 30
+SHOWS_MAX_PER_PAGE = 100
+SEARCH_PER_PAGE = 20
+# Upcoming / past shows listed per section on venue and artist pages.
+DETAIL_SHOWS_PER_PAGE = 12
+# Shows accepted by one POST /api/v1/shows/batch.
+SHOW_BATCH_MAX_ROWS = 500
+# Deleting a venue: 'hard' removes it and its shows in one transaction;
+# 'archive' hides it at once and purges its shows in the background,
+# VENUE_PURGE_CHUNK per transaction.
+VENUE_DELETE_MODE = 'hard'
+VENUE_PURGE_CHUNK = 500
+
+# Background jobs, run by `flask worker` from the jobs table. A failed job is
+# retried after JOBS_BACKOFF_SECONDS, doubling up to JOBS_BACKOFF_MAX_SECONDS,
+# JOBS_MAX_ATTEMPTS times in all. A running job whose worker has been gone for
+# JOBS_LEASE_SECONDS is run again. JOBS_SCHEDULE: kind -> seconds between runs.
+JOBS_CONCURRENCY = 2
+JOBS_POLL_SECONDS = 1
+JOBS_MAX_ATTEMPTS = 5
+JOBS_BACKOFF_SECONDS = 10
+JOBS_BACKOFF_MAX_SECONDS = 3600
+JOBS_LEASE_SECONDS = 600
+JOBS_SCHEDULE = {'refresh_venue_areas': 60, 'warm_cache': 60}
+
+# /autocomplete: matches returned by default and at most, and the time a
+# lookup may take before it returns what it has. The in-process name index
+# is rebuilt in the background this often to pick up other workers' writes.
+AUTOCOMPLETE_LIMIT = 10
+AUTOCOMPLETE_MAX_LIMIT = 50
+AUTOCOMPLETE_BUDGET_MS = 5
+AUTOCOMPLETE_REFRESH_SECONDS = 300
+
+# Response cache. Use a shared backend ('redis' or a dotted class path) when
+# running more than one worker so writes invalidate pages everywhere.
+CACHE_ENABLED = True
+CACHE_BACKEND = 'memory'
+CACHE_OPTIONS = {'max_entries': 1024}
+CACHE_DEFAULT_TTL = 60
+# Pages the warm_cache job renders ahead of visitors (shared backends only).
+CACHE_WARM_URLS = ['/', '/venues', '/artists', '/shows']
+# Rendered show tiles kept per process (fragments.py).
+FRAGMENT_CACHE_ENTRIES = 20000
+
+# Query profiling. Every request logs its statement count, DB time, rows and
+# template time to the 'fyyur.queries' logger; totals are served at /metrics.
+# QUERY_DEBUG_HEADER adds the same numbers as an X-Query-Stats header.
+QUERY_DEBUG_HEADER = DEBUG
+SLOW_QUERY_MS = 200
+N_PLUS_ONE_THRESHOLD = 3
 PYTHONUNBUFFERED = ""
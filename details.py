@@ -0,0 +1,106 @@
+from datetime import datetime
+from flask import url_for
+from sqlalchemy import select
+from models import db, Venue, Artist
+from aggregates import show_counts
+from genres import genre_names_statement, group_genre_names
+from schedule import show_page_query, show_page_result
+
+#----------------------------------------------------------------------------#
+# Venue / Artist detail pages.
+#
+# A detail page is five independent statements: the entity row, one page of
+# upcoming shows, one page of past shows, the show counts and the genres.
+# load_detail() runs them one after another on the request session. The
+# async read path (async_reads.py) sends the same statements concurrently
+# and builds the page with the same build_detail().
+#----------------------------------------------------------------------------#
+
+# (template key, column) for the entity row
+DETAIL_FIELDS = {
+    Venue: [
+        ('id', Venue.id), ('name', Venue.name), ('address', Venue.address),
+        ('city', Venue.city), ('state', Venue.state), ('phone', Venue.phone),
+        ('website', Venue.website_link), ('facebook_link', Venue.facebook_link),
+        ('seeking_talent', Venue.seeking_talent), ('seeking_description', Venue.seeking_description),
+        ('image_link', Venue.image_link),
+    ],
+    Artist: [
+        ('id', Artist.id), ('name', Artist.name), ('city', Artist.city),
+        ('state', Artist.state), ('phone', Artist.phone), ('website', Artist.website_link),
+        ('facebook_link', Artist.facebook_link), ('seeking_venue', Artist.seeking_venue),
+        ('seeking_description', Artist.seeking_description), ('image_link', Artist.image_link),
+    ],
+}
+
+PAST_SHOWS_ENDPOINTS = {
+    Venue: 'venue_past_shows',
+    Artist: 'artist_past_shows',
+}
+
+
+def detail_statements(model, entity_id, limit):
+    # the async path runs these on a Core connection, outside the ORM filter
+    # that hides archived venues (removal.py): a venue's own row, and the
+    # venue joined to each of an artist's shows, are filtered explicitly
+    entity = select(*[column.label(key) for key, column in DETAIL_FIELDS[model]]).where(model.id == entity_id)
+    upcoming = show_page_query(model, entity_id, past=False, limit=limit).statement
+    past = show_page_query(model, entity_id, past=True, limit=limit).statement
+    if model is Venue:
+        entity = entity.where(Venue.deleted_at.is_(None))
+    else:
+        upcoming = upcoming.where(Venue.deleted_at.is_(None))
+        past = past.where(Venue.deleted_at.is_(None))
+    return [
+        entity,
+        upcoming,
+        past,
+        select(show_counts(model, [entity_id])),
+        genre_names_statement(model, [entity_id]),
+    ]
+
+
+def detail_stamp(model):
+    # cache.cached_page stamp: the entity's date_created, None when it does
+    # not exist. Keeps page ETags apart for a row re-created under an old id.
+    key = model.__name__.lower() + '_id'
+
+    def stamp(**kwargs):
+        return db.session.query(model.date_created).filter(model.id == kwargs[key]).scalar()
+    return stamp
+
+
+def upcoming_shows_url(**filters):
+    # the rest of an entity's upcoming shows continue on /shows
+    return url_for('shows', **dict(filters, **{'from': datetime.now().date().isoformat()}))
+
+
+def build_detail(model, entity_id, limit, results):
+    # template data from the rows of detail_statements(), in the same order;
+    # {} when the entity does not exist
+    entity_rows, upcoming_rows, past_rows, count_rows, genre_rows = results
+    if not entity_rows:
+        return {}
+
+    key = model.__name__.lower() + '_id'
+    upcoming_shows, more_upcoming = show_page_result(model, upcoming_rows, limit)
+    past_shows, past_cursor = show_page_result(model, past_rows, limit)
+    upcoming_count, past_count = (
+        (count_rows[0].num_upcoming_shows, count_rows[0].num_past_shows) if count_rows else (0, 0))
+
+    detail = dict(entity_rows[0]._mapping)
+    detail.update({
+        "genres": group_genre_names([entity_id], genre_rows)[entity_id],
+        "past_shows": past_shows,
+        "upcoming_shows": upcoming_shows,
+        "past_shows_count": past_count,
+        "upcoming_shows_count": upcoming_count,
+        "more_upcoming_url": upcoming_shows_url(**{key: entity_id}) if more_upcoming else None,
+        "more_past_url": url_for(PAST_SHOWS_ENDPOINTS[model], after=past_cursor, **{key: entity_id}) if past_cursor else None,
+    })
+    return detail
+
+
+def load_detail(model, entity_id, limit):
+    results = [db.session.execute(statement).all() for statement in detail_statements(model, entity_id, limit)]
+    return build_detail(model, entity_id, limit, results)
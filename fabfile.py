@@ -7,12 +7,27 @@ from fabric.contrib.console import confirm
 def test():
     with settings(warn_only=True):
         result = local(
-            "python test_tasks.py -v && python test_users.py -v", capture=True
+            "python benchmark.py --iterations 5 --fail-on-error", capture=True
         )
     if result.failed and not confirm("Tests failed. Continue?"):
         abort("Aborted at user request.")
 
 
+def benchmark(compare=None):
+    # full run; pass compare=benchmarks/<commit>.json to diff against it
+    local("python benchmark.py" + (" --compare {}".format(compare) if compare else ""))
+
+
+def assets():
+    # content-hashed, precompressed static files in static/build/
+    local("flask build-assets")
+
+
+def worker():
+    # background jobs: purges, rollup refreshes, queued imports, cache warming
+    local("flask worker")
+
+
 def commit():
     message = raw_input("Enter a git commit message: ")
     local("git add . && git commit -am '{}'".format(message))
@@ -40,7 +55,7 @@ def heroku():
 
 def heroku_test():
     local(
-        "heroku run python test_tasks.py -v && heroku run python test_users.py -v"
+        "heroku run python benchmark.py --iterations 5 --fail-on-error"
     )
 
 
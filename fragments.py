@@ -0,0 +1,72 @@
+from flask import current_app
+from markupsafe import Markup
+from cache import cache, MemoryBackend
+
+#----------------------------------------------------------------------------#
+# Show tile fragments.
+#
+# /shows, the venue and artist pages and the past-show pages all list shows
+# as tiles. The show_tiles() template global returns a page's tiles as one
+# string. Each tile is rendered once from fragments/show_tile.html and kept
+# under the show's id, start time and the cache versions of the venue and
+# artist it shows. Pages then only render tiles that are missing or whose
+# venue or artist was edited.
+#
+# Tiles are kept in a process-local LRU of FRAGMENT_CACHE_ENTRIES. They are
+# cheap to rebuild, and a shared backend would spend a round trip on each.
+# The versions come from the configured backend, so an edit made in another
+# worker still reaches this one.
+#----------------------------------------------------------------------------#
+
+TILE_TEMPLATE = 'fragments/show_tile.html'
+
+# the side(s) a tile shows -> the entities it depends on
+TILE_DEPENDENCIES = {
+    'artist': ('artist',),
+    'venue': ('venue',),
+    None: ('artist', 'venue'),
+}
+
+
+class Fragments:
+    # each app keeps its own tile LRU in app.extensions['fragments']
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('FRAGMENT_CACHE_ENTRIES', 20000)
+        app.extensions['fragments'] = MemoryBackend(max_entries=app.config['FRAGMENT_CACHE_ENTRIES'])
+        app.add_template_global(self.show_tiles, 'show_tiles')
+
+    def show_tiles(self, shows, other=None):
+        # shows: row views (projection.py) with id, start_time and
+        # <side>_id/_name/_image_link for each side the tile shows; other as
+        # in the template
+        if not shows:
+            return Markup('')
+        sides = TILE_DEPENDENCIES[other]
+        entities = sorted({(side, getattr(show, side + '_id')) for show in shows for side in sides})
+        counters = cache.versions(['{}:{}'.format(side, entity_id) for side, entity_id in entities])
+        versions = dict(zip(entities, counters))
+        # the store is process-local, so keys can stay tuples
+        keys = [
+            (other, show.id, show.start_time)
+            + tuple((getattr(show, side + '_id'), versions[side, getattr(show, side + '_id')]) for side in sides)
+            for show in shows
+        ]
+
+        store = current_app.extensions['fragments'] if cache.enabled else None
+        tiles = store.get_many(keys) if store is not None else [None] * len(keys)
+        render = None
+        for position, tile in enumerate(tiles):
+            if tile is None:
+                render = render or current_app.jinja_env.get_template(TILE_TEMPLATE).module.show_tile
+                tiles[position] = str(render(shows[position], other))
+                if store is not None:
+                    store.set(keys[position], tiles[position])
+        return Markup(''.join(tiles))
+
+
+fragments = Fragments()
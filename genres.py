@@ -0,0 +1,45 @@
+from sqlalchemy import func, select
+from models import db, Genre, Venue, Artist, venue_genres, artist_genres
+
+#----------------------------------------------------------------------------#
+# Genre lookups.
+#----------------------------------------------------------------------------#
+
+# the association column that links each entity to its genres
+GENRE_LINKS = {
+    Venue: venue_genres.c.venue_id,
+    Artist: artist_genres.c.artist_id,
+}
+
+
+def entities_with_genre(model, name):
+    # ids of every venue/artist tagged `name` (case-insensitive), answered from
+    # the (genre_id, entity_id) index rather than by scanning entity rows
+    link = GENRE_LINKS[model]
+    return select(link).join(Genre, Genre.id == link.table.c.genre_id).where(
+        func.lower(Genre.name) == name.lower())
+
+
+def filter_by_genre(query, model, name):
+    return query.filter(model.id.in_(entities_with_genre(model, name)))
+
+
+def genre_names_statement(model, ids):
+    link = GENRE_LINKS[model]
+    return select(link, Genre.name).join(
+        Genre, Genre.id == link.table.c.genre_id
+    ).where(link.in_(ids)).order_by(link, Genre.name)
+
+
+def group_genre_names(ids, rows):
+    names = {entity_id: [] for entity_id in ids}
+    for entity_id, name in rows:
+        names[entity_id].append(name)
+    return names
+
+
+def genre_names(model, ids):
+    # {id: [genre names]} for a page of entities in one query
+    if not ids:
+        return {}
+    return group_genre_names(ids, db.session.execute(genre_names_statement(model, ids)).all())
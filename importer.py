@@ -0,0 +1,557 @@
+import csv
+import io
+import itertools
+import json
+import time
+from datetime import datetime
+from sqlalchemy import tuple_
+from sqlalchemy.exc import IntegrityError
+from wtforms import BooleanField, DateTimeField, IntegerField, SelectField, SelectMultipleField
+from wtforms.fields.core import UnboundField
+from wtforms.validators import StopValidation, ValidationError
+from forms import VenueForm, ArtistForm, ShowForm
+from models import db, Genre, Venue, Artist, Show, venue_genres, artist_genres
+from cache import cache
+from search import reset_fallback_index
+from autocomplete import autocomplete
+from areas import insert_venue_areas, update_venue_areas
+from booking import EXCLUSION_VIOLATION, Booking, BookingIndex, describe_conflict, end_of
+from jobs import enqueue, logger
+
+#----------------------------------------------------------------------------#
+# Bulk import.
+#
+# Streams CSV or NDJSON records, checks them against the same field rules as
+# VenueForm / ArtistForm / ShowForm (the form classes are read once, no form
+# object is built per row), and writes each batch with one COPY on Postgres
+# or one executemany elsewhere. Duplicates, foreign keys and overlapping
+# show bookings are resolved with one query per batch. queue_import() hands
+# the batches to `flask worker` as import_chunk jobs instead.
+#
+# book_show_batch() runs one batch of shows the same way for
+# POST /api/v1/shows/batch, with one multi-row INSERT and an outcome per row.
+#----------------------------------------------------------------------------#
+
+MAX_REPORTED_ERRORS = 100
+
+
+class FieldShim:
+    # just enough of a WTForms field for its validators to run against a value
+    __slots__ = ('data', 'errors')
+
+    def __init__(self, data):
+        self.data = data
+        self.errors = []
+
+    def gettext(self, string):
+        return string
+
+    def ngettext(self, singular, plural, n):
+        return singular if n == 1 else plural
+
+
+def compile_rules(form_class):
+    # [(name, field class, kwargs, validators)] in declaration order
+    fields = [
+        (name, value) for name, value in vars(form_class).items()
+        if isinstance(value, UnboundField)
+    ]
+    fields.sort(key=lambda item: item[1].creation_counter)
+    return [
+        (name, field.field_class, field.kwargs, field.kwargs.get('validators') or ())
+        for name, field in fields
+    ]
+
+
+def clean_value(field_class, kwargs, value):
+    # converts a raw CSV/NDJSON value the way the matching field would
+    if issubclass(field_class, SelectMultipleField):
+        if isinstance(value, str):
+            value = [item.strip() for item in value.split(',') if item.strip()]
+        value = list(value or [])
+        choices = {choice for choice, _ in kwargs.get('choices', ())}
+        invalid = [item for item in value if item not in choices]
+        if invalid:
+            raise ValidationError('not a valid choice: ' + ', '.join(invalid))
+        return value
+    if issubclass(field_class, BooleanField):
+        return value not in (None, False, 'false', '')
+    if issubclass(field_class, DateTimeField):
+        if not value or isinstance(value, datetime):
+            return value or None
+        try:
+            return datetime.strptime(value, kwargs.get('format', '%Y-%m-%d %H:%M:%S'))
+        except ValueError:
+            raise ValidationError('not a valid datetime value')
+    if issubclass(field_class, IntegerField):
+        if value in (None, ''):
+            return kwargs.get('default')
+        try:
+            return int(value)
+        except (TypeError, ValueError):
+            raise ValidationError('not a valid integer value')
+    value = '' if value is None else str(value)
+    if issubclass(field_class, SelectField):
+        if value not in {choice for choice, _ in kwargs.get('choices', ())}:
+            raise ValidationError('not a valid choice')
+    return value
+
+
+def validate(rules, record):
+    # returns (cleaned dict, list of error strings)
+    cleaned, errors = {}, []
+    for name, field_class, kwargs, validators in rules:
+        try:
+            shim = FieldShim(clean_value(field_class, kwargs, record.get(name)))
+            for validator in validators:
+                validator(None, shim)
+            cleaned[name] = shim.data
+        except (ValidationError, StopValidation) as error:
+            errors.append('{}: {}'.format(name, error.args[0] if error.args else 'invalid'))
+    return cleaned, errors
+
+
+#  Readers
+#  ----------------------------------------------------------------
+
+def read_records(stream, format):
+    # yields (line number, dict) from a text stream
+    if format == 'csv':
+        reader = csv.DictReader(stream)
+        for record in reader:
+            yield reader.line_num, record
+    elif format == 'ndjson':
+        for line_number, line in enumerate(stream, 1):
+            if line.strip():
+                yield line_number, json.loads(line)
+    else:
+        raise ValueError('unsupported format: {}'.format(format))
+
+
+def guess_format(filename):
+    return 'ndjson' if filename.endswith(('.ndjson', '.jsonl')) else 'csv'
+
+
+#  Writers
+#  ----------------------------------------------------------------
+
+def copy_value(value):
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, datetime):
+        return value.isoformat(sep=' ')
+    return str(value).replace('\\', '\\\\').replace('\t', '\\t').replace('\n', '\\n').replace('\r', '\\r')
+
+
+def write_rows(table, rows):
+    # one COPY on Postgres, one executemany everywhere else
+    if not rows:
+        return
+    if db.engine.dialect.name == 'postgresql':
+        columns = list(rows[0])
+        buffer = io.StringIO()
+        for row in rows:
+            buffer.write('\t'.join(copy_value(row[column]) for column in columns) + '\n')
+        buffer.seek(0)
+        cursor = db.session.connection().connection.cursor()
+        cursor.copy_expert('COPY {} ({}) FROM STDIN'.format(table.name, ', '.join(columns)), buffer)
+    else:
+        db.session.execute(table.insert(), rows)
+
+
+def existing_keys(key_columns, keys):
+    if not keys:
+        return set()
+    rows = db.session.query(*key_columns).filter(tuple_(*key_columns).in_(list(keys))).all()
+    return {tuple(row) for row in rows}
+
+
+def link_genres(model, link_table, key_columns, rows):
+    # genre links for freshly inserted venues/artists, resolved per batch
+    names = {name for row in rows for name in row['genres']}
+    if not names:
+        return
+    genre_ids = dict(db.session.query(Genre.name, Genre.id).filter(Genre.name.in_(names)))
+    missing = names - set(genre_ids)
+    if missing:
+        write_rows(Genre.__table__, [{'name': name} for name in sorted(missing)])
+        genre_ids.update(db.session.query(Genre.name, Genre.id).filter(Genre.name.in_(missing)))
+
+    keys = [row['key'] for row in rows]
+    ids = {
+        tuple(row[1:]): row[0]
+        for row in db.session.query(model.id, *key_columns).filter(tuple_(*key_columns).in_(keys))
+    }
+    link_column = [column for column in link_table.c if column.name != 'genre_id'][0].name
+    write_rows(link_table, [
+        {link_column: ids[row['key']], 'genre_id': genre_ids[name]}
+        for row in rows for name in dict.fromkeys(row['genres'])
+    ])
+
+
+#  Import kinds
+#  ----------------------------------------------------------------
+
+class EntityImport:
+    # venues and artists: form fields map onto columns, genres onto links
+
+    def __init__(self, model, form_class, link_table, key_names):
+        self.model = model
+        self.rules = compile_rules(form_class)
+        self.link_table = link_table
+        self.key_columns = [getattr(model, name) for name in key_names]
+        self.key_names = key_names
+        self.dependencies = [model.__tablename__]
+
+    def prepare(self, records, report):
+        now = datetime.utcnow()
+        rows = []
+        for line_number, cleaned, record in records:
+            row = {name: value for name, value in cleaned.items() if name != 'genres'}
+            row['date_created'] = now
+            rows.append({
+                'line': line_number,
+                'key': tuple(cleaned[name] for name in self.key_names),
+                'columns': row,
+                'genres': cleaned['genres'],
+            })
+        return rows
+
+    def admit(self, rows, report):
+        return rows
+
+    def write(self, rows):
+        write_rows(self.model.__table__, [row['columns'] for row in rows])
+        link_genres(self.model, self.link_table, self.key_columns, rows)
+
+    def refresh_areas(self, rows):
+        # new venues join the /venues rollup in their batch's transaction
+        if self.model is not Venue or not rows:
+            return
+        keys = [row['key'] for row in rows]
+        venue_ids = [venue_id for (venue_id,) in db.session.query(Venue.id).filter(
+            tuple_(*self.key_columns).in_(keys))]
+        insert_venue_areas(db.session.connection(), venue_ids)
+
+
+class ShowImport:
+    # shows: artist/venue given by id or by exact name, both checked in bulk
+
+    model = Show
+    # artist/venue references are resolved by reference() below, not by the form rules;
+    # imports are deduplicated by key_columns rather than idempotency keys
+    rules = [rule for rule in compile_rules(ShowForm) if rule[0] not in ('artist_id', 'venue_id', 'idempotency_key')]
+    key_columns = [Show.artist_id, Show.venue_id, Show.start_time]
+    dependencies = ['shows', 'venues', 'artists']
+
+    def prepare(self, records, report):
+        raw = [record for _, _, record in records]
+        artists = self.resolve(Artist, raw, 'artist')
+        venues = self.resolve(Venue, raw, 'venue')
+
+        rows = []
+        for line_number, cleaned, record in records:
+            artist_id = artists.get(self.reference(record, 'artist'))
+            venue_id = venues.get(self.reference(record, 'venue'))
+            if artist_id is None or venue_id is None:
+                report.reject(line_number, ['unknown or ambiguous {}'.format(
+                    'artist' if artist_id is None else 'venue')])
+                continue
+            rows.append({
+                'line': line_number,
+                'key': (artist_id, venue_id, cleaned['start_time']),
+                'columns': {
+                    'artist_id': artist_id,
+                    'venue_id': venue_id,
+                    'start_time': cleaned['start_time'],
+                    'duration_minutes': cleaned['duration_minutes'],
+                },
+            })
+        return rows
+
+    def admit(self, rows, report):
+        # drops rows that overlap an existing show, or an earlier row of the
+        # batch, for the same venue or artist
+        if not rows:
+            return rows
+        bookings = [
+            Booking(None, row['columns']['venue_id'], row['columns']['artist_id'], row['columns']['start_time'],
+                    end_of(row['columns']['start_time'], row['columns']['duration_minutes']))
+            for row in rows
+        ]
+        index = BookingIndex.load(
+            {booking.venue_id for booking in bookings}, {booking.artist_id for booking in bookings},
+            min(booking.start_time for booking in bookings), max(booking.end_time for booking in bookings))
+
+        admitted = []
+        for row, booking in zip(rows, bookings):
+            conflicts = index.conflicts(booking.venue_id, booking.artist_id, booking.start_time, booking.end_time)
+            if conflicts:
+                report.reject(row['line'], [
+                    describe_conflict(conflict, booking.venue_id, booking.artist_id) for conflict in conflicts],
+                    status='conflict')
+            else:
+                index.add(booking)
+                admitted.append(row)
+        return admitted
+
+    @staticmethod
+    def reference(record, prefix):
+        value = record.get(prefix + '_id')
+        if value not in (None, ''):
+            return ('id', str(value))
+        return ('name', record.get(prefix + '_name') or '')
+
+    def resolve(self, model, records, prefix):
+        # {('id', '3') | ('name', 'Blue Note'): id} in at most two queries
+        references = {self.reference(record, prefix) for record in records}
+        ids = {value for kind, value in references if kind == 'id' and value.isdigit()}
+        names = {value for kind, value in references if kind == 'name' and value}
+        resolved = {}
+        if ids:
+            for (row_id,) in db.session.query(model.id).filter(model.id.in_([int(value) for value in ids])):
+                resolved[('id', str(row_id))] = row_id
+        if names:
+            matches = {}
+            for row_id, name in db.session.query(model.id, model.name).filter(model.name.in_(names)):
+                matches.setdefault(name, []).append(row_id)
+            for name, row_ids in matches.items():
+                if len(row_ids) == 1:
+                    resolved[('name', name)] = row_ids[0]
+        return resolved
+
+    def write(self, rows):
+        write_rows(Show.__table__, [row['columns'] for row in rows])
+
+    def refresh_areas(self, rows):
+        # recounts only the venues the batch booked shows at
+        update_venue_areas(db.session.connection(), list({row['columns']['venue_id'] for row in rows}))
+
+
+KINDS = {
+    'venues': lambda: EntityImport(Venue, VenueForm, venue_genres, ['name', 'city', 'state', 'address']),
+    'artists': lambda: EntityImport(Artist, ArtistForm, artist_genres, ['name', 'city', 'state']),
+    'shows': ShowImport,
+}
+
+
+#  Pipeline
+#  ----------------------------------------------------------------
+
+class ImportReport:
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.read = 0
+        self.inserted = 0
+        self.duplicates = 0
+        self.invalid = 0
+        self.errors = []
+        self.started = time.monotonic()
+
+    def reject(self, line_number, errors, status='invalid'):
+        # status ('invalid' or 'conflict') is only kept by BatchReport
+        self.invalid += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append({'line': line_number, 'errors': errors})
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    @property
+    def rows_per_second(self):
+        return self.read / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self):
+        return {
+            'kind': self.kind,
+            'read': self.read,
+            'inserted': self.inserted,
+            'duplicates': self.duplicates,
+            'invalid': self.invalid,
+            'errors': self.errors,
+            'seconds': round(self.elapsed, 3),
+            'rows_per_second': round(self.rows_per_second, 1),
+        }
+
+
+def import_records(kind, records, batch_size=1000, progress=None, finish=True):
+    # records: iterable of (line number, dict). Each batch commits on its own
+    # so a failure part-way keeps the batches that were already written.
+    # finish=False leaves the finish_import() step to the caller.
+    spec = KINDS[kind]()
+    report = ImportReport(kind)
+    records = iter(records)
+
+    while True:
+        batch = list(itertools.islice(records, batch_size))
+        if not batch:
+            break
+        report.read += len(batch)
+
+        valid = []
+        for line_number, record in batch:
+            cleaned, errors = validate(spec.rules, record)
+            if errors:
+                report.reject(line_number, errors)
+            else:
+                valid.append((line_number, cleaned, record))
+
+        rows = spec.prepare(valid, report)
+
+        # drop rows repeated within the batch or already in the database
+        existing = existing_keys(spec.key_columns, {row['key'] for row in rows})
+        unique = []
+        for row in rows:
+            if row['key'] in existing:
+                report.duplicates += 1
+            else:
+                existing.add(row['key'])
+                unique.append(row)
+        unique = spec.admit(unique, report)
+
+        try:
+            spec.write(unique)
+            spec.refresh_areas(unique)
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        report.inserted += len(unique)
+        if progress is not None:
+            progress(report)
+
+    if finish:
+        finish_import(kind)
+    return report
+
+
+def finish_import(kind):
+    # refreshes the caches the bulk writes bypassed; also run as a job. The
+    # venue area rollup is kept current batch by batch.
+    spec = KINDS[kind]()
+    cache.bump(*spec.dependencies)
+    reset_fallback_index(spec.model)
+    autocomplete.reset()
+
+
+def queue_import(kind, records, batch_size=1000):
+    # records as for import_records(), queued as one import_chunk job per
+    # batch for `flask worker`; the caller commits. Returns the job count.
+    records, chunks = iter(records), 0
+    while True:
+        batch = list(itertools.islice(records, batch_size))
+        if not batch:
+            return chunks
+        enqueue('import_chunk', {'kind': kind, 'records': batch})
+        chunks += 1
+
+
+def import_chunk(kind, records):
+    # job: one batch of a queued import. Every chunk queues finish_import
+    # after it commits; the key keeps that to one queued at a time, and one
+    # always runs after the last chunk.
+    report = import_records(kind, records, batch_size=max(len(records), 1), finish=False)
+    for error in report.errors:
+        logger.warning('import %s line %s: %s', kind, error['line'], '; '.join(error['errors']))
+    enqueue('finish_import', {'kind': kind}, key='finish_import:' + kind)
+    db.session.commit()
+
+
+#  Show batches
+#  ----------------------------------------------------------------
+
+class BatchReport(ImportReport):
+    # also keeps every row's outcome, by position in the batch
+
+    def __init__(self, kind):
+        super().__init__(kind)
+        self.results = {}
+
+    def reject(self, line_number, errors, status='invalid'):
+        super().reject(line_number, errors, status)
+        self.results[line_number] = {'status': status, 'errors': errors}
+
+
+def insert_shows(rows):
+    # one multi-row INSERT; returns {(venue_id, start_time): id} for the new
+    # shows. Shows of one venue never overlap, so that pair names one show.
+    if not rows:
+        return {}
+    statement = Show.__table__.insert().values([row['columns'] for row in rows])
+    if db.engine.dialect.name == 'postgresql':
+        result = db.session.execute(statement.returning(Show.id, Show.venue_id, Show.start_time))
+    else:
+        db.session.execute(statement)
+        keys = [(row['columns']['venue_id'], row['columns']['start_time']) for row in rows]
+        result = db.session.query(Show.id, Show.venue_id, Show.start_time).filter(
+            tuple_(Show.venue_id, Show.start_time).in_(keys))
+    return {(venue_id, start_time): show_id for show_id, venue_id, start_time in result}
+
+
+def book_show_batch(records, attempts=3):
+    # records: list of dicts with the /import/shows fields. Books every valid,
+    # non-overlapping record in one transaction and returns the report; its
+    # results map each position to {'status': 'created' | 'duplicate' |
+    # 'invalid' | 'conflict', 'id' or 'errors'}. A show that is already
+    # booked (same artist, venue and start) counts as a duplicate, so a
+    # retried batch books nothing twice.
+    spec = ShowImport()
+    for attempt in range(attempts):
+        report = BatchReport('shows')
+        report.read = len(records)
+        valid = []
+        for position, record in enumerate(records):
+            cleaned, errors = validate(spec.rules, record)
+            if errors:
+                report.reject(position, errors)
+            else:
+                valid.append((position, cleaned, record))
+        rows = spec.prepare(valid, report)
+
+        keys = list({row['key'] for row in rows})
+        existing = {
+            tuple(row[1:]): row[0]
+            for row in db.session.query(Show.id, *spec.key_columns).filter(tuple_(*spec.key_columns).in_(keys))
+        } if keys else {}
+        unique, repeats, seen = [], [], set()
+        for row in rows:
+            if row['key'] in existing or row['key'] in seen:
+                repeats.append(row)
+            else:
+                seen.add(row['key'])
+                unique.append(row)
+        admitted = spec.admit(unique, report)
+
+        try:
+            ids = insert_shows(admitted)
+            spec.refresh_areas(admitted)
+            db.session.commit()
+        except IntegrityError as error:
+            db.session.rollback()
+            if getattr(error.orig, 'pgcode', None) != EXCLUSION_VIOLATION or attempt == attempts - 1:
+                raise
+            # a concurrent booking took one of the slots after admit(); look again
+            continue
+        break
+
+    for row in admitted:
+        columns = row['columns']
+        existing[row['key']] = ids[(columns['venue_id'], columns['start_time'])]
+        report.results[row['line']] = {'status': 'created', 'id': existing[row['key']]}
+    report.inserted = len(admitted)
+    for row in repeats:
+        if row['key'] in existing:
+            report.duplicates += 1
+            report.results[row['line']] = {'status': 'duplicate', 'id': existing[row['key']]}
+        else:
+            # repeats an earlier row of the batch that was turned down
+            report.reject(row['line'], ['same show as an earlier row'])
+
+    if admitted:
+        cache.bump('shows', *{'venue:{}'.format(row['columns']['venue_id']) for row in admitted},
+                   *{'artist:{}'.format(row['columns']['artist_id']) for row in admitted})
+    return report
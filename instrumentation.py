@@ -0,0 +1,196 @@
+import json
+import logging
+import threading
+import time
+from collections import Counter, defaultdict
+from flask import Response, before_render_template, current_app, g, has_request_context, request, template_rendered
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+#----------------------------------------------------------------------------#
+# Per-request SQL instrumentation.
+#
+# Every statement run during a request is timed and counted along with the
+# rows it returned and the time spent rendering templates. Each request ends
+# with one structured log line. The same numbers are added up per endpoint
+# for /metrics (Prometheus text format). With QUERY_DEBUG_HEADER on they are
+# also returned in an X-Query-Stats response header. A statement repeated
+# within one request is reported as an N+1 suspect.
+#----------------------------------------------------------------------------#
+
+logger = logging.getLogger('fyyur.queries')
+
+
+class RequestStats:
+    __slots__ = ('started', 'statements', 'db_time', 'rows', 'template_time',
+                 'template_started', 'fingerprints', 'slow')
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statements = 0
+        self.db_time = 0.0
+        self.rows = 0
+        self.template_time = 0.0
+        self.template_started = None
+        self.fingerprints = Counter()
+        self.slow = []
+
+    def count_row(self, cursor, row):
+        # sqlite3 row_factory, see QueryProfiler._before_execute
+        self.rows += 1
+        return row
+
+    def n_plus_one(self, threshold):
+        return [statement for statement, count in self.fingerprints.items() if count >= threshold]
+
+
+class ProfilerState:
+    # one app's settings and per-endpoint totals
+
+    def __init__(self, app):
+        self.debug_header = app.config.get('QUERY_DEBUG_HEADER', False)
+        self.slow_query_seconds = app.config.get('SLOW_QUERY_MS', 200) / 1000.0
+        self.n_plus_one_threshold = app.config.get('N_PLUS_ONE_THRESHOLD', 3)
+        self.lock = threading.Lock()
+        self.totals = defaultdict(lambda: defaultdict(float))
+
+
+class QueryProfiler:
+
+    METRICS = (
+        ('requests_total', 'counter', 'Requests handled.'),
+        ('request_seconds_total', 'counter', 'Wall time spent handling requests.'),
+        ('db_statements_total', 'counter', 'SQL statements executed.'),
+        ('db_seconds_total', 'counter', 'Time spent executing SQL statements.'),
+        ('db_rows_total', 'counter', 'Rows returned or changed by executed statements.'),
+        ('template_seconds_total', 'counter', 'Time spent rendering templates.'),
+        ('n_plus_one_total', 'counter', 'Requests that repeated an identical statement.'),
+    )
+
+    def __init__(self, app=None):
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        # settings and totals are kept per app in app.extensions, so every
+        # app built by create_app() reports only its own requests. The
+        # Engine listeners are shared and registered once.
+        app.extensions['query_profiler'] = ProfilerState(app)
+        for name, listener in (('before_cursor_execute', self._before_execute),
+                               ('after_cursor_execute', self._after_execute)):
+            if not event.contains(Engine, name, listener):
+                event.listen(Engine, name, listener)
+        before_render_template.connect(self._before_render, app)
+        template_rendered.connect(self._after_render, app)
+        app.before_request(self._start_request)
+        app.after_request(self._finish_request)
+        app.add_url_rule('/metrics', 'metrics', self.metrics)
+
+    @staticmethod
+    def state():
+        return current_app.extensions['query_profiler']
+
+    #  Hooks
+    #  ----------------------------------------------------------------
+
+    def _start_request(self):
+        g.query_stats = RequestStats()
+
+    def _before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if has_request_context() and 'query_stats' in g:
+            conn.info.setdefault('query_started', []).append(time.perf_counter())
+            if conn.dialect.driver == 'pysqlite':
+                # SQLite reports no rowcount for SELECTs, so their rows are
+                # counted as the cursor builds them
+                cursor.row_factory = g.query_stats.count_row
+
+    def _after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if not (has_request_context() and 'query_stats' in g):
+            return
+        started = conn.info.get('query_started')
+        if not started:
+            return
+        elapsed = time.perf_counter() - started.pop()
+        stats = g.query_stats
+        stats.statements += 1
+        stats.db_time += elapsed
+        # rows affected, or returned where the driver knows it up front
+        # (psycopg2); -1 otherwise
+        stats.rows += max(cursor.rowcount, 0)
+        stats.fingerprints[statement] += 1
+        if elapsed >= self.state().slow_query_seconds:
+            stats.slow.append((round(elapsed * 1000, 2), statement))
+            logger.warning(json.dumps({
+                'event': 'slow_query',
+                'endpoint': request.endpoint,
+                'ms': round(elapsed * 1000, 2),
+                'statement': ' '.join(statement.split()),
+            }))
+
+    def _before_render(self, sender, template, context, **extra):
+        if 'query_stats' in g:
+            g.query_stats.template_started = time.perf_counter()
+
+    def _after_render(self, sender, template, context, **extra):
+        stats = g.get('query_stats')
+        if stats is not None and stats.template_started is not None:
+            stats.template_time += time.perf_counter() - stats.template_started
+            stats.template_started = None
+
+    def _finish_request(self, response):
+        stats = g.pop('query_stats', None)
+        if stats is None or request.endpoint == 'metrics':
+            return response
+
+        state = self.state()
+        duration = time.perf_counter() - stats.started
+        suspects = stats.n_plus_one(state.n_plus_one_threshold)
+        endpoint = request.endpoint or 'unmatched'
+
+        with state.lock:
+            totals = state.totals[endpoint]
+            totals['requests_total'] += 1
+            totals['request_seconds_total'] += duration
+            totals['db_statements_total'] += stats.statements
+            totals['db_seconds_total'] += stats.db_time
+            totals['db_rows_total'] += stats.rows
+            totals['template_seconds_total'] += stats.template_time
+            totals['n_plus_one_total'] += 1 if suspects else 0
+
+        logger.info(json.dumps({
+            'event': 'request',
+            'method': request.method,
+            'path': request.path,
+            'endpoint': endpoint,
+            'status': response.status_code,
+            'ms': round(duration * 1000, 2),
+            'statements': stats.statements,
+            'db_ms': round(stats.db_time * 1000, 2),
+            'rows': stats.rows,
+            'template_ms': round(stats.template_time * 1000, 2),
+            'n_plus_one': [' '.join(statement.split()) for statement in suspects],
+        }))
+
+        if state.debug_header:
+            response.headers['X-Query-Stats'] = (
+                'statements={}; db_ms={:.2f}; rows={}; template_ms={:.2f}; n_plus_one={}'.format(
+                    stats.statements, stats.db_time * 1000, stats.rows,
+                    stats.template_time * 1000, len(suspects)))
+        return response
+
+    #  Prometheus endpoint
+    #  ----------------------------------------------------------------
+
+    def metrics(self):
+        state = self.state()
+        lines = []
+        with state.lock:
+            for name, kind, description in self.METRICS:
+                lines.append('# HELP fyyur_{} {}'.format(name, description))
+                lines.append('# TYPE fyyur_{} {}'.format(name, kind))
+                for endpoint, totals in sorted(state.totals.items()):
+                    lines.append('fyyur_{}{{endpoint="{}"}} {}'.format(name, endpoint, totals[name]))
+        return Response('\n'.join(lines) + '\n', mimetype='text/plain; version=0.0.4')
+
+
+profiler = QueryProfiler()
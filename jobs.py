@@ -0,0 +1,235 @@
+import importlib
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+import traceback
+from collections import namedtuple
+from datetime import datetime, timedelta
+from flask import current_app
+from sqlalchemy import and_, insert, or_, select
+from models import db, Job
+from cache import cache, MemoryBackend
+
+#----------------------------------------------------------------------------#
+# Background jobs.
+#
+# Work that should not hold up a request is queued as a row in the jobs
+# table and run by `flask worker`, a separate process with
+# JOBS_CONCURRENCY threads. The queue is the application database, so
+# there is no broker to run.
+#
+# A worker claims the oldest due job with SELECT ... FOR UPDATE SKIP LOCKED,
+# so concurrent workers never wait on each other or take the same row. A job
+# that raises is retried after JOBS_BACKOFF_SECONDS, doubling each time up to
+# JOBS_BACKOFF_MAX_SECONDS. After JOBS_MAX_ATTEMPTS tries it is marked
+# failed. A job whose worker died is taken over once its lease of
+# JOBS_LEASE_SECONDS runs out. Kinds listed in JOBS_SCHEDULE are queued
+# again after each run, that many seconds later.
+#
+# SQLite has no row locks, so there a claim is a conditional UPDATE and the
+# worker that loses the race simply looks again.
+#----------------------------------------------------------------------------#
+
+QUEUED = 'queued'
+RUNNING = 'running'
+FAILED = 'failed'
+
+# kind -> 'module:function', imported when a job of that kind first runs.
+# The function is called with the job's payload as keyword arguments.
+TASKS = {
+    'purge_venue': 'removal:purge_venue',
+    'refresh_venue_areas': 'areas:refresh_due_venue_areas',
+    'import_chunk': 'importer:import_chunk',
+    'finish_import': 'importer:finish_import',
+    'warm_cache': 'jobs:warm_cache',
+}
+
+ClaimedJob = namedtuple('ClaimedJob', 'id kind payload attempts max_attempts')
+
+logger = logging.getLogger('fyyur.jobs')
+
+
+def enqueue(kind, payload=None, delay=0, key=None, max_attempts=None):
+    # adds a job to the caller's transaction, so it is queued only if the
+    # caller commits. Nothing is added while a job with the same `key` is
+    # still queued.
+    if kind not in TASKS:
+        raise ValueError('unknown job kind: {}'.format(kind))
+    now = datetime.utcnow()
+    values = {
+        'kind': kind,
+        'payload': payload or {},
+        'key': key,
+        'status': QUEUED,
+        'attempts': 0,
+        'max_attempts': max_attempts or current_app.config['JOBS_MAX_ATTEMPTS'],
+        'run_at': now + timedelta(seconds=delay),
+        'created': now,
+    }
+    db.session.execute(_insert_ignoring_key().values(**values))
+
+
+def _insert_ignoring_key():
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert as dialect_insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert as dialect_insert
+    else:
+        return insert(Job.__table__)
+    return dialect_insert(Job.__table__).on_conflict_do_nothing(index_elements=['key'])
+
+
+#  Claiming and running
+#  ----------------------------------------------------------------
+
+def _due(now):
+    lease = now - timedelta(seconds=current_app.config['JOBS_LEASE_SECONDS'])
+    return or_(
+        and_(Job.status == QUEUED, Job.run_at <= now),
+        and_(Job.status == RUNNING, Job.locked_at < lease),
+    )
+
+
+def claim(worker_id):
+    # marks the next due job as running for this worker and returns it as a
+    # ClaimedJob; None when nothing is due
+    while True:
+        now = datetime.utcnow()
+        job = db.session.execute(
+            select(Job.id, Job.kind, Job.payload, Job.attempts, Job.max_attempts)
+            .where(_due(now)).order_by(Job.run_at).limit(1)
+            .with_for_update(skip_locked=True)).first()
+        if job is None:
+            db.session.rollback()
+            return None
+        # the key is released so the same work can be queued again while this runs
+        claimed = db.session.execute(
+            Job.__table__.update().where(Job.id == job.id, _due(now)).values(
+                status=RUNNING, locked_at=now, locked_by=worker_id, attempts=Job.attempts + 1, key=None))
+        db.session.commit()
+        if claimed.rowcount == 1:
+            return ClaimedJob(job.id, job.kind, job.payload, job.attempts + 1, job.max_attempts)
+
+
+def resolve(kind):
+    module, _, attribute = TASKS[kind].partition(':')
+    return getattr(importlib.import_module(module), attribute)
+
+
+def run_job(job):
+    # runs a claimed job; True when it succeeded
+    started = time.perf_counter()
+    try:
+        resolve(job.kind)(**job.payload)
+    except Exception as error:
+        db.session.rollback()
+        _retry_or_fail(job, error)
+        return False
+
+    db.session.execute(Job.__table__.delete().where(Job.id == job.id))
+    interval = current_app.config['JOBS_SCHEDULE'].get(job.kind)
+    if interval:
+        enqueue(job.kind, job.payload, delay=interval, key=job.kind)
+    db.session.commit()
+    logger.info('job %s (%s) done in %.0fms', job.id, job.kind, (time.perf_counter() - started) * 1000)
+    return True
+
+
+def backoff(attempts):
+    config = current_app.config
+    return min(config['JOBS_BACKOFF_SECONDS'] * 2 ** (attempts - 1), config['JOBS_BACKOFF_MAX_SECONDS'])
+
+
+def _retry_or_fail(job, error):
+    last_error = ''.join(traceback.format_exception_only(type(error), error)).strip()
+    if job.attempts >= job.max_attempts:
+        values = {'status': FAILED}
+        logger.exception('job %s (%s) failed after %s attempts', job.id, job.kind, job.attempts)
+    else:
+        delay = backoff(job.attempts)
+        values = {'status': QUEUED, 'run_at': datetime.utcnow() + timedelta(seconds=delay)}
+        logger.warning('job %s (%s) attempt %s failed, retrying in %ss: %s',
+                       job.id, job.kind, job.attempts, delay, last_error)
+    db.session.execute(Job.__table__.update().where(Job.id == job.id).values(
+        locked_at=None, locked_by=None, last_error=last_error, **values))
+    db.session.commit()
+
+
+def schedule_periodic():
+    # makes sure every JOBS_SCHEDULE kind has a job queued
+    for kind in current_app.config['JOBS_SCHEDULE']:
+        enqueue(kind, key=kind)
+    db.session.commit()
+
+
+#  Worker
+#  ----------------------------------------------------------------
+
+class Worker:
+    # JOBS_CONCURRENCY threads, each claiming and running one job at a time
+    # in an app context of its own. With burst=True a thread stops as soon
+    # as nothing is due instead of polling.
+
+    def __init__(self, app, concurrency=None, burst=False):
+        self.app = app
+        self.concurrency = concurrency or app.config['JOBS_CONCURRENCY']
+        self.burst = burst
+        self.name = '{}:{}'.format(socket.gethostname(), os.getpid())
+        self.stopping = threading.Event()
+
+    def run(self):
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(signum, lambda signum, frame: self.stop())
+        with self.app.app_context():
+            schedule_periodic()
+        threads = [
+            threading.Thread(target=self._loop, args=('{}/{}'.format(self.name, number),),
+                             name='job-worker-{}'.format(number), daemon=True)
+            for number in range(self.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        # joined with a timeout so the signal handlers get to run
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(0.5)
+
+    def stop(self):
+        # running jobs finish; nothing new is claimed
+        self.stopping.set()
+
+    def _loop(self, worker_id):
+        poll = self.app.config['JOBS_POLL_SECONDS']
+        while not self.stopping.is_set():
+            with self.app.app_context():
+                try:
+                    job = claim(worker_id)
+                    if job is not None:
+                        run_job(job)
+                except Exception:
+                    # lost the database; the job, if any, is retaken when its lease runs out
+                    logger.exception('job worker %s', worker_id)
+                    job = None
+            if job is None:
+                if self.burst:
+                    return
+                self.stopping.wait(poll)
+
+
+#  Built-in tasks
+#  ----------------------------------------------------------------
+
+def warm_cache(urls=None):
+    # renders the busiest pages into the response cache ahead of visitors.
+    # Only worth doing with a shared CACHE_BACKEND: a memory cache in the
+    # worker is not the one the web processes read.
+    if isinstance(cache.backend, MemoryBackend):
+        return
+    client = current_app.test_client()
+    for url in urls or current_app.config['CACHE_WARM_URLS']:
+        client.get(url)
@@ -0,0 +1,58 @@
+"""venue archiving and cascading show deletes
+
+Revision ID: 3b9e5f0d7c12
+Revises: 7d4c2e9b1a56
+Create Date: 2026-10-18 19:12:44.603117
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3b9e5f0d7c12'
+down_revision = '7d4c2e9b1a56'
+branch_labels = None
+depends_on = None
+
+# (constraint, column, referred table) on shows
+FOREIGN_KEYS = [
+    ('shows_venue_id_fkey', 'venue_id', 'venues'),
+    ('shows_artist_id_fkey', 'artist_id', 'artists'),
+]
+
+
+# SQLite reflects foreign keys created without a name as unnamed; batch
+# mode names them with this convention so they can be dropped
+SQLITE_NAMING = {'fk': 'fk_%(table_name)s_%(column_0_name)s_%(referred_table_name)s'}
+
+
+def upgrade():
+    op.add_column('venues', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+    _recreate_foreign_keys(ondelete='CASCADE')
+
+
+def downgrade():
+    _recreate_foreign_keys(ondelete=None)
+    with op.batch_alter_table('venues') as batch_op:
+        batch_op.drop_column('deleted_at')
+
+
+def _recreate_foreign_keys(ondelete):
+    # SQLite does not enforce the cascade, but its schema has to match the
+    # models all the same, or every autogenerated migration would carry it.
+    # SQLite cannot alter a constraint, so there the table is rebuilt.
+    if op.get_bind().dialect.name == 'sqlite':
+        current = {
+            foreign_key['constrained_columns'][0]: foreign_key['name']
+            for foreign_key in sa.inspect(op.get_bind()).get_foreign_keys('shows')
+        }
+        with op.batch_alter_table('shows', naming_convention=SQLITE_NAMING) as batch_op:
+            for name, column, table in FOREIGN_KEYS:
+                batch_op.drop_constraint(current.get(column) or 'fk_shows_{}_{}'.format(column, table),
+                                         type_='foreignkey')
+                batch_op.create_foreign_key(name, table, [column], ['id'], ondelete=ondelete)
+        return
+    for name, column, table in FOREIGN_KEYS:
+        op.drop_constraint(name, 'shows', type_='foreignkey')
+        op.create_foreign_key(name, 'shows', table, [column], ['id'], ondelete=ondelete)
@@ -0,0 +1,45 @@
+"""search indexes for venues and artists
+
+Revision ID: 6d2f1b7c4a90
+Revises: bc640a1bf96c
+Create Date: 2026-10-18 09:12:41.503217
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6d2f1b7c4a90'
+down_revision = 'bc640a1bf96c'
+branch_labels = None
+depends_on = None
+
+SEARCHABLE_TABLES = ('venues', 'artists')
+
+
+def upgrade():
+    # full-text and trigram indexes only exist on Postgres; other databases
+    # use the in-process index in search.py
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    for table in SEARCHABLE_TABLES:
+        # the expression must match search.search_document()
+        op.execute(
+            f"CREATE INDEX ix_{table}_search ON {table} USING gin "
+            f"(to_tsvector('simple'::regconfig, name || ' ' || city || ' ' || state || ' ' || genres))"
+        )
+        op.execute(
+            f'CREATE INDEX ix_{table}_name_trgm ON {table} USING gin (name gin_trgm_ops)'
+        )
+
+
+def downgrade():
+    if op.get_bind().dialect.name != 'postgresql':
+        return
+
+    for table in SEARCHABLE_TABLES:
+        op.execute(f'DROP INDEX IF EXISTS ix_{table}_name_trgm')
+        op.execute(f'DROP INDEX IF EXISTS ix_{table}_search')
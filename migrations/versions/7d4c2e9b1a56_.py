@@ -0,0 +1,30 @@
+"""idempotency keys for show submissions
+
+Revision ID: 7d4c2e9b1a56
+Revises: f2a8d61c0b34
+Create Date: 2026-10-18 17:41:08.215384
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '7d4c2e9b1a56'
+down_revision = 'f2a8d61c0b34'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('idempotency_keys',
+    sa.Column('key', sa.String(length=64), nullable=False),
+    sa.Column('show_id', sa.Integer(), nullable=True),
+    sa.Column('created', sa.DateTime(), nullable=False),
+    sa.ForeignKeyConstraint(['show_id'], ['shows.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('key')
+    )
+
+
+def downgrade():
+    op.drop_table('idempotency_keys')
@@ -0,0 +1,46 @@
+"""indexes for show lookups and the venue area listing
+
+Revision ID: a41e7c93d5b2
+Revises: 6d2f1b7c4a90
+Create Date: 2026-10-18 10:03:18.220519
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a41e7c93d5b2'
+down_revision = '6d2f1b7c4a90'
+branch_labels = None
+depends_on = None
+
+# (name, table, columns) -- kept in step with __table_args__ in models.py
+INDEXES = [
+    ('ix_shows_venue_id_start_time', 'shows', ['venue_id', 'start_time']),
+    ('ix_shows_artist_id_start_time', 'shows', ['artist_id', 'start_time']),
+    ('ix_shows_start_time_id', 'shows', ['start_time', 'id']),
+    ('ix_venues_city_state_id', 'venues', ['city', 'state', 'id']),
+]
+
+
+def upgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        # CONCURRENTLY keeps the tables writable while the indexes build, but
+        # it cannot run inside the migration transaction
+        with op.get_context().autocommit_block():
+            for name, table, columns in INDEXES:
+                op.create_index(name, table, columns, postgresql_concurrently=True)
+    else:
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns)
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        with op.get_context().autocommit_block():
+            for name, table, columns in reversed(INDEXES):
+                op.drop_index(name, table_name=table, postgresql_concurrently=True)
+    else:
+        for name, table, columns in reversed(INDEXES):
+            op.drop_index(name, table_name=table)
@@ -0,0 +1,44 @@
+"""precomputed venue area rollup for /venues
+
+Revision ID: c93e4a7d1f08
+Revises: e5b80c1f3a27
+Create Date: 2026-10-18 13:02:41.517209
+
+"""
+from datetime import datetime
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c93e4a7d1f08'
+down_revision = 'e5b80c1f3a27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table('venue_areas',
+    sa.Column('venue_id', sa.Integer(), nullable=False),
+    sa.Column('city', sa.String(length=120), nullable=False),
+    sa.Column('state', sa.String(length=120), nullable=False),
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('num_upcoming_shows', sa.Integer(), nullable=False),
+    sa.Column('next_show_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['venue_id'], ['venues.id'], ondelete='CASCADE'),
+    sa.PrimaryKeyConstraint('venue_id')
+    )
+    op.create_index('ix_venue_areas_city_state_venue_id', 'venue_areas', ['city', 'state', 'venue_id'])
+
+    # same rows areas.rebuild_venue_areas() produces
+    op.get_bind().execute(sa.text(
+        'INSERT INTO venue_areas (venue_id, city, state, name, num_upcoming_shows, next_show_at) '
+        'SELECT venues.id, venues.city, venues.state, venues.name, count(shows.id), min(shows.start_time) '
+        'FROM venues LEFT OUTER JOIN shows ON shows.venue_id = venues.id AND shows.start_time > :now '
+        'GROUP BY venues.id, venues.city, venues.state, venues.name'
+    ), {'now': datetime.now()})
+
+
+def downgrade():
+    op.drop_index('ix_venue_areas_city_state_venue_id', table_name='venue_areas')
+    op.drop_table('venue_areas')
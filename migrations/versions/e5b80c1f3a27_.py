@@ -0,0 +1,119 @@
+"""normalize venue and artist genres into a lookup table
+
+Revision ID: e5b80c1f3a27
+Revises: a41e7c93d5b2
+Create Date: 2026-10-18 11:26:05.871342
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e5b80c1f3a27'
+down_revision = 'a41e7c93d5b2'
+branch_labels = None
+depends_on = None
+
+# (entity table, link table, link column)
+LINKS = [
+    ('venues', 'venue_genres', 'venue_id'),
+    ('artists', 'artist_genres', 'artist_id'),
+]
+
+genres = sa.table('genres', sa.column('id', sa.Integer), sa.column('name', sa.String))
+
+
+def search_index(table, columns):
+    # GIN index matching search.search_document() for the given column list
+    document = " || ' ' || ".join(columns)
+    return (
+        f"CREATE INDEX ix_{table}_search ON {table} USING gin "
+        f"(to_tsvector('simple'::regconfig, {document}))"
+    )
+
+
+def upgrade():
+    op.create_table('genres',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(length=120), nullable=False),
+    sa.PrimaryKeyConstraint('id'),
+    sa.UniqueConstraint('name')
+    )
+    for table, link_table, link_column in LINKS:
+        op.create_table(link_table,
+        sa.Column(link_column, sa.Integer(), nullable=False),
+        sa.Column('genre_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint([link_column], [f'{table}.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['genre_id'], ['genres.id'], ),
+        sa.PrimaryKeyConstraint(link_column, 'genre_id')
+        )
+        op.create_index(f'ix_{link_table}_genre_id_{link_column}', link_table, ['genre_id', link_column])
+
+    # convert the comma-joined strings into genre rows and links
+    connection = op.get_bind()
+    entity_genres = {}
+    for table, link_table, link_column in LINKS:
+        rows = connection.execute(sa.text(f'SELECT id, genres FROM {table}'))
+        entity_genres[table] = [
+            (row_id, [name.strip() for name in value.split(',') if name.strip()])
+            for row_id, value in rows
+        ]
+
+    names = sorted({name for rows in entity_genres.values() for _, row_names in rows for name in row_names})
+    if names:
+        op.bulk_insert(genres, [{'name': name} for name in names])
+    genre_ids = dict(connection.execute(sa.select(genres.c.name, genres.c.id)).fetchall())
+
+    for table, link_table, link_column in LINKS:
+        links = sa.table(link_table, sa.column(link_column, sa.Integer), sa.column('genre_id', sa.Integer))
+        values = [
+            {link_column: row_id, 'genre_id': genre_ids[name]}
+            for row_id, row_names in entity_genres[table]
+            for name in dict.fromkeys(row_names)
+        ]
+        if values:
+            op.bulk_insert(links, values)
+
+    # the search index no longer covers genres; they are matched through the links
+    postgres = connection.dialect.name == 'postgresql'
+    for table, link_table, link_column in LINKS:
+        if postgres:
+            op.execute(f'DROP INDEX IF EXISTS ix_{table}_search')
+            op.execute(search_index(table, ['name', 'city', 'state']))
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_column('genres')
+
+
+def downgrade():
+    connection = op.get_bind()
+    postgres = connection.dialect.name == 'postgresql'
+
+    for table, link_table, link_column in LINKS:
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.add_column(sa.Column('genres', sa.String(), nullable=True))
+
+        rows = connection.execute(sa.text(
+            f'SELECT {link_column}, genres.name FROM {link_table} '
+            f'JOIN genres ON genres.id = {link_table}.genre_id ORDER BY {link_column}, genres.name'))
+        joined = {}
+        for row_id, name in rows:
+            joined.setdefault(row_id, []).append(name)
+
+        entities = sa.table(table, sa.column('id', sa.Integer), sa.column('genres', sa.String))
+        connection.execute(entities.update().values(genres=''))
+        for row_id, row_names in joined.items():
+            connection.execute(
+                entities.update().where(entities.c.id == row_id).values(genres=','.join(row_names)))
+
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.alter_column('genres', existing_type=sa.String(), nullable=False)
+
+        if postgres:
+            op.execute(f'DROP INDEX IF EXISTS ix_{table}_search')
+            op.execute(search_index(table, ['name', 'city', 'state', 'genres']))
+
+        op.drop_index(f'ix_{link_table}_genre_id_{link_column}', table_name=link_table)
+        op.drop_table(link_table)
+
+    op.drop_table('genres')
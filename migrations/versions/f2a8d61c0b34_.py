@@ -0,0 +1,67 @@
+"""show durations and non-overlapping bookings
+
+Revision ID: f2a8d61c0b34
+Revises: c93e4a7d1f08
+Create Date: 2026-10-18 15:20:12.304917
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2a8d61c0b34'
+down_revision = 'c93e4a7d1f08'
+branch_labels = None
+depends_on = None
+
+# must match booking.show_period() for the planner to use these indexes;
+# {0} is an optional table alias
+PERIOD = "tsrange({0}start_time, {0}start_time + {0}duration_minutes * interval '1 minute')"
+
+# (constraint name, column)
+EXCLUSIONS = [
+    ('shows_venue_no_overlap', 'venue_id'),
+    ('shows_artist_no_overlap', 'artist_id'),
+]
+
+
+def overlapping_pairs(connection, column):
+    # a few (show id, show id) pairs that would violate the constraint on `column`
+    return connection.execute(sa.text(
+        f'SELECT a.id, b.id FROM shows a JOIN shows b ON b.{column} = a.{column} AND b.id > a.id '
+        f'AND {PERIOD.format("a.")} && {PERIOD.format("b.")} '
+        'LIMIT 10'
+    )).fetchall()
+
+
+def upgrade():
+    with op.batch_alter_table('shows') as batch_op:
+        batch_op.add_column(sa.Column('duration_minutes', sa.Integer(), server_default='120', nullable=False))
+        batch_op.create_check_constraint(
+            'ck_shows_duration_minutes', 'duration_minutes > 0 AND duration_minutes <= 1440')
+
+    connection = op.get_bind()
+    if connection.dialect.name != 'postgresql':
+        return
+
+    # double bookings made before this revision have to be resolved by hand
+    for name, column in EXCLUSIONS:
+        pairs = overlapping_pairs(connection, column)
+        if pairs:
+            raise RuntimeError('cannot add {}: overlapping shows {}'.format(
+                name, ', '.join('{}/{}'.format(*pair) for pair in pairs)))
+
+    op.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+    for name, column in EXCLUSIONS:
+        op.execute(f'ALTER TABLE shows ADD CONSTRAINT {name} '
+                   f'EXCLUDE USING gist ({column} WITH =, {PERIOD.format("")} WITH &&)')
+
+
+def downgrade():
+    if op.get_bind().dialect.name == 'postgresql':
+        for name, column in EXCLUSIONS:
+            op.execute(f'ALTER TABLE shows DROP CONSTRAINT {name}')
+    with op.batch_alter_table('shows') as batch_op:
+        batch_op.drop_constraint('ck_shows_duration_minutes', type_='check')
+        batch_op.drop_column('duration_minutes')
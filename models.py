@@ -1,16 +1,51 @@
 
 from datetime import datetime
-from flask_sqlalchemy import SQLAlchemy
+from routing import RoutingSQLAlchemy
 
-db = SQLAlchemy()
+db = RoutingSQLAlchemy()
 
 #----------------------------------------------------------------------------#
 # Models.
 #----------------------------------------------------------------------------#
 
+# many-to-many links between venues/artists and genres. The (genre_id, entity)
+# indexes serve "all venues/artists with genre X" lookups.
+venue_genres = db.Table(
+    'venue_genres',
+    db.Column('venue_id', db.Integer, db.ForeignKey('venues.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('genre_id', db.Integer, db.ForeignKey('genres.id'), primary_key=True),
+    db.Index('ix_venue_genres_genre_id_venue_id', 'genre_id', 'venue_id'),
+)
+
+artist_genres = db.Table(
+    'artist_genres',
+    db.Column('artist_id', db.Integer, db.ForeignKey('artists.id', ondelete='CASCADE'), primary_key=True),
+    db.Column('genre_id', db.Integer, db.ForeignKey('genres.id'), primary_key=True),
+    db.Index('ix_artist_genres_genre_id_artist_id', 'genre_id', 'artist_id'),
+)
+
+
+class Genre(db.Model):
+    __tablename__ = 'genres'
+    id = db.Column(db.Integer, primary_key=True)
+    name = db.Column(db.String(120), nullable=False, unique=True)
+
+    @classmethod
+    def from_names(cls, names):
+        # existing genres for `names`, creating the ones that are missing
+        names = list(dict.fromkeys(names))
+        existing = {genre.name: genre for genre in cls.query.filter(cls.name.in_(names))}
+        return [existing.get(name) or cls(name=name) for name in names]
+
+    def __repr__(self):
+        return f'<Genre ID:{self.id}, Name:{self.name}>'
+
 
 class Venue(db.Model):
     __tablename__ = 'venues'
+    __table_args__ = (
+        db.Index('ix_venues_city_state_id', 'city', 'state', 'id'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     name = db.Column(db.String(), nullable=False)
     city = db.Column(db.String(120), nullable=False)
@@ -18,15 +53,17 @@ class Venue(db.Model):
     address = db.Column(db.String(120), nullable=False)
     phone = db.Column(db.String(120), nullable=False)
     image_link = db.Column(db.String(500), nullable=False)
-    genres = db.Column(db.String(), nullable=False)
     facebook_link = db.Column(db.String(120), nullable=False)
     website_link = db.Column(db.String(), nullable=False)
     seeking_talent = db.Column(db.Boolean, nullable=False, default=False)
     seeking_description = db.Column(db.String(), nullable=True)
     date_created = db.Column(
         db.DateTime, nullable=False, default=datetime.utcnow)
-    shows = db.relationship('Show', backref='venue',
-                            lazy=False, cascade='all, delete-orphan')
+    # set when the venue is archived; hidden from reads until removal.py purges it
+    deleted_at = db.Column(db.DateTime, nullable=True)
+    genres = db.relationship('Genre', secondary=venue_genres, order_by='Genre.name')
+    shows = db.relationship('Show', backref='venue', lazy='select',
+                            cascade='all, delete-orphan', passive_deletes=True)
 
     def __repr__(self):
         return f'<Venue ID:{self.id}, Name:{self.name}, \
@@ -38,6 +75,25 @@ class Venue(db.Model):
                                 Talent_description:{self.seeking_description}>'
 
 
+class VenueArea(db.Model):
+    # precomputed /venues listing: one row per venue, read in (city, state)
+    # order straight off the index. Kept current by areas.py.
+    __tablename__ = 'venue_areas'
+    __table_args__ = (
+        db.Index('ix_venue_areas_city_state_venue_id', 'city', 'state', 'venue_id'),
+    )
+    venue_id = db.Column(db.Integer, db.ForeignKey('venues.id', ondelete='CASCADE'), primary_key=True)
+    city = db.Column(db.String(120), nullable=False)
+    state = db.Column(db.String(120), nullable=False)
+    name = db.Column(db.String(), nullable=False)
+    num_upcoming_shows = db.Column(db.Integer, nullable=False, default=0)
+    # the count holds until this show starts; NULL when nothing is upcoming
+    next_show_at = db.Column(db.DateTime, nullable=True)
+
+    def __repr__(self):
+        return f'<VenueArea Venue_ID:{self.venue_id}, City:{self.city}, State:{self.state}>'
+
+
 class Artist(db.Model):
     __tablename__ = 'artists'
     id = db.Column(db.Integer, primary_key=True)
@@ -46,28 +102,89 @@ class Artist(db.Model):
     state = db.Column(db.String(120), nullable=False)
     phone = db.Column(db.String(120), nullable=False)
     image_link = db.Column(db.String(500), nullable=False)
-    genres = db.Column(db.String(), nullable=False)
     facebook_link = db.Column(db.String(120), nullable=True)
     website_link = db.Column(db.String(), nullable=True)
     seeking_venue = db.Column(db.Boolean, nullable=False, default=False)
     seeking_description = db.Column(db.String(), nullable=True)
     date_created = db.Column(
         db.DateTime, nullable=False, default=datetime.utcnow)
-    shows = db.relationship('Show', backref='artist',
-                            lazy=False, cascade='all, delete-orphan')
+    genres = db.relationship('Genre', secondary=artist_genres, order_by='Genre.name')
+    shows = db.relationship('Show', backref='artist', lazy='select',
+                            cascade='all, delete-orphan', passive_deletes=True)
 
     def __repr__(self):
         return f'<Artist ID:{self.id}, Name:{self.name}>'
 
 
+# a show holds its venue and artist for [start_time, start_time + duration);
+# the upper bound keeps overlap checks to a short index range (booking.py)
+DEFAULT_SHOW_MINUTES = 120
+MAX_SHOW_MINUTES = 24 * 60
+
+
 class Show(db.Model):
+    # Postgres also carries the shows_venue_no_overlap / shows_artist_no_overlap
+    # exclusion constraints, created by migration only
     __tablename__ = 'shows'
+    __table_args__ = (
+        db.Index('ix_shows_venue_id_start_time', 'venue_id', 'start_time'),
+        db.Index('ix_shows_artist_id_start_time', 'artist_id', 'start_time'),
+        db.Index('ix_shows_start_time_id', 'start_time', 'id'),
+        db.CheckConstraint(
+            'duration_minutes > 0 AND duration_minutes <= {}'.format(MAX_SHOW_MINUTES),
+            name='ck_shows_duration_minutes'),
+    )
     id = db.Column(db.Integer, primary_key=True)
     artist_id = db.Column(db.Integer, db.ForeignKey(
-        'artists.id'), nullable=False)
+        'artists.id', ondelete='CASCADE'), nullable=False)
     venue_id = db.Column(db.Integer, db.ForeignKey(
-        'venues.id'), nullable=False)
+        'venues.id', ondelete='CASCADE'), nullable=False)
     start_time = db.Column(db.DateTime, nullable=False)
+    duration_minutes = db.Column(db.Integer, nullable=False, default=DEFAULT_SHOW_MINUTES,
+                                 server_default=str(DEFAULT_SHOW_MINUTES))
+
+    def __repr__(self):
+        return f'<Show ID:{self.id} Venue_ID:{self.venue_id} Artist_ID:{self.artist_id}, start_time:{self.start_time}, duration:{self.duration_minutes}>'
+
+
+# longest Idempotency-Key accepted
+MAX_IDEMPOTENCY_KEY_LENGTH = 64
+
+
+class IdempotencyKey(db.Model):
+    # one row per show submission made with a key; a retry carrying the same
+    # key is answered from here instead of booking a second show. The row is
+    # written before the show, in the same transaction, so a concurrent retry
+    # waits on the primary key and then sees the first one.
+    __tablename__ = 'idempotency_keys'
+    key = db.Column(db.String(MAX_IDEMPOTENCY_KEY_LENGTH), primary_key=True)
+    show_id = db.Column(db.Integer, db.ForeignKey('shows.id', ondelete='CASCADE'), nullable=True)
+    created = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+
+    def __repr__(self):
+        return f'<IdempotencyKey {self.key} Show_ID:{self.show_id}>'
+
+
+class Job(db.Model):
+    # one queued unit of background work (jobs.py). The row is deleted when
+    # the job succeeds; failed jobs stay for inspection. `key` is set while a
+    # job is queued to keep a second copy of it from being queued.
+    __tablename__ = 'jobs'
+    __table_args__ = (
+        db.Index('ix_jobs_status_run_at', 'status', 'run_at'),
+    )
+    id = db.Column(db.Integer, primary_key=True)
+    kind = db.Column(db.String(64), nullable=False)
+    payload = db.Column(db.JSON, nullable=False, default=dict)
+    key = db.Column(db.String(200), nullable=True, unique=True)
+    status = db.Column(db.String(16), nullable=False, default='queued')
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False)
+    run_at = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
+    locked_at = db.Column(db.DateTime, nullable=True)
+    locked_by = db.Column(db.String(120), nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)
 
     def __repr__(self):
-        return f'<Show ID:{self.id} Venue_ID:{self.venue_id} Artist_ID:{self.artist_id}, start_time:{self.start_time}>'
+        return f'<Job ID:{self.id} Kind:{self.kind} Status:{self.status} Attempts:{self.attempts}>'
@@ -0,0 +1,59 @@
+import base64
+from datetime import datetime, timedelta
+from sqlalchemy import tuple_
+
+#----------------------------------------------------------------------------#
+# Keyset pagination helpers.
+#----------------------------------------------------------------------------#
+
+CURSOR_TIME_FORMAT = '%Y-%m-%dT%H:%M:%S.%f'
+
+
+def encode_cursor(start_time, row_id):
+    # opaque, url-safe token for the last (start_time, id) seen on a page
+    raw = '{}|{}'.format(start_time.strftime(CURSOR_TIME_FORMAT), row_id)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    # returns (start_time, id); any malformed token raises ValueError
+    padded = cursor + '=' * (-len(cursor) % 4)
+    raw = base64.urlsafe_b64decode(padded.encode()).decode()
+    start_time, row_id = raw.split('|')
+    return datetime.strptime(start_time, CURSOR_TIME_FORMAT), int(row_id)
+
+
+def parse_window_bound(value, end=False):
+    # accepts YYYY-MM-DD or a full ISO timestamp. A bare date used as the end
+    # of a window covers that whole day, so the bound moves to the next midnight.
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if end and len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed
+
+
+def parse_id(value):
+    # an optional integer id from the query string. A value that is not an
+    # integer raises ValueError rather than reading as "no filter".
+    return int(value) if value else None
+
+
+def keyset_query(query, order_columns, after, limit, descending=False):
+    # `query` narrowed to one page starting strictly after the `after` key, in
+    # `order_columns` order (the last one must be unique). One extra row is
+    # read to find out whether another page exists, so each page costs
+    # O(limit). With descending=True the page walks the same key backwards.
+    if after is not None:
+        key, bound = tuple_(*order_columns), tuple_(*after)
+        query = query.filter(key < bound if descending else key > bound)
+    if descending:
+        order_columns = [column.desc() for column in order_columns]
+    return query.order_by(*order_columns).limit(limit + 1)
+
+
+def keyset_page(query, order_columns, after, limit, descending=False):
+    # (rows, has_more) for one page of keyset_query()
+    rows = keyset_query(query, order_columns, after, limit, descending).all()
+    return rows[:limit], len(rows) > limit
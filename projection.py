@@ -0,0 +1,59 @@
+import functools
+from collections import namedtuple
+
+#----------------------------------------------------------------------------#
+# Row views.
+#
+# Read routes hand their query rows to templates as small tuple views
+# instead of building a dict per row. A view class lists the row's columns
+# in select order. project() copies each Row into one tuple, with no
+# per-row dict or key strings. Views can be read by attribute
+# (show.artist_name) and by name (show['artist_name']), so templates and
+# code written against the old dicts read them unchanged. Attribute reads
+# are also much cheaper in templates: Jinja tries getattr() before [] and a
+# dict key costs it a caught AttributeError every time. Values are kept
+# as selected. Datetimes stay datetimes until a template formats the ones
+# it prints with the `datetime` filter.
+#----------------------------------------------------------------------------#
+
+
+def row_view(name, fields):
+    # a namedtuple class whose instances also take field names as keys
+    base = namedtuple(name, fields)
+
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        return tuple.__getitem__(self, key)
+
+    return type(name, (base,), {'__slots__': (), '__getitem__': __getitem__})
+
+
+def project(view, rows):
+    # rows must carry the view's columns, in the view's order. Built with
+    # tuple.__new__ directly, so there is no Python call per row.
+    return list(map(functools.partial(tuple.__new__, view), rows))
+
+
+#  Views
+#  ----------------------------------------------------------------
+
+# /shows listing
+ShowListing = row_view('ShowListing', [
+    'id', 'venue_id', 'venue_name', 'artist_id', 'artist_name', 'artist_image_link', 'start_time'])
+
+# a venue's shows, showing the artist, and an artist's, showing the venue
+VenueShow = row_view('VenueShow', ['id', 'start_time', 'artist_id', 'artist_name', 'artist_image_link'])
+ArtistShow = row_view('ArtistShow', ['id', 'start_time', 'venue_id', 'venue_name', 'venue_image_link'])
+
+# /artists listing
+ArtistListing = row_view('ArtistListing', ['id', 'name'])
+
+# a venue under its area on /venues
+AreaVenue = row_view('AreaVenue', ['id', 'name', 'num_upcoming_shows'])
+
+# one search match
+SearchMatch = row_view('SearchMatch', ['id', 'name', 'num_upcoming_shows'])
@@ -0,0 +1,93 @@
+from datetime import datetime
+from flask import current_app
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session, with_loader_criteria
+from models import db, Venue, Show, IdempotencyKey, venue_genres
+from areas import delete_venue_areas
+from cache import cache
+from jobs import enqueue
+
+#----------------------------------------------------------------------------#
+# Venue removal.
+#
+# Removing a venue never loads its shows. delete_venue() takes the venue's
+# shows, genre links and venue_areas row out with one set-based DELETE each,
+# then the venue itself. Postgres would cascade most of that from the venue
+# (ON DELETE CASCADE), but SQLite does not enforce foreign keys, so the rows
+# are deleted explicitly everywhere.
+#
+# With VENUE_DELETE_MODE = 'archive' the venue is only stamped deleted_at,
+# which hides it from every ORM read at once (see _hide_archived_venues).
+# A purge_venue job (jobs.py) then deletes its shows VENUE_PURGE_CHUNK at a
+# time, each chunk in a short transaction of its own, before the venue row
+# goes. `flask purge-venues` does the same in the foreground.
+#----------------------------------------------------------------------------#
+
+
+def delete_venue(venue_id):
+    # returns False when there is no such venue. The caller commits.
+    _delete_shows(Show.venue_id == venue_id)
+    return _delete_venue_row(venue_id)
+
+
+def archive_venue(venue_id):
+    # hides the venue and queues its purge; returns False when there is no
+    # such (live) venue. The caller commits.
+    venue = db.session.get(Venue, venue_id)
+    if venue is None:
+        return False
+    venue.deleted_at = datetime.utcnow()
+    enqueue('purge_venue', {'venue_id': venue_id, 'chunk_size': current_app.config['VENUE_PURGE_CHUNK']},
+            key='purge_venue:{}'.format(venue_id))
+    return True
+
+
+def purge_venue(venue_id, chunk_size):
+    # deletes an archived venue's shows chunk by chunk, then the venue;
+    # each chunk commits on its own so no transaction holds many rows
+    while True:
+        show_ids = db.session.execute(
+            select(Show.id).where(Show.venue_id == venue_id).limit(chunk_size)).scalars().all()
+        if not show_ids:
+            break
+        _delete_shows(Show.id.in_(show_ids))
+        db.session.commit()
+    _delete_venue_row(venue_id)
+    db.session.commit()
+    cache.bump('venues', 'venue:{}'.format(venue_id), 'shows')
+
+
+def archived_venue_ids():
+    return db.session.execute(
+        select(Venue.id).where(Venue.deleted_at.isnot(None)).order_by(Venue.deleted_at),
+        execution_options={'include_archived': True},
+    ).scalars().all()
+
+
+def _delete_shows(condition):
+    # shows matching `condition`, with the idempotency keys that point at them
+    show_ids = select(Show.id).where(condition)
+    db.session.execute(IdempotencyKey.__table__.delete().where(IdempotencyKey.show_id.in_(show_ids)))
+    db.session.execute(Show.__table__.delete().where(condition))
+
+
+def _delete_venue_row(venue_id):
+    db.session.execute(venue_genres.delete().where(venue_genres.c.venue_id == venue_id))
+    delete_venue_areas(db.session.connection(), [venue_id])
+    deleted = db.session.execute(Venue.__table__.delete().where(Venue.id == venue_id)).rowcount == 1
+    # queued the way the ORM hooks queue a deleted instance, so the name
+    # indexes drop the venue on commit and keep it on rollback
+    db.session.info.setdefault('autocomplete_changes', []).append((Venue, venue_id, None))
+    db.session.info.setdefault('search_changes', []).append((Venue, venue_id, None))
+    return deleted
+
+
+@event.listens_for(Session, 'do_orm_execute')
+def _hide_archived_venues(execute_state):
+    # every ORM SELECT, joins included, skips archived venues unless run with
+    # execution_options(include_archived=True)
+    if (execute_state.is_select and not execute_state.is_column_load
+            and not execute_state.is_relationship_load
+            and not execute_state.execution_options.get('include_archived', False)):
+        execute_state.statement = execute_state.statement.options(
+            with_loader_criteria(Venue, lambda venue: venue.deleted_at.is_(None), include_aliases=True))
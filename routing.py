@@ -0,0 +1,102 @@
+import time
+from flask import current_app, g, has_request_context, request, session
+from flask_sqlalchemy import SQLAlchemy, SignallingSession, get_state
+from sqlalchemy import orm
+from sqlalchemy.sql.dml import UpdateBase
+
+#----------------------------------------------------------------------------#
+# Engine configuration and read-replica routing.
+#
+# Views marked @replica_reads send their queries to the 'replica' bind when
+# SQLALCHEMY_BINDS defines one. Everything else goes to the primary: flushes,
+# INSERT/UPDATE/DELETE statements, CLI commands and unmarked views. Once a
+# request writes, its later reads use the primary too. The client that wrote
+# then keeps reading from the primary for REPLICA_STICKY_SECONDS, so it sees
+# its own changes even when the replica lags.
+#----------------------------------------------------------------------------#
+
+REPLICA = 'replica'
+
+# pool sizing only applies to real connection pools; SQLite runs on NullPool
+POOL_SIZING_OPTIONS = ('pool_size', 'max_overflow', 'pool_timeout')
+
+
+def replica_reads(view):
+    # marks a view whose queries are safe to serve from the replica
+    view.replica_reads = True
+    return view
+
+
+class RoutingSession(SignallingSession):
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self._flushing or isinstance(clause, UpdateBase):
+            if has_request_context():
+                g.db_wrote = True
+        elif get_state(self.app).db.read_bind() == REPLICA:
+            return get_state(self.app).db.get_engine(self.app, bind=REPLICA)
+        return super().get_bind(mapper, clause)
+
+
+class RoutingSQLAlchemy(SQLAlchemy):
+
+    def init_app(self, app):
+        super().init_app(app)
+        app.config.setdefault('REPLICA_STICKY_SECONDS', 5)
+        app.config.setdefault('DB_STATEMENT_TIMEOUT_MS', 0)
+        app.before_request(_choose_engine)
+        app.after_request(_stick_to_primary)
+
+    def create_session(self, options):
+        return orm.sessionmaker(class_=RoutingSession, db=self, **options)
+
+    def create_engine(self, sa_url, engine_opts):
+        return super().create_engine(sa_url, engine_options(sa_url, engine_opts, self.get_app().config))
+
+    def read_bind(self):
+        return read_bind()
+
+
+def read_bind():
+    # the bind this request's reads go to: 'replica' or None (primary)
+    return REPLICA if has_request_context() and g.get('use_replica') and not g.get('db_wrote') else None
+
+
+def sticks_to_primary():
+    # a replica is configured and this request, or its client within
+    # REPLICA_STICKY_SECONDS, wrote; shared caches may be behind for it
+    return REPLICA in (current_app.config.get('SQLALCHEMY_BINDS') or {}) and bool(
+        g.get('db_wrote') or session.get('primary_until', 0) >= time.time())
+
+
+def engine_options(sa_url, options, config):
+    # SQLALCHEMY_ENGINE_OPTIONS adjusted for the driver behind `sa_url`
+    options = dict(options)
+    if sa_url.get_backend_name() == 'sqlite':
+        for name in POOL_SIZING_OPTIONS:
+            options.pop(name, None)
+    elif sa_url.get_backend_name() == 'postgresql' and config.get('DB_STATEMENT_TIMEOUT_MS'):
+        timeout = int(config['DB_STATEMENT_TIMEOUT_MS'])
+        connect_args = dict(options.get('connect_args', {}))
+        if sa_url.get_driver_name() == 'asyncpg':
+            connect_args['server_settings'] = dict(connect_args.get('server_settings', {}), statement_timeout=str(timeout))
+        else:
+            connect_args['options'] = '{} -c statement_timeout={}'.format(
+                connect_args.get('options', ''), timeout).strip()
+        options['connect_args'] = connect_args
+    return options
+
+
+def _choose_engine():
+    view = current_app.view_functions.get(request.endpoint)
+    g.use_replica = (
+        REPLICA in (current_app.config.get('SQLALCHEMY_BINDS') or {})
+        and getattr(view, 'replica_reads', False)
+        and session.get('primary_until', 0) < time.time()
+    )
+
+
+def _stick_to_primary(response):
+    if g.get('db_wrote'):
+        session['primary_until'] = time.time() + current_app.config['REPLICA_STICKY_SECONDS']
+    return response
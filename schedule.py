@@ -0,0 +1,54 @@
+from datetime import datetime
+from models import db, Venue, Artist, Show
+from aggregates import SHOW_FOREIGN_KEYS
+from pagination import encode_cursor, keyset_query
+from projection import ArtistShow, VenueShow, project
+
+#----------------------------------------------------------------------------#
+# Venue / Artist show listings.
+#
+# Detail pages list upcoming shows soonest first and past shows latest first.
+# Each section is its own keyset-paginated query on the (venue_id, start_time)
+# or (artist_id, start_time) index, so a page costs the same whether the
+# entity has ten shows or ten thousand.
+#----------------------------------------------------------------------------#
+
+# for each entity, the one on the other side of its shows and its key prefix
+COUNTERPARTS = {
+    Venue: (Artist, 'artist'),
+    Artist: (Venue, 'venue'),
+}
+
+# the view of an entity's shows; its columns are show_page_query()'s
+SHOW_VIEWS = {
+    Venue: VenueShow,
+    Artist: ArtistShow,
+}
+
+
+def show_page_query(model, entity_id, past, limit, after=None):
+    # one page (plus one row) of upcoming shows, soonest first, or past shows,
+    # latest first
+    other, prefix = COUNTERPARTS[model]
+    now = datetime.now()
+    query = db.session.query(
+        Show.id, Show.start_time,
+        other.id.label(prefix + '_id'),
+        other.name.label(prefix + '_name'),
+        other.image_link.label(prefix + '_image_link'),
+    ).join(other, other.id == SHOW_FOREIGN_KEYS[other]).filter(SHOW_FOREIGN_KEYS[model] == entity_id)
+    query = query.filter(Show.start_time <= now if past else Show.start_time > now)
+    return keyset_query(query, (Show.start_time, Show.id), after, limit, descending=past)
+
+
+def show_page_result(model, rows, limit):
+    # (shows, cursor for the next page or None) from show_page_query() rows;
+    # every show is a VenueShow or ArtistShow view (projection.py)
+    page = rows[:limit]
+    shows = project(SHOW_VIEWS[model], page)
+    return shows, encode_cursor(page[-1].start_time, page[-1].id) if len(rows) > limit else None
+
+
+def show_page(model, entity_id, past, limit, after=None):
+    rows = show_page_query(model, entity_id, past, limit, after).all()
+    return show_page_result(model, rows, limit)
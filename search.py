@@ -0,0 +1,270 @@
+import re
+import threading
+from sqlalchemy import event, func, literal_column, or_
+from sqlalchemy.orm import Session
+from models import db, Venue, Artist, Genre
+from aggregates import show_counts_for
+from genres import GENRE_LINKS, entities_with_genre
+from projection import SearchMatch
+
+#----------------------------------------------------------------------------#
+# Venue / Artist search.
+#
+# On Postgres the search runs against the GIN indexes created in migrations
+# 6d2f1b7c4a90 and e5b80c1f3a27: a tsvector over name, city and state plus a
+# trigram index on name for substring and fuzzy matches. A term that names a
+# genre also matches through the genre link tables. Any other database (the
+# SQLite used for tests and benchmarks) falls back to an in-process index
+# with the same matching and ranking rules.
+#----------------------------------------------------------------------------#
+
+SEARCH_CONFIG = literal_column("'simple'::regconfig")
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def search_document(model):
+    # must stay identical to the indexed expression in the migration
+    return func.to_tsvector(
+        SEARCH_CONFIG,
+        model.name + ' ' + model.city + ' ' + model.state)
+
+
+def search(model, term, page=1, per_page=20):
+    # returns {"count": total matches, "data": [SearchMatch]}
+    term = (term or '').strip()
+    page = max(page, 1)
+
+    if db.engine.dialect.name == 'postgresql':
+        total, rows = _search_postgres(model, term, page, per_page)
+    else:
+        total, rows = fallback_index(model).search(term, (page - 1) * per_page, per_page)
+
+    counts = show_counts_for(model, [row_id for row_id, _ in rows])
+    return {
+        "count": total,
+        "page": page,
+        "pages": -(-total // per_page),
+        "data": [SearchMatch(row_id, name, counts.get(row_id, (0, 0))[0]) for row_id, name in rows]
+    }
+
+
+def _search_postgres(model, term, page, per_page):
+    query = db.session.query(model.id, model.name)
+
+    if term:
+        tsquery = func.plainto_tsquery(SEARCH_CONFIG, term)
+        document = search_document(model)
+        query = query.filter(or_(
+            document.op('@@')(tsquery),
+            model.name.ilike('%' + _escape_like(term) + '%', escape='\\'),
+            model.name.op('%')(term),
+            model.id.in_(entities_with_genre(model, term)),
+        ))
+        rank = func.ts_rank(document, tsquery) + func.similarity(model.name, term)
+        ordering = (rank.desc(), model.id)
+    else:
+        ordering = (model.name, model.id)
+
+    total = query.order_by(None).count()
+    rows = query.order_by(*ordering).offset((page - 1) * per_page).limit(per_page).all()
+    return total, [tuple(row) for row in rows]
+
+
+def _escape_like(term):
+    return term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+#----------------------------------------------------------------------------#
+# In-process fallback index.
+#----------------------------------------------------------------------------#
+
+
+def tokenize(text):
+    return TOKEN_RE.findall(text.lower())
+
+
+def trigrams(text):
+    # same padding rules as pg_trgm: each word gets two leading and one trailing space
+    grams = set()
+    for word in tokenize(text):
+        padded = '  ' + word + ' '
+        grams.update(padded[i:i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+def similarity(left, right):
+    if not left or not right:
+        return 0.0
+    return len(left & right) / len(left | right)
+
+
+class SearchIndex:
+    # token and trigram postings for one model, kept in sync with committed writes
+
+    SIMILARITY_THRESHOLD = 0.3
+
+    def __init__(self, model):
+        self.model = model
+        self.lock = threading.Lock()
+        self.loaded = False
+        self.names = {}
+        self.documents = {}
+        self.name_grams = {}
+        self.tokens = {}
+        self.grams = {}
+        self.entity_genres = {}
+        self.genres = {}
+
+    def load(self):
+        with self.lock:
+            if self.loaded:
+                return
+            link = GENRE_LINKS[self.model]
+            genres = {}
+            for row_id, genre in db.session.query(link, Genre.name).join(
+                    Genre, Genre.id == link.table.c.genre_id):
+                genres.setdefault(row_id, []).append(genre)
+
+            rows = db.session.query(
+                self.model.id, self.model.name, self.model.city, self.model.state).all()
+            for row in rows:
+                self._add(*row, genres.get(row.id, []))
+            self.loaded = True
+
+    def apply(self, changes):
+        # changes: iterable of (id, document tuple or None for a delete). A
+        # document's genres are None when they were not touched by the write.
+        with self.lock:
+            if not self.loaded:
+                return
+            for row_id, document in changes:
+                genres = self.entity_genres.get(row_id, ())
+                self._remove(row_id)
+                if document is not None:
+                    name, city, state, new_genres = document
+                    self._add(row_id, name, city, state,
+                              genres if new_genres is None else new_genres)
+
+    def _add(self, row_id, name, city, state, genres):
+        tokens = set(tokenize(' '.join((name, city, state))))
+        grams = trigrams(name)
+        self.names[row_id] = name
+        self.documents[row_id] = tokens
+        self.name_grams[row_id] = grams
+        self.entity_genres[row_id] = {genre.lower() for genre in genres}
+        for token in tokens:
+            self.tokens.setdefault(token, set()).add(row_id)
+        for gram in grams:
+            self.grams.setdefault(gram, set()).add(row_id)
+        for genre in self.entity_genres[row_id]:
+            self.genres.setdefault(genre, set()).add(row_id)
+
+    def _remove(self, row_id):
+        if row_id not in self.names:
+            return
+        for token in self.documents.pop(row_id):
+            self.tokens[token].discard(row_id)
+        for gram in self.name_grams.pop(row_id):
+            self.grams[gram].discard(row_id)
+        for genre in self.entity_genres.pop(row_id):
+            self.genres[genre].discard(row_id)
+        del self.names[row_id]
+
+    def search(self, term, offset, limit):
+        self.load()
+        with self.lock:
+            if not term:
+                ordered = sorted(self.names, key=lambda row_id: (self.names[row_id], row_id))
+            else:
+                ranked = self._rank(term)
+                ordered = sorted(ranked, key=lambda row_id: (-ranked[row_id], row_id))
+            page = ordered[offset:offset + limit]
+            return len(ordered), [(row_id, self.names[row_id]) for row_id in page]
+
+    def _rank(self, term):
+        query_tokens = set(tokenize(term))
+        query_grams = trigrams(term)
+        needle = term.lower()
+
+        # full-text matches: every query token present in the document
+        candidates = set()
+        if query_tokens:
+            postings = [self.tokens.get(token, set()) for token in query_tokens]
+            candidates = set.intersection(*postings)
+
+        # name matches: only ids sharing a trigram with the term need checking,
+        # except for terms too short to produce an inner trigram
+        if len(needle) < 3:
+            candidates.update(self.names)
+        for gram in query_grams:
+            candidates.update(self.grams.get(gram, ()))
+
+        # genre matches: the whole term names one of the entity's genres
+        genre_matches = self.genres.get(needle, set())
+        candidates.update(genre_matches)
+
+        ranked = {}
+        for row_id in candidates:
+            document = self.documents[row_id]
+            score = similarity(self.name_grams[row_id], query_grams)
+            full_text = query_tokens and query_tokens <= document
+            if full_text:
+                score += len(query_tokens) / len(document)
+            if full_text or row_id in genre_matches or needle in self.names[row_id].lower() \
+                    or score >= self.SIMILARITY_THRESHOLD:
+                ranked[row_id] = score
+        return ranked
+
+
+_indexes = {}
+_indexes_lock = threading.Lock()
+
+
+def fallback_index(model):
+    # one index per (database, model); built on first use
+    key = (str(db.engine.url), model)
+    with _indexes_lock:
+        if key not in _indexes:
+            _indexes[key] = SearchIndex(model)
+        return _indexes[key]
+
+
+def reset_fallback_index(model):
+    # for writes that bypass the ORM (bulk imports); rebuilt on the next search
+    with _indexes_lock:
+        for key in [key for key in _indexes if key[1] is model]:
+            del _indexes[key]
+
+
+@event.listens_for(Session, 'after_flush')
+def _collect_search_changes(session, flush_context):
+    pending = session.info.setdefault('search_changes', [])
+    for instance in session.new.union(session.dirty):
+        if getattr(instance, 'deleted_at', None):
+            # an archived venue leaves the index as if deleted
+            pending.append((type(instance), instance.id, None))
+        elif isinstance(instance, (Venue, Artist)):
+            genres = instance.__dict__.get('genres')
+            pending.append((type(instance), instance.id, (
+                instance.name, instance.city, instance.state,
+                None if genres is None else [genre.name for genre in genres])))
+    for instance in session.deleted:
+        if isinstance(instance, (Venue, Artist)):
+            pending.append((type(instance), instance.id, None))
+
+
+@event.listens_for(Session, 'after_commit')
+def _apply_search_changes(session):
+    pending = session.info.pop('search_changes', None)
+    if not pending or not _indexes:
+        return
+    url = str(session.get_bind().url)
+    for model in (Venue, Artist):
+        index = _indexes.get((url, model))
+        if index is not None:
+            index.apply((row_id, document) for changed, row_id, document in pending
+                        if changed is model)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_search_changes(session):
+    session.info.pop('search_changes', None)
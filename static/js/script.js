@@ -2,3 +2,33 @@ window.parseISOString = function parseISOString(s) {
   var b = s.split(/\D+/);
   return new Date(Date.UTC(b[0], --b[1], b[2], b[3], b[4], b[5], b[6]));
 };
+
+// Inputs marked data-autocomplete="venues" or "artists" take an id; typing a
+// name offers the matching ids from /autocomplete as <datalist> options.
+document.querySelectorAll('input[data-autocomplete]').forEach(function (input) {
+  var kind = input.getAttribute('data-autocomplete');
+  var list = document.createElement('datalist');
+  var latest = 0;
+  list.id = input.id + '-suggestions';
+  input.setAttribute('list', list.id);
+  input.parentNode.appendChild(list);
+
+  input.addEventListener('input', function () {
+    var term = input.value;
+    if (!term || /^\d+$/.test(term)) return;
+    var request = ++latest;
+    fetch('/autocomplete?type=' + kind + '&q=' + encodeURIComponent(term))
+      .then(function (response) { return response.json(); })
+      .then(function (data) {
+        // answers can arrive out of order; only the newest one is shown
+        if (request !== latest) return;
+        list.innerHTML = '';
+        data[kind].forEach(function (match) {
+          var option = document.createElement('option');
+          option.value = match.id;
+          option.label = match.name;
+          list.appendChild(option);
+        });
+      });
+  });
+});
@@ -0,0 +1,128 @@
+import threading
+import pytest
+from sqlalchemy import event
+
+#----------------------------------------------------------------------------#
+# Query budgets.
+#
+# Seeds a small SQLite database with the benchmark's generator and requests
+# each read route twice. The second request, once indexes and lazy caches are
+# warm, must stay within the route's budget of SQL statements and of rows
+# fetched. A change that brings back eager loading or an N+1 shows up here
+# as a failed budget.
+#
+# Statements are counted with an after_cursor_execute listener. SQLite
+# reports no rowcount for SELECTs, so rows are counted as the driver builds
+# them, through the cursor's row_factory (wrapping the one the query
+# profiler sets). Only the request's own thread
+# is counted, not the autocomplete index rebuilding in the background.
+# The page cache is off, so every request reaches the database.
+#
+#   python -m pytest test_query_budgets.py
+#----------------------------------------------------------------------------#
+
+VENUES = 30
+ARTISTS = 60
+SHOWS = 400
+
+# route -> (statements, rows)
+BUDGETS = {
+    '/': (0, 0),
+    '/venues': (1, VENUES),
+    '/venues?genre=Jazz': (1, 3),
+    '/venues/{venue}': (6, 30),
+    '/venues/{venue}/past-shows': (3, 15),
+    '/venues/{venue}/edit': (2, 2),
+    '/artists': (1, ARTISTS),
+    '/artists/{artist}': (6, 30),
+    '/artists/{artist}/past-shows': (3, 15),
+    '/artists/{artist}/edit': (2, 2),
+    '/shows': (1, 31),
+    '/shows?venue_id={venue}': (1, 31),
+    '/autocomplete?q=th': (0, 0),
+    '/api/v1/venues': (3, 112),
+    '/api/v1/artists/{artist}': (3, 3),
+    '/api/v1/shows': (1, 31),
+}
+
+SEARCH_BUDGETS = {
+    '/venues/search': (1, 20),
+    '/artists/search': (1, 20),
+}
+
+
+class QueryCounter:
+
+    def __init__(self):
+        self.thread = threading.get_ident()
+        self.statements = 0
+        self.rows = 0
+
+    def reset(self):
+        self.statements = 0
+        self.rows = 0
+
+    def after_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() == self.thread:
+            self.statements += 1
+
+    def before_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if threading.get_ident() != self.thread:
+            return
+        inner = cursor.row_factory
+
+        def count_row(cursor, row):
+            self.rows += 1
+            return row if inner is None else inner(cursor, row)
+        cursor.row_factory = count_row
+
+
+@pytest.fixture(scope='module')
+def seeded(tmp_path_factory):
+    from app import create_app
+    from models import db
+    from benchmark import generate_data
+
+    app = create_app(settings={
+        'SQLALCHEMY_DATABASE_URI': 'sqlite:///{}'.format(tmp_path_factory.mktemp('budgets') / 'fyyur.db'),
+        'WTF_CSRF_ENABLED': False,
+        'CACHE_ENABLED': False,
+    })
+    counter = QueryCounter()
+    with app.app_context():
+        db.create_all()
+        venue_ids, artist_ids = generate_data(VENUES, ARTISTS, SHOWS)
+        db.session.remove()
+        event.listen(db.engine, 'before_cursor_execute', counter.before_execute)
+        event.listen(db.engine, 'after_cursor_execute', counter.after_execute)
+    yield app, counter, {'venue': venue_ids[0], 'artist': artist_ids[0]}
+    with app.app_context():
+        event.remove(db.engine, 'before_cursor_execute', counter.before_execute)
+        event.remove(db.engine, 'after_cursor_execute', counter.after_execute)
+
+
+def measure(seeded, method, url, data=None):
+    app, counter, _ = seeded
+    client = app.test_client()
+    # the first request warms the search index and the lookup caches
+    for _ in range(2):
+        counter.reset()
+        response = client.open(url, method=method, data=data)
+        assert response.status_code == 200, url
+    return counter.statements, counter.rows
+
+
+@pytest.mark.parametrize('route', sorted(BUDGETS))
+def test_read_route_budget(seeded, route):
+    statements, rows = measure(seeded, 'GET', route.format(**seeded[2]))
+    max_statements, max_rows = BUDGETS[route]
+    assert statements <= max_statements, '{} ran {} statements'.format(route, statements)
+    assert rows <= max_rows, '{} fetched {} rows'.format(route, rows)
+
+
+@pytest.mark.parametrize('route', sorted(SEARCH_BUDGETS))
+def test_search_budget(seeded, route):
+    statements, rows = measure(seeded, 'POST', route, {'search_term': 'the'})
+    max_statements, max_rows = SEARCH_BUDGETS[route]
+    assert statements <= max_statements, '{} ran {} statements'.format(route, statements)
+    assert rows <= max_rows, '{} fetched {} rows'.format(route, rows)